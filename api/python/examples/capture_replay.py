@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+"""
+Simple example demonstrating usb traffic capture and replay. A short
+session is captured from a device to a traffic log. The same session
+is then replayed, without the device, from the log and the replies
+compared.
+"""
+import sys
+from simple_step import Simple_Step
+from simple_step.traffic import Replay_Transport, Traffic_Log
+
+filename = 'session.sstraf'
+
+def session(dev):
+    dev.set_pos_setpt(0)
+    dev.set_mode('position')
+    dev.set_status('running')
+    values = []
+    for i in range(10):
+        values.append((dev.get_pos(), dev.get_vel()))
+    dev.set_status('stopped')
+    return values
+
+if len(sys.argv) < 2 or sys.argv[1] != 'replay':
+    dev = Simple_Step(capture=filename)
+    print session(dev)
+    dev.close()
+    Traffic_Log(filename).print_records(10)
+else:
+    transport = Replay_Transport(filename, strict=True)
+    dev = Simple_Step(transport=transport)
+    print session(dev)
+    dev.close()
+    print 'mismatches:', transport.mismatches
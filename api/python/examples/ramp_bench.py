@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+"""
+Benchmarks the fidelity of the soft ramp helpers for a range of ramp 
+update time steps, against hardware or a simulated device.
+
+usage: ramp_bench.py [--sim] [--latency=sec] [--dt=dt0,dt1,...] [--repeat=n]
+"""
+import optparse
+from simple_step import Simple_Step
+from simple_step.sim_step import Sim_Step
+from simple_step import ramp_bench
+
+parser = optparse.OptionParser()
+parser.add_option('--sim', action='store_true', dest='sim', default=False,
+                  help='use simulated device')
+parser.add_option('--latency', type='float', dest='latency', default=0.001,
+                  help='simulated usb round trip time (sec)')
+parser.add_option('--dt', dest='dt', default='0.2,0.1,0.05,0.02,0.01',
+                  help='comma separated ramp update time steps (sec)')
+parser.add_option('--repeat', type='int', dest='repeat', default=3,
+                  help='number of runs of each benchmark')
+options, args = parser.parse_args()
+
+if options.sim:
+    dev = Sim_Step(latency=options.latency)
+else:
+    # Threaded - the device is sampled from a second thread
+    dev = Simple_Step(threaded=True)
+
+dt_list = [float(x) for x in options.dt.split(',')]
+results = ramp_bench.run_benchmark(dev, dt_list=dt_list, repeat=options.repeat, verbose=True)
+print
+ramp_bench.print_report(results)
+dev.close()
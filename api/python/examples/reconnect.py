@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+"""
+Simple example demonstrating automatic reconnect. The motor is moved
+back and forth while the position is printed. Unplugging and plugging
+the device back in, or resetting it, interrupts the loop only briefly:
+the device is reopened and its mode, positioning velocity and set-point
+are restored. The device status is not restored, so the example
+restarts the device after a reconnect.
+"""
+import time
+from simple_step import Simple_Step
+
+def on_reconnect(event):
+    print 'reconnected after %1.3f sec, %d attempts (%s)'%(event['downtime'], event['attempts'], event['error'])
+    dev.start()
+
+dev = Simple_Step()
+dev.set_reconnect(True, timeout=30.0)
+dev.on('reconnect', on_reconnect)
+
+dev.set_mode('position')
+dev.set_pos_vel(2000)
+dev.start()
+try:
+    for i in range(20):
+        dev.set_pos_setpt(2000*(i%2))
+        t_end = time.time() + 1.5
+        while time.time() < t_end:
+            print 'position:', dev.get_pos()
+            time.sleep(0.1)
+finally:
+    dev.stop()
+    dev.close()
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+"""
+Simple example demonstrating recording motor position and velocity to
+disk and reading back part of the recording. Requires numpy.
+"""
+import time
+from simple_step import Simple_Step
+from simple_step.recorder import Recorder, Recording
+
+dev = Simple_Step(threaded=True)
+dev.set_zero_pos(0)
+
+# Record at 100Hz while moving
+recorder = Recorder([dev], 'record_data', rate=100.0)
+recorder.start()
+t_move = time.time()
+dev.move_to_pos(2000)
+recorder.stop()
+print recorder.get_stats()
+
+# Read back the samples recorded during the move
+recording = Recording('record_data')
+t = recording.get('t', t_start=t_move)
+pos = recording.get('pos_0', t_start=t_move)
+print 'samples:', len(recording)
+print 'final position:', pos[-1], 'at t =', t[-1] - t_move
+
+dev.close()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+"""
+Simple example demonstrating an on-device motion program. The device
+steps the motor out in 10 moves, pulsing DIO pin 0 after each, and
+then returns to zero. The timing of the sequence is set by the device
+not the host.
+"""
+from simple_step import Simple_Step
+from simple_step.motion_program import disassemble
+
+program = [
+    ('set_vel', 2000),
+    ('loop', 10, [
+        ('move_rel', 200),
+        ('wait_done',),
+        ('dio_set', 0x01, 0x01),
+        ('wait_us', 500),
+        ('dio_set', 0x00, 0x01),
+        ('wait_us', 100000),
+        ]),
+    ('move', 0),
+    ('wait_done',),
+    ]
+
+dev = Simple_Step()
+dev.set_zero_pos(0)
+code = dev.load_program(program)
+print disassemble(code)
+print 'program state:', dev.run_program(wait=True)
+print 'position:', dev.get_pos()
+dev.close()
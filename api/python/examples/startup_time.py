@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Measures the start up time of short lived scripts: the time to import
+simple_step and the time to open a device with and without lazy_limits.
+Each measurement is made in a fresh interpreter. Also checks that the
+modules which are imported on first use are not imported by the package,
+and exits with status 1 if they are. The check is also run by the 
+package tests (python setup.py test).
+
+usage: startup_time.py [--repeat=n] [--no-device]
+"""
+import sys
+import optparse
+import subprocess
+
+LAZY_MODULES = ('pylibusb', 'optparse', 'json', 'random', 'tempfile',
+                'simple_step.cmd_line', 'simple_step.traffic', 'simple_step.stress',
+                'simple_step.motion_program')
+
+IMPORT_SRC = """
+import sys, time
+t0 = time.time()
+import simple_step
+t1 = time.time()
+print (t1 - t0)*1.0e3
+print ' '.join([m for m in %s if sys.modules.get(m) is not None])
+"""%(repr(LAZY_MODULES),)
+
+OPEN_SRC = """
+import time
+import simple_step
+t0 = time.time()
+dev = simple_step.Simple_Step(lazy_limits=%s)
+t1 = time.time()
+dev.close()
+print (t1 - t0)*1.0e3
+"""
+
+def run(src):
+    """
+    Runs source in a fresh interpreter and returns its output lines.
+    """
+    output = subprocess.Popen([sys.executable, '-c', src], stdout=subprocess.PIPE).communicate()[0]
+    return output.splitlines()
+
+def print_times(name, times):
+    times.sort()
+    print '%-24s min %7.2f  median %7.2f  max %7.2f (ms)'%(name, times[0], times[len(times)/2], times[-1])
+
+parser = optparse.OptionParser()
+parser.add_option('--repeat', type='int', dest='repeat', default=10,
+                  help='number of measurements')
+parser.add_option('--no-device', action='store_false', dest='device', default=True,
+                  help='only measure import time')
+options, args = parser.parse_args()
+
+import_times = []
+for i in range(options.repeat):
+    lines = run(IMPORT_SRC)
+    import_times.append(float(lines[0]))
+    loaded = lines[1:] and lines[1].split() or []
+print_times('import simple_step', import_times)
+if loaded:
+    print 'ERROR: imported by the package:', ' '.join(loaded)
+
+if options.device:
+    for lazy_limits in (False, True):
+        open_times = [float(run(OPEN_SRC%(lazy_limits,))[0]) for i in range(options.repeat)]
+        print_times('open lazy_limits=%s'%(lazy_limits,), open_times)
+
+if loaded:
+    sys.exit(1)
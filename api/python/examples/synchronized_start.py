@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+"""
+Simple example demonstrating a synchronized start of two devices. DIO
+pin 0 of device A must be wired to the trigger inputs of both devices.
+"""
+from simple_step import Simple_Step_Pool
+
+pool = Simple_Step_Pool(['0.0.A', '0.0.B'])
+
+# Stage moves
+for dev in pool:
+    dev.stop()
+    dev.set_mode('velocity')
+    dev.set_dir_setpt('positive', io_update=False)
+    dev.set_vel_setpt(1000)
+
+# Start both devices on the same trigger edge
+pool.arm_and_fire(master='0.0.A', pin=0)
+
+for dev in pool:
+    dev.print_values()
+    print
+
+# Close devices
+pool.close()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+"""
+Compares the usb command round trip time of the libusb and usbfs
+transports. The usbfs transport needs read/write access to the device
+node under /dev/bus/usb.
+
+usage: transport_latency.py [--num=n] [--serial_number=sn]
+"""
+import time
+import optparse
+from simple_step import Simple_Step
+
+parser = optparse.OptionParser()
+parser.add_option('--num', type='int', dest='num', default=2000,
+                  help='number of commands')
+parser.add_option('--serial_number', dest='serial_number', default=None,
+                  help='device serial number')
+options, args = parser.parse_args()
+
+for transport in (None, 'usbfs'):
+    dev = Simple_Step(serial_number=options.serial_number, transport=transport)
+    dt_list = []
+    for i in range(options.num):
+        t0 = time.time()
+        dev.get_pos()
+        dt_list.append(time.time() - t0)
+    dev.close()
+    dt_list.sort()
+    n = len(dt_list)
+    print '%-8s median %7.1f  99%% %7.1f  max %7.1f (us)'%(transport or 'libusb',
+        1.0e6*dt_list[n/2], 1.0e6*dt_list[int(0.99*n)], 1.0e6*dt_list[-1])
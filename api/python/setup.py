@@ -34,7 +34,8 @@ setup(name='simple_step',
       description = 'provides an interface to the simpke_step at90usb stepper motor controller',
       author = 'William Dickson',
       author_email = 'wbd@caltech.edi',
-      packages=find_packages(),
+      packages=find_packages(exclude=['tests']),
+      test_suite = 'tests',
       entry_points = {'console_scripts': ['simple-step = simple_step:cmd_line_main',]}
       )
       
@@ -24,4 +24,14 @@ License along with Foobar.  If not, see
 <http://www.gnu.org/licenses/>.
 """
 from simple_step import *
-from cmd_line import cmd_line_main
+from pool import Simple_Step_Pool
+from clock_sync import Clock_Sync
+from state_mirror import State_Publisher, State_Reader
+
+def cmd_line_main():
+    """
+    Entry point for the simple-step command. The command line module is
+    imported here, rather than with the package, to keep imports fast.
+    """
+    from cmd_line import cmd_line_main
+    cmd_line_main()
@@ -0,0 +1,209 @@
+"""
+-----------------------------------------------------------------------
+simple_step
+Copyright (C) William Dickson, 2008.
+
+wbd@caltech.edu
+www.willdickson.com
+
+Released under the LGPL Licence, Version 3
+
+This file is part of simple_step.
+
+simple_step is free software: you can redistribute it and/or modify it
+under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+simple_step is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with simple_step.  If not, see
+<http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------------------
+
+Purpose: Provides host-device clock synchronization for the at90usb
+based stepper motor controller. The offset and drift of the device
+clock relative to the host clock are estimated from round trip clock
+queries so that device time stamps can be placed on the host timeline.
+
+Author: William Dickson
+
+------------------------------------------------------------------------
+"""
+import time
+from simple_step import DEVICE_CLOCK_FREQ
+
+# Wrap around values for device clock and reply time stamps (usec)
+CLOCK_WRAP = 2**32
+STAMP_WRAP = 2**16
+
+# Default number of samples used in the fit
+DEFAULT_WINDOW = 50
+
+class Clock_Sync:
+
+    """
+    Host-device clock synchronization. The device clock, in seconds, is
+    modeled as t_dev = offset + rate*t_host and the model parameters are
+    found by a least squares fit to round trip clock queries. Queries with
+    long round trip times are rejected.
+    """
+
+    def __init__(self,dev,window=DEFAULT_WINDOW):
+        """
+        Initialize clock synchronization for device.
+
+        Arguments:
+          dev = Simple_Step device
+
+        Keywords:
+          window = maximum number of samples used in the fit
+
+        Return: None
+        """
+        self.dev = dev
+        self.window = window
+        self.samples = []
+        self.offset = None
+        self.rate = 1.0
+        self.last_clock = None
+        self.clock_wraps = 0
+
+    def sync(self,num=20):
+        """
+        Perform a number of round trip clock queries and update the
+        clock model.
+
+        Keywords:
+          num = number of round trip queries
+
+        Return: (offset, rate)
+        """
+        for i in range(num):
+            self.update()
+        return self.offset, self.rate
+
+    def update(self):
+        """
+        Perform a single round trip clock query and update the clock
+        model. Should be called periodically, and at least once every
+        device clock wrap around (71.6 minutes), to track drift.
+
+        Arguments: None
+
+        Return: round trip time (sec) of the query.
+        """
+        t0 = time.time()
+        clock = self.dev.get_clock()
+        t1 = time.time()
+
+        # Unwrap 32 bit device clock
+        if self.last_clock is not None and clock < self.last_clock:
+            self.clock_wraps += 1
+        self.last_clock = clock
+        t_dev = (clock + self.clock_wraps*CLOCK_WRAP)/DEVICE_CLOCK_FREQ
+
+        # Device clock read at midpoint of round trip (on average)
+        rtt = t1 - t0
+        self.samples.append((0.5*(t0 + t1), t_dev, rtt))
+        if len(self.samples) > self.window:
+            self.samples.pop(0)
+        self.__fit()
+        return rtt
+
+    def __fit(self):
+        """
+        Least squares fit of the clock model to the samples with round
+        trip times less than or equal to the median round trip time.
+        """
+        rtt_list = sorted([rtt for t_host, t_dev, rtt in self.samples])
+        rtt_med = rtt_list[len(rtt_list)/2]
+        pts = [(t_host,t_dev) for t_host, t_dev, rtt in self.samples if rtt <= rtt_med]
+
+        # Use first point as origin to avoid loss of precision
+        h0, d0 = pts[0]
+        n = float(len(pts))
+        mean_h = sum([h-h0 for h,d in pts])/n
+        mean_d = sum([d-d0 for h,d in pts])/n
+        var_h = sum([(h-h0-mean_h)**2 for h,d in pts])
+        cov_hd = sum([(h-h0-mean_h)*(d-d0-mean_d) for h,d in pts])
+
+        # Need some time base before drift can be estimated
+        if var_h > 0.0:
+            self.rate = cov_hd/var_h
+        else:
+            self.rate = 1.0
+        self.offset = (d0 + mean_d) - self.rate*(h0 + mean_h)
+        return
+
+    def host_to_device(self,t_host):
+        """
+        Convert host time to device time.
+
+        Arguments:
+          t_host = host time (sec)
+
+        Return: device time (sec)
+        """
+        self.__check_synced()
+        return self.offset + self.rate*t_host
+
+    def device_to_host(self,t_dev):
+        """
+        Convert device time to host time.
+
+        Arguments:
+          t_dev = device time (sec)
+
+        Return: host time (sec)
+        """
+        self.__check_synced()
+        return (t_dev - self.offset)/self.rate
+
+    def stamp_to_host(self,stamp,t_host):
+        """
+        Convert a 16 bit reply time stamp to host time. The stamp is
+        unwrapped using the device time predicted at host time t_host,
+        which must be within 32ms of the time the stamp was taken.
+
+        Arguments:
+          stamp  = reply time stamp (usec, modulo 2**16)
+          t_host = approximate host time of the stamp (sec)
+
+        Return: host time (sec)
+        """
+        t_pred = self.host_to_device(t_host)*DEVICE_CLOCK_FREQ
+        base = int(t_pred) - (int(t_pred) % STAMP_WRAP)
+        t_dev = base + stamp
+        if t_dev - t_pred > STAMP_WRAP/2:
+            t_dev -= STAMP_WRAP
+        elif t_pred - t_dev > STAMP_WRAP/2:
+            t_dev += STAMP_WRAP
+        return self.device_to_host(t_dev/DEVICE_CLOCK_FREQ)
+
+    def get_stamped(self,method,*args,**kwargs):
+        """
+        Calls a device method, e.g. get_pos or get_vel, and returns the
+        value along with the time, on the host timeline, at which the
+        device processed the command.
+
+        Arguments:
+          method = bound method of the device
+
+        Return: (value, t)
+                 value = value returned by method
+                 t     = host time of sample (sec)
+        """
+        value = method(*args,**kwargs)
+        stamp, t_send, t_recv = self.dev.get_last_stamp()
+        t = self.stamp_to_host(stamp, 0.5*(t_send + t_recv))
+        return value, t
+
+    def __check_synced(self):
+        if self.offset is None:
+            raise RuntimeError, "clock not synchronized - call sync first"
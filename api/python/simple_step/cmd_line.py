@@ -37,9 +37,15 @@ import sys
 import optparse
 import atexit
 from simple_step import Simple_Step
+from lazy import Lazy_Module
+
+# Only needed by the stress command - imported on first use
+stress = Lazy_Module('stress', globals())
 
 
 DEFAULT_ACCEL = 15000
+DEFAULT_STRESS_DURATION = 3600
+DEFAULT_STRESS_INTERVAL = 10
 
 class Simple_Step_Cmd_Line:
     
@@ -66,9 +72,13 @@ class Simple_Step_Cmd_Line:
             'set-vel'     : self.set_vel,
             'ramp-to-vel' : self.ramp_to_vel,
             'zero'        : self.zero,
+            'home'        : self.home,
+            'stress'      : self.stress,
             'help'        : self.help,
             'set-ext-int' : self.set_ext_int,
             'get-ext-int' : self.get_ext_int,
+            'save-config' : self.save_config,
+            'clear-config': self.clear_config,
             }
 
         # Table of command strings to help strings
@@ -87,9 +97,13 @@ class Simple_Step_Cmd_Line:
             'set-vel'     : Simple_Step_Cmd_Line.set_vel_help_str,
             'ramp-to-vel' : Simple_Step_Cmd_Line.ramp_to_vel_help_str,
             'zero'        : Simple_Step_Cmd_Line.zero_help_str,
+            'home'        : Simple_Step_Cmd_Line.home_help_str,
+            'stress'      : Simple_Step_Cmd_Line.stress_help_str,
             'help'        : Simple_Step_Cmd_Line.help_help_str,
             'set-ext-int' : Simple_Step_Cmd_Line.set_ext_int_help_str,
             'get-ext-int' : Simple_Step_Cmd_Line.get_ext_int_help_str,
+            'save-config' : Simple_Step_Cmd_Line.save_config_help_str,
+            'clear-config': Simple_Step_Cmd_Line.clear_config_help_str,
             }
 
         # Set up option parser
@@ -106,6 +120,12 @@ class Simple_Step_Cmd_Line:
                           help = 'serial number - specify device by serial number',
                           default = None)
 
+        self.parser.add_option('-c', '--cache',
+                          action='store_true',
+                          dest = 'cache',
+                          help = 'cache device profiles in ~/.simple_step to speed up opening',
+                          default = False)
+
         self.options, self.args = self.parser.parse_args()
         serial_number = self.options.serial_number
 
@@ -115,7 +135,8 @@ class Simple_Step_Cmd_Line:
         ########################################################################
         
         # Open device
-        self.dev = Simple_Step(serial_number=serial_number)        
+        self.dev = Simple_Step(serial_number=serial_number, lazy_limits=True, 
+                               cache=self.options.cache)
         atexit.register(self.atexit)
         return 
 
@@ -162,7 +183,7 @@ class Simple_Step_Cmd_Line:
             print "ERROR: command 'set-ext-int' requires an argument"
             sys.exit(1)
         val = self.args[1]
-        if not val.lower() in ('enabled','disabled'):
+        if not val.lower() in ('enabled','disabled','latch'):
             try:
                 val = int(val)
             except Exception, err:
@@ -180,6 +201,18 @@ class Simple_Step_Cmd_Line:
         """
         print self.dev.get_ext_int()
 
+    def save_config(self):
+        """
+        Save current settings as the device start up configuration.
+        """
+        self.dev.save_config()
+
+    def clear_config(self):
+        """
+        Erase the saved device start up configuration.
+        """
+        self.dev.clear_config()
+
     def dio_hi(self):
         """
         Set DIO pin to logic high
@@ -430,6 +463,42 @@ class Simple_Step_Cmd_Line:
         self.dev.soft_ramp_to_vel(vel,direction,accel)
         
 
+    def home(self):
+        """
+        Home motor using switch on external interrupt pin
+        """
+        # Extract direction of home switch
+        direction = 'negative'
+        opt_start = 1
+        if len(self.args) > 1 and not '=' in self.args[1]:
+            direction = self.args[1].lower()
+            if not direction in ('positive', 'negative'):
+                print "ERROR: direction must be positive or negative"
+                sys.exit(1)
+            opt_start = 2
+
+        # Handle optional arguments
+        kwargs = {}
+        if len(self.args) > opt_start:
+            opt_args = get_opt_args(self.args[opt_start:])
+            for name in ('fast_vel', 'slow_vel', 'backoff'):
+                val = get_arg(opt_args, name)
+                if val != None:
+                    kwargs[name] = val
+
+            # We should have no more optional arguments
+            if len(opt_args)!=0:
+                print "ERROR: unkown optional argument for command"
+                for k,v in opt_args.iteritems():
+                    print '%s = %s'%(k,v)
+                sys.exit(1)
+
+        # Perform homing
+        state = self.dev.home(dir=direction,**kwargs)
+        if state != 'done':
+            print "ERROR: homing %s"%(state,)
+            sys.exit(1)
+
     def zero(self):
         """
         Set motor zero position
@@ -469,7 +538,61 @@ class Simple_Step_Cmd_Line:
             print help_str
             
         
-    
+
+    def stress(self):
+        """
+        Soak and stress test of the usb command path
+        """
+        # Extract serial numbers of additional devices
+        opt_start = 1
+        while len(self.args) > opt_start and not '=' in self.args[opt_start]:
+            opt_start += 1
+        serial_numbers = self.args[1:opt_start]
+
+        # Handle optional arguments
+        report = None
+        duration = DEFAULT_STRESS_DURATION
+        interval = DEFAULT_STRESS_INTERVAL
+        seed = None
+        if len(self.args) > opt_start:
+            opt_args = get_opt_args(self.args[opt_start:])
+            report = opt_args.pop('report', None)
+            val = get_arg(opt_args, 'duration')
+            if val != None:
+                duration = val
+            val = get_arg(opt_args, 'interval')
+            if val != None:
+                interval = val
+            seed = get_arg(opt_args, 'seed')
+
+            # We should have no more optional arguments
+            if len(opt_args)!=0:
+                print "ERROR: unkown optional argument for command"
+                for k,v in opt_args.iteritems():
+                    print '%s = %s'%(k,v)
+                sys.exit(1)
+
+        # Open additional devices
+        dev_list = [self.dev]
+        for serial_number in serial_numbers:
+            try:
+                dev_list.append(Simple_Step(serial_number=serial_number, lazy_limits=True, 
+                                            cache=self.options.cache))
+            except RuntimeError, err:
+                print "ERROR: %s"%(err,)
+                sys.exit(1)
+
+        # Run test
+        stress_test = stress.Stress_Test(dev_list, seed=seed)
+        try:
+            stress_test.run(duration, interval=interval, report=report)
+            print
+            stress_test.print_summary()
+        finally:
+            for dev in stress_test.dev_list[1:]:
+                dev.close()
+            # Device may have been reopened by the test
+            self.dev = stress_test.dev_list[0]
 
     # Help strings ---------------------------------
 
@@ -494,8 +617,12 @@ Command Summary:
  start          - start controller
  stop           - stop controller
  zero           - set the zero position of the motor
+ home           - home motor using switch on external interrupt pin
+ stress         - soak and stress test of the usb command path
  set-ext-int    - enable/disable external interrupt
  get-ext-int    - get current external interrupt setting
+ save-config    - save current settings as the start up configuration
+ clear-config   - erase the saved start up configuration
 
 
 * To get help for a specific command type: %prog help cmd.
@@ -521,7 +648,8 @@ command: set-ext-int
 usage: simple-step set-ext-int value
 
 Enables or disables external interrupts. Where value should be strings 
-enable or disable strings  or integers 1 or 0.
+enable or disable strings  or integers 1 or 0. The value latch, or 2, 
+latches the position on external interrupts without stopping the motor.
 """
 
     get_ext_int_help_str = """\
@@ -529,7 +657,30 @@ command: get-ext-int
 
 usage: simple-set get-ext-int
 
-Returns the current external interrupt setting (enabled or disabled)
+Returns the current external interrupt setting (enabled, latch or disabled)
+"""
+
+    save_config_help_str = """\
+command: save-config
+
+usage: simple-step save-config
+
+Saves the current operating mode, positioning velocity, enable state,
+external interrupt setting, step mode and acceleration to the device 
+EEPROM. The saved settings are applied whenever the device starts up.
+
+Example:
+ simple-step set-ext-int enable
+ simple-step save-config
+"""
+
+    clear_config_help_str = """\
+command: clear-config
+
+usage: simple-step clear-config
+
+Erases the start up configuration saved by save-config. The device 
+will start up with the firmware defaults.
 """
 
     dio_hi_help_str = """\
@@ -598,6 +749,55 @@ Disables stepper motor drive by setting the enable pin low.
 Example:
  simple-step disable
 """
+    home_help_str = """\
+command: home
+
+usage: simple-step home [dir] [fast_vel=velocity] [slow_vel=velocity] 
+                        [backoff=distance]
+
+Homes the motor using a switch wired to the external interrupt pin. The 
+motor approaches the switch quickly, backs off, and re-approaches slowly.
+The position at which the switch is reached becomes the zero position 
+and the motor is parked backoff indices away from the switch. The
+direction of the switch, dir, is positive or negative (default).
+
+Examples:
+
+ simple-step home                   # home in the negative direction
+ simple-step home positive          # home in the positive direction
+
+ # home w/ slow re-approach velocity of 50 ind/sec
+ simple-step home negative slow_vel=50
+
+"""
+
+    stress_help_str = """\
+command: stress
+
+usage: simple-step stress [serial_number ...] [duration=sec] [interval=sec]
+                          [seed=n] [report=file]
+
+Soak and stress test of the usb command path. A randomized mix of get 
+and set commands is sent to each device as fast as possible for duration
+seconds (default 3600). Throughput, latency percentiles, retries, command
+id mismatches, errors and reconnects are printed every interval seconds
+(default 10) and, if report is given, written to a json report file. The
+devices are stopped for the test and their mode and set-points are 
+restored at the end. The test can be ended early with Ctrl-C. 
+
+The device given with the -s option, or the first device found, is
+tested along with any devices whose serial numbers are given.
+
+Examples:
+
+ simple-step stress                           # test for one hour
+ simple-step stress duration=60 interval=5    # test for one minute
+
+ # test two devices overnight and write report 
+ simple-step -s 0001 stress 0002 duration=43200 report=stress.json
+
+"""
+
     move_to_pos_help_str = """\
 command: move-to-pos
 
@@ -0,0 +1,135 @@
+"""
+-----------------------------------------------------------------------
+simple_step
+Copyright (C) William Dickson, 2008.
+
+wbd@caltech.edu
+www.willdickson.com
+
+Released under the LGPL Licence, Version 3
+
+This file is part of simple_step.
+
+simple_step is free software: you can redistribute it and/or modify it
+under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+simple_step is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with simple_step.  If not, see
+<http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------------------
+
+Purpose: Provides deferred module imports for the simple_step package.
+A Lazy_Module stands in for a module and imports it on first attribute 
+access, so that modules which are slow to import, or which may not be 
+installed, e.g. pylibusb, cost nothing until they are used. A 
+Lazy_Attribute defers an instance attribute, e.g. a value read from 
+the device, in the same way.
+
+Author: William Dickson 
+
+------------------------------------------------------------------------
+"""
+import threading
+
+class Lazy_Module:
+
+    """
+    Placeholder for a module which is imported on first use.
+    """
+
+    def __init__(self,name,globals=None):
+        """
+        Initialize lazy module.
+
+        Arguments:
+          name = module name
+
+        Keywords:
+          globals = globals of the importing module. Used to resolve
+                    imports relative to the importing package.
+
+        Return: None
+        """
+        self.__dict__['_name'] = name
+        self.__dict__['_globals'] = globals
+        self.__dict__['_module'] = None
+        self.__dict__['_lock'] = threading.Lock()
+
+    def __getattr__(self,name):
+        return getattr(self.load(), name)
+
+    def __setattr__(self,name,value):
+        setattr(self.load(), name, value)
+
+    def load(self):
+        """
+        Imports the module, if not already imported, and returns it.
+
+        Arguments: None
+
+        Return: module
+        """
+        module = self.__dict__['_module']
+        if module is None:
+            self._lock.acquire()
+            try:
+                module = self.__dict__['_module']
+                if module is None:
+                    module = __import__(self._name, self._globals, None, ['__name__'])
+                    self.__dict__['_module'] = module
+            finally:
+                self._lock.release()
+        return module
+
+    def is_loaded(self):
+        """
+        Returns True if the module has been imported.
+        """
+        return self.__dict__['_module'] is not None
+
+    def __repr__(self):
+        return "<lazy module '%s'>"%(self._name,)
+
+    # Old style instances look up special methods with __getattr__ - 
+    # without these str, print and truth tests would import the module.
+    __str__ = __repr__
+
+    def __nonzero__(self):
+        return True
+
+class Lazy_Attribute(object):
+
+    """
+    Class attribute which computes an instance attribute on first use. 
+    The value is returned by the named method of the instance and stored
+    in the instance, which then shadows the Lazy_Attribute. Assigning the
+    attribute in the usual way also shadows it.
+    """
+
+    def __init__(self,name,method):
+        """
+        Initialize lazy attribute.
+
+        Arguments:
+          name   = attribute name
+          method = name of the method which returns the value
+
+        Return: None
+        """
+        self.name = name
+        self.method = method
+
+    def __get__(self,obj,cls=None):
+        if obj is None:
+            return self
+        value = getattr(obj, self.method)()
+        obj.__dict__[self.name] = value
+        return value
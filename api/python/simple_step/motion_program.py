@@ -0,0 +1,197 @@
+"""
+-----------------------------------------------------------------------
+simple_step
+Copyright (C) William Dickson, 2008.
+
+wbd@caltech.edu
+www.willdickson.com
+
+Released under the LGPL Licence, Version 3
+
+This file is part of simple_step.
+
+simple_step is free software: you can redistribute it and/or modify it
+under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+simple_step is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with simple_step.  If not, see
+<http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------------------
+
+Purpose: Compiles motion programs for the on-device motion program 
+interpreter of the at90usb based stepper motor controller. A motion
+program is described in python as a list of instructions, e.g.
+
+    program = [
+        ('set_vel', 2000),
+        ('loop', 10, [
+            ('move_rel', 500),
+            ('wait_done',),
+            ('dio_set', 0x01, 0x01),
+            ('wait_us', 1000),
+            ('dio_set', 0x00, 0x01),
+            ]),
+        ('wait_ext_int',),
+        ('move', 0),
+        ('wait_done',),
+        ]
+
+and compiled into (opcode, argument) pairs which are uploaded to the
+device with Simple_Step.load_program. The instructions are:
+
+    ('move', pos)              - move to position pos 
+    ('move_rel', dpos)         - move by dpos from the position set-point
+    ('set_vel', vel)           - set the positioning velocity 
+    ('wait_done',)             - wait until the move is complete 
+    ('wait_us', t)             - wait t microseconds 
+    ('dio_set', mask[, pins])  - set the DIO pins in pins (default all) 
+                                 to the values in mask
+    ('wait_ext_int',)          - wait for an external interrupt edge 
+    ('loop', count, body)      - run the list of instructions body count 
+                                 times, or endlessly if count is 0.
+                                 Loops may be nested.
+
+Author: William Dickson
+
+------------------------------------------------------------------------
+"""
+
+# Opcodes - must match the firmware
+PROG_OP_END = 0
+PROG_OP_MOVE = 1
+PROG_OP_MOVE_REL = 2
+PROG_OP_SET_VEL = 3
+PROG_OP_WAIT_DONE = 4
+PROG_OP_WAIT_US = 5
+PROG_OP_DIO_SET = 6
+PROG_OP_WAIT_EXT_INT = 7
+PROG_OP_LOOP = 8
+
+# Mapping from instruction names to opcodes 
+PROG_OP2VAL_DICT = {
+    'end'          : PROG_OP_END,
+    'move'         : PROG_OP_MOVE,
+    'move_rel'     : PROG_OP_MOVE_REL,
+    'set_vel'      : PROG_OP_SET_VEL,
+    'wait_done'    : PROG_OP_WAIT_DONE,
+    'wait_us'      : PROG_OP_WAIT_US,
+    'dio_set'      : PROG_OP_DIO_SET,
+    'wait_ext_int' : PROG_OP_WAIT_EXT_INT,
+    'loop'         : PROG_OP_LOOP,
+    }
+VAL2PROG_OP_DICT = dict([(v,k) for k,v in PROG_OP2VAL_DICT.iteritems()])
+
+# Program size and argument limits
+PROG_TABLE_SIZE = 64
+PROG_LOOP_FOREVER = 0
+PROG_LOOP_COUNT_MAX = 2**16-1
+INT32_MIN = -2**31
+INT32_MAX = 2**31-1
+
+def compile_program(program):
+    """
+    Compiles a motion program description into a list of (opcode, 
+    argument) pairs. An 'end' instruction is appended.
+
+    Arguments:
+      program = list of instruction tuples - see module docstring
+
+    Return: list of (opcode, argument) pairs
+    """
+    code = []
+    _compile_block(program, code)
+    code.append((PROG_OP_END, 0))
+    if len(code) > PROG_TABLE_SIZE:
+        raise ValueError, "program too long - %d instructions, max %d"%(len(code),PROG_TABLE_SIZE)
+    return code
+
+def disassemble(code):
+    """
+    Returns a readable listing of compiled program code.
+
+    Arguments:
+      code = list of (opcode, argument) pairs
+
+    Return: string listing, one instruction per line
+    """
+    lines = []
+    for i, (op, arg) in enumerate(code):
+        name = VAL2PROG_OP_DICT.get(op, str(op))
+        if op == PROG_OP_LOOP:
+            arg_str = 'to %d, count %d'%(arg & 0xFF, arg >> 8)
+        elif op == PROG_OP_DIO_SET:
+            arg_str = 'mask 0x%02x, pins 0x%02x'%(arg & 0xFF, (arg >> 8) or 0xFF)
+        elif op in (PROG_OP_END, PROG_OP_WAIT_DONE, PROG_OP_WAIT_EXT_INT):
+            arg_str = ''
+        else:
+            arg_str = str(arg)
+        lines.append('%3d %-12s %s'%(i, name, arg_str))
+    return '\n'.join(lines)
+
+def _compile_block(program, code):
+    """
+    Compiles a list of instructions, appending to code. 
+    """
+    for inst in program:
+        if type(inst) == str:
+            inst = (inst,)
+        try:
+            name, args = inst[0], tuple(inst[1:])
+            op = PROG_OP2VAL_DICT[name]
+        except (IndexError, KeyError, TypeError):
+            raise ValueError, "unknown instruction %s"%(inst,)
+
+        if op in (PROG_OP_END, PROG_OP_WAIT_DONE, PROG_OP_WAIT_EXT_INT):
+            _check_num_args(name, args, 0, 0)
+            code.append((op, 0))
+
+        elif op in (PROG_OP_MOVE, PROG_OP_MOVE_REL):
+            _check_num_args(name, args, 1, 1)
+            code.append((op, _check_range(name, args[0], INT32_MIN, INT32_MAX)))
+
+        elif op == PROG_OP_SET_VEL:
+            _check_num_args(name, args, 1, 1)
+            code.append((op, _check_range(name, args[0], 1, 2**16-1)))
+
+        elif op == PROG_OP_WAIT_US:
+            _check_num_args(name, args, 1, 1)
+            code.append((op, _check_range(name, args[0], 0, INT32_MAX)))
+
+        elif op == PROG_OP_DIO_SET:
+            _check_num_args(name, args, 1, 2)
+            mask = _check_range(name, args[0], 0, 0xFF)
+            if len(args) > 1:
+                pins = _check_range(name, args[1], 1, 0xFF)
+            else:
+                pins = 0xFF
+            code.append((op, (pins << 8) | mask))
+
+        elif op == PROG_OP_LOOP:
+            _check_num_args(name, args, 2, 2)
+            count = _check_range(name, args[0], 0, PROG_LOOP_COUNT_MAX)
+            start = len(code)
+            _compile_block(args[1], code)
+            if len(code) == start:
+                raise ValueError, "empty loop body"
+            if start >= PROG_TABLE_SIZE:
+                raise ValueError, "program too long"
+            code.append((op, (count << 8) | start))
+    return code
+
+def _check_num_args(name, args, num_min, num_max):
+    if len(args) < num_min or len(args) > num_max:
+        raise ValueError, "wrong number of arguments for %s"%(name,)
+
+def _check_range(name, val, val_min, val_max):
+    val = int(val)
+    if val < val_min or val > val_max:
+        raise ValueError, "%s argument out of range %d-%d"%(name,val_min,val_max)
+    return val
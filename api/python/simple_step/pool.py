@@ -0,0 +1,161 @@
+"""
+-----------------------------------------------------------------------
+simple_step
+Copyright (C) William Dickson, 2008.
+  
+wbd@caltech.edu
+www.willdickson.com
+
+Released under the LGPL Licence, Version 3
+
+This file is part of simple_step.
+
+simple_step is free software: you can redistribute it and/or modify it
+under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+    
+simple_step is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with simple_step.  If not, see
+<http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------------------
+
+Purpose: Provides a class for operating several at90usb based stepper 
+motor controllers together.
+
+Author: William Dickson 
+
+------------------------------------------------------------------------
+"""
+from simple_step import Simple_Step
+from simple_step import DEFAULT_TRIG_PIN
+from simple_step import stop_all
+
+class Simple_Step_Pool:
+
+    """
+    Collection of at90usb based stepper motor controllers. 
+    """
+
+    def __init__(self,dev_list):
+        """
+        Open the devices in the pool.
+
+        Arguments:
+          dev_list = list of devices. Each entry can be either the serial
+                     number of the device or an open Simple_Step object.
+
+        Return: None.
+        """
+        self.dev_list = []
+        for dev in dev_list:
+            if isinstance(dev, Simple_Step):
+                self.dev_list.append(dev)
+            else:
+                self.dev_list.append(Simple_Step(serial_number=dev))
+
+    def __len__(self):
+        return len(self.dev_list)
+
+    def __iter__(self):
+        return iter(self.dev_list)
+
+    def __getitem__(self,ind):
+        return self.dev_list[ind]
+
+    def close(self):
+        """
+        Close all devices in the pool.
+
+        Arguments: None
+
+        Return: None
+        """
+        for dev in self.dev_list:
+            dev.close()
+        return
+
+    def get_dev(self,serial_number):
+        """
+        Returns the device in the pool with the given serial number.
+
+        Arguments:
+          serial_number = serial number of the device
+
+        Return: Simple_Step object.
+        """
+        for dev in self.dev_list:
+            if dev.get_serial_number() == serial_number:
+                return dev
+        raise ValueError, "no device w/ serial number %s in pool"%(serial_number,)
+
+    def start(self):
+        """
+        Starts all devices in the pool one after the other. Use
+        arm_and_fire for a synchronized start.
+
+        Arguments: None
+
+        Return: None
+        """
+        for dev in self.dev_list:
+            dev.start()
+        return
+
+    def stop(self,disable=False):
+        """
+        Stops all devices in the pool. The stop commands are issued to 
+        the devices in parallel.
+
+        Keywords:
+          disable = True or False (default). If True the drives are also
+                    disabled.
+
+        Return: None
+        """
+        stop_all(self.dev_list,disable=disable)
+        return
+
+    def arm(self):
+        """
+        Arms all devices in the pool. Each device will start running on 
+        the next rising edge of its trigger input.
+
+        Arguments: None
+
+        Return: None
+        """
+        for dev in self.dev_list:
+            dev.arm()
+        return
+
+    def arm_and_fire(self,master=None,pin=DEFAULT_TRIG_PIN):
+        """
+        Synchronized start of all devices in the pool. The moves should 
+        be staged first, i.e., the mode and set-points of each device set
+        while the devices are stopped. All devices are armed and then the
+        master device sends a trigger pulse on the given DIO pin. The DIO 
+        pin of the master device must be wired to the trigger inputs of all
+        devices in the pool. 
+
+        Keywords:
+          master = the device sending the trigger pulse - a serial number,
+                   a Simple_Step object or None. If None (default) the 
+                   first device in the pool is used.
+          pin    = the DIO pin of the master used for the trigger pulse.
+
+        Return: None
+        """
+        if master is None:
+            master = self.dev_list[0]
+        elif not isinstance(master, Simple_Step):
+            master = self.get_dev(master)
+        self.arm()
+        master.fire_trig(pin)
+        return
@@ -0,0 +1,199 @@
+"""
+-----------------------------------------------------------------------
+simple_step
+Copyright (C) William Dickson, 2008.
+
+wbd@caltech.edu
+www.willdickson.com
+
+Released under the LGPL Licence, Version 3
+
+This file is part of simple_step.
+
+simple_step is free software: you can redistribute it and/or modify it
+under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+simple_step is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with simple_step.  If not, see
+<http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------------------
+
+Purpose: Provides an on-disk cache of static device information for 
+the at90usb based stepper motor controller. For each device, keyed by 
+serial number, the cache stores the firmware build identifier, the 
+usb descriptor strings and IDs, and the velocity limits. Simple_Step 
+uses the cache, when opened with cache=True, to avoid reading these 
+from the device every time it is opened. A cached profile is only used 
+when its build identifier matches that of the device.
+
+Author: William Dickson 
+
+------------------------------------------------------------------------
+"""
+import os
+import json
+
+# Default cache file
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.simple_step')
+DEFAULT_CACHE_FILE = os.path.join(DEFAULT_CACHE_DIR, 'profiles.json')
+
+# Cache file format version - cache files with other versions are ignored
+CACHE_VERSION = 1
+
+# Profile keys
+PROFILE_KEYS = (
+    'serial_number',
+    'build_id',
+    'manufacturer',
+    'product',
+    'vendor_id',
+    'product_id',
+    'max_vel',
+    'min_vel',
+    )
+
+class Profile_Cache:
+
+    """
+    On-disk cache of device profiles keyed by serial number. The cache
+    file is reread on every access, and replaced atomically on every 
+    update, so that it may be shared by many processes. 
+    """
+
+    def __init__(self,filename=DEFAULT_CACHE_FILE):
+        """
+        Initialize profile cache.
+
+        Keywords:
+          filename = cache file name. The directory is created when the
+                     cache is first written.
+
+        Return: None
+        """
+        self.filename = filename
+
+    def get(self,serial_number,build_id=None):
+        """
+        Returns the cached profile of a device.
+
+        Arguments:
+          serial_number = device serial number
+
+        Keywords:
+          build_id = firmware build identifier. If not None only a profile
+                     with a matching build identifier is returned.
+
+        Return: profile dictionary or None if there is no valid profile.
+        """
+        profile = self.__read().get(serial_number)
+        if profile is None:
+            return None
+        for key in PROFILE_KEYS:
+            if not key in profile:
+                return None
+        if build_id is not None and profile['build_id'] != build_id:
+            return None
+        # json strings are unicode - return str as read from the device
+        for key, value in profile.items():
+            if isinstance(value, unicode):
+                profile[key] = str(value)
+        return profile
+
+    def put(self,profile):
+        """
+        Adds, or replaces, a device profile.
+
+        Arguments:
+          profile = profile dictionary - see PROFILE_KEYS
+
+        Return: None
+        """
+        for key in PROFILE_KEYS:
+            if not key in profile:
+                raise ValueError, "profile missing key %s"%(key,)
+        profiles = self.__read()
+        profiles[profile['serial_number']] = dict([(k,profile[k]) for k in PROFILE_KEYS])
+        self.__write(profiles)
+        return
+
+    def remove(self,serial_number):
+        """
+        Removes a device profile.
+
+        Arguments:
+          serial_number = device serial number
+
+        Return: None
+        """
+        profiles = self.__read()
+        if profiles.pop(serial_number, None) is not None:
+            self.__write(profiles)
+        return
+
+    def clear(self):
+        """
+        Removes all device profiles.
+
+        Arguments: None
+
+        Return: None
+        """
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        return
+
+    def get_serial_numbers(self):
+        """
+        Returns a list of the serial numbers of the cached profiles.
+        """
+        serial_numbers = self.__read().keys()
+        serial_numbers.sort()
+        return serial_numbers
+
+    def __read(self):
+        """
+        Reads the cache file. A missing, unreadable or out of date cache 
+        file is treated as empty.
+        """
+        try:
+            fid = open(self.filename, 'r')
+        except IOError:
+            return {}
+        try:
+            try:
+                data = json.load(fid)
+            except ValueError:
+                return {}
+        finally:
+            fid.close()
+        if not isinstance(data, dict) or data.get('version') != CACHE_VERSION:
+            return {}
+        profiles = data.get('profiles')
+        if not isinstance(profiles, dict):
+            return {}
+        return profiles
+
+    def __write(self,profiles):
+        """
+        Writes the cache file. A temporary file is renamed into place so 
+        that readers never see a partially written cache.
+        """
+        cache_dir = os.path.dirname(self.filename)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_filename = '%s.%d.tmp'%(self.filename, os.getpid())
+        fid = open(tmp_filename, 'w')
+        try:
+            json.dump({'version': CACHE_VERSION, 'profiles': profiles}, fid, indent=1)
+        finally:
+            fid.close()
+        os.rename(tmp_filename, self.filename)
+        return
@@ -0,0 +1,461 @@
+"""
+-----------------------------------------------------------------------
+simple_step
+Copyright (C) William Dickson, 2008.
+
+wbd@caltech.edu
+www.willdickson.com
+
+Released under the LGPL Licence, Version 3
+
+This file is part of simple_step.
+
+simple_step is free software: you can redistribute it and/or modify it
+under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+simple_step is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with simple_step.  If not, see
+<http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------------------
+
+Purpose: Provides a fidelity benchmark for the soft ramp helpers,
+soft_ramp_to_vel and soft_ramp_to_pos, of the at90usb based stepper
+motor controller. The ramps are run while the commanded set-points are
+logged and the achieved velocity and position are sampled. The 
+timelines are compared with the ideal constant acceleration profiles
+to give the rms acceleration error, the rms velocity error, overshoot,
+completion time versus ideal and the jitter of the set-point updates.
+
+The benchmark can be run against hardware, in which case the device 
+should be opened with threaded=True as it is sampled from a second
+thread during the ramp, or against a simulated device (see sim_step).
+
+Author: William Dickson
+
+------------------------------------------------------------------------
+"""
+import time
+import math
+import threading
+from simple_step import USB_CMD_SET_VEL_SETPT
+from simple_step import USB_CMD_SET_DIR_SETPT
+from simple_step import USB_CMD_SET_POS_VEL
+from simple_step import NEGATIVE
+
+# Benchmark defaults
+DEFAULT_DT_LIST = (0.2, 0.1, 0.05, 0.02, 0.01)
+DEFAULT_VEL = 4000
+DEFAULT_ACCEL = 4000
+DEFAULT_DIST = 4000
+DEFAULT_SAMPLE_DT = 0.005
+DEFAULT_SETTLE_TIME = 0.25
+
+# Metrics reported for each benchmark run - name, format, units
+METRIC_LIST = (
+    ('accel_rms_err',     '%10.1f', 'ind/s^2'),
+    ('vel_rms_err',       '%10.1f', 'ind/s'),
+    ('overshoot',         '%10.1f', 'ind or ind/s'),
+    ('t_ideal',           '%10.3f', 's'),
+    ('t_complete',        '%10.3f', 's'),
+    ('t_error',           '%10.3f', 's'),
+    ('update_dt_mean',    '%10.4f', 's'),
+    ('update_dt_std',     '%10.4f', 's'),
+    ('update_jitter_max', '%10.4f', 's'),
+    ('num_updates',       '%10d',   ''),
+    )
+
+class Command_Log:
+
+    """
+    Logs the set commands sent by a device. The device's usb_set_cmd
+    method is wrapped, so all set commands sent by the device methods
+    are logged with the host time at which they were sent.
+    """
+
+    def __init__(self,dev):
+        self.dev = dev
+        self.log = []
+        self.usb_set_cmd = None
+
+    def start(self):
+        """
+        Starts logging.
+
+        Arguments: None
+
+        Return: None
+        """
+        if self.usb_set_cmd is not None:
+            return
+        self.usb_set_cmd = self.dev.usb_set_cmd
+        def usb_set_cmd(cmd_id,val,*args,**kwargs):
+            self.log.append((time.time(), cmd_id, val))
+            return self.usb_set_cmd(cmd_id,val,*args,**kwargs)
+        self.dev.usb_set_cmd = usb_set_cmd
+        return
+
+    def stop(self):
+        """
+        Stops logging.
+
+        Arguments: None
+
+        Return: None
+        """
+        if self.usb_set_cmd is None:
+            return
+        del self.dev.usb_set_cmd
+        self.usb_set_cmd = None
+        return
+
+    def get(self,cmd_id):
+        """
+        Returns the logged (time, value) pairs for a command.
+
+        Arguments:
+          cmd_id = the usb command id 
+
+        Return: list of (time, value) pairs
+        """
+        return [(t, val) for t, c, val in self.log if c == cmd_id]
+
+def bench_ramp_to_vel(dev,vel=DEFAULT_VEL,accel=DEFAULT_ACCEL,dt=0.1,
+                      sample_dt=DEFAULT_SAMPLE_DT,settle_time=DEFAULT_SETTLE_TIME):
+    """
+    Benchmarks soft_ramp_to_vel (software ramp). The motor is ramped 
+    from rest to velocity vel. The motor is left running at vel.
+
+    Arguments:
+      dev = Simple_Step device (threaded=True) or Sim_Step device
+
+    Keywords:
+      vel         = ramp velocity (ind/s). Negative for negative direction.
+      accel       = ramp acceleration (ind/s^2)
+      dt          = ramp update time step (s)
+      sample_dt   = sample period for achieved velocity (s)
+      settle_time = time sampled after the ramp returns (s)
+
+    Return: dictionary of metrics - see METRIC_LIST.
+    """
+    vel, accel = int(vel), int(accel)
+    if vel >= 0:
+        dir = 'positive'
+    else:
+        dir = 'negative'
+
+    # Start from rest 
+    dev.stop()
+    dev.set_mode('velocity')
+    dev.set_vel_setpt(0)
+
+    # Run ramp, logging commands, and sample achieved velocity 
+    cmd_log = Command_Log(dev)
+    cmd_log.start()
+    try:
+        t0 = time.time()
+        samples = _sample_during(dev, dev.soft_ramp_to_vel, (abs(vel), dir, accel), 
+                                 {'dt': dt, 'firmware': False}, sample_dt, settle_time)
+    finally:
+        cmd_log.stop()
+
+    # Commanded signed velocity timeline 
+    cmd_list = []
+    dir_val = None
+    for t, cmd_id, val in cmd_log.log:
+        if cmd_id == USB_CMD_SET_DIR_SETPT:
+            dir_val = val
+        elif cmd_id == USB_CMD_SET_VEL_SETPT and dir_val is not None:
+            cmd_list.append((t - t0, val if dir_val != NEGATIVE else -val))
+
+    # Ideal profile - constant acceleration to vel
+    t_ideal = abs(vel)/float(accel)
+    accel_signed = math.copysign(accel, vel)
+    def vel_ideal(t):
+        return accel_signed*min(max(t, 0.0), t_ideal)
+    def accel_ideal(t):
+        if t < t_ideal:
+            return accel_signed
+        return 0.0
+
+    # Achieved signed velocity timeline
+    vel_list = [(t - t0, v*(-1 if d == NEGATIVE else 1)) for t, p, v, d in samples]
+    overshoot = max([0.0] + [(v - vel)*math.copysign(1, vel) for t, v in vel_list])
+    t_complete = None
+    for t, v in vel_list:
+        if v == vel:
+            t_complete = t
+            break
+
+    metrics = _ramp_metrics(cmd_list, vel_list, vel_ideal, accel_ideal, dt)
+    metrics.update({
+        'overshoot'  : overshoot,
+        't_ideal'    : t_ideal,
+        't_complete' : t_complete,
+        't_error'    : _sub(t_complete, t_ideal),
+        })
+    return metrics
+
+def bench_ramp_to_pos(dev,dist=DEFAULT_DIST,accel=DEFAULT_ACCEL,pos_vel=DEFAULT_VEL,dt=0.1,
+                      sample_dt=DEFAULT_SAMPLE_DT,settle_time=DEFAULT_SETTLE_TIME):
+    """
+    Benchmarks soft_ramp_to_pos. The motor is moved by dist from its
+    current position.
+
+    Arguments:
+      dev = Simple_Step device (threaded=True) or Sim_Step device
+
+    Keywords:
+      dist        = move distance (ind). Negative for negative moves. 
+      accel       = ramp acceleration (ind/s^2)
+      pos_vel     = peak ramp velocity (ind/s)
+      dt          = ramp update time step (s)
+      sample_dt   = sample period for achieved position (s)
+      settle_time = time sampled after the ramp returns (s)
+
+    Return: dictionary of metrics - see METRIC_LIST.
+    """
+    dist, accel, pos_vel = int(dist), int(accel), int(pos_vel)
+    dev.stop()
+    pos_start = dev.get_pos()
+    pos = pos_start + dist
+    sign = math.copysign(1, dist)
+
+    cmd_log = Command_Log(dev)
+    cmd_log.start()
+    try:
+        t0 = time.time()
+        samples = _sample_during(dev, dev.soft_ramp_to_pos, (pos, accel), 
+                                 {'pos_vel': pos_vel, 'dt': dt}, sample_dt, settle_time)
+    finally:
+        cmd_log.stop()
+
+    # Commanded signed velocity timeline - positioning velocity updates
+    cmd_list = [(t - t0, sign*v) for t, v in cmd_log.get(USB_CMD_SET_POS_VEL)]
+
+    # Ideal profile - trapezoid, or triangle for short moves
+    d = float(abs(dist))
+    t_accel = pos_vel/float(accel)
+    if d >= accel*t_accel**2:
+        t_ideal = 2.0*t_accel + (d - accel*t_accel**2)/pos_vel
+    else:
+        t_accel = math.sqrt(d/accel)
+        t_ideal = 2.0*t_accel
+    def vel_ideal(t):
+        t = min(max(t, 0.0), t_ideal)
+        return sign*min(accel*t, accel*t_accel, accel*(t_ideal - t))
+    def accel_ideal(t):
+        if t < t_accel:
+            return sign*accel
+        elif t < t_ideal - t_accel:
+            return 0.0
+        elif t < t_ideal:
+            return -sign*accel
+        return 0.0
+
+    # Achieved velocity and position timelines
+    vel_list = [(t - t0, v*(-1 if di == NEGATIVE else 1)) for t, p, v, di in samples]
+    overshoot = max([0.0] + [(p - pos)*sign for t, p, v, di in samples])
+    t_complete = None
+    for t, p, v, di in samples:
+        if p == pos:
+            t_complete = t - t0
+            break
+
+    metrics = _ramp_metrics(cmd_list, vel_list, vel_ideal, accel_ideal, dt)
+    metrics.update({
+        'overshoot'  : overshoot,
+        't_ideal'    : t_ideal,
+        't_complete' : t_complete,
+        't_error'    : _sub(t_complete, t_ideal),
+        })
+    return metrics
+
+def run_benchmark(dev,dt_list=DEFAULT_DT_LIST,repeat=1,vel=DEFAULT_VEL,accel=DEFAULT_ACCEL,
+                  dist=DEFAULT_DIST,ramps=('vel','pos'),verbose=False):
+    """
+    Runs the velocity and position ramp benchmarks for each ramp update
+    time step in dt_list. 
+
+    Arguments:
+      dev = Simple_Step device (threaded=True) or Sim_Step device
+
+    Keywords:
+      dt_list = list of ramp update time steps (s)
+      repeat  = number of runs of each benchmark
+      vel     = velocity ramp final velocity and position ramp peak
+                velocity (ind/s)
+      accel   = ramp acceleration (ind/s^2)
+      dist    = position ramp distance (ind). Alternate runs move in
+                opposite directions.
+      ramps   = ramps to benchmark, 'vel' and/or 'pos'
+      verbose = print progress 
+
+    Return: list of metric dictionaries with additional keys 'ramp' 
+            and 'dt'.
+    """
+    results = []
+    for dt in dt_list:
+        for i in range(repeat):
+            for ramp in ramps:
+                if verbose:
+                    print 'ramp: %s, dt: %1.3f, run: %d'%(ramp, dt, i)
+                if ramp == 'vel':
+                    metrics = bench_ramp_to_vel(dev,vel=vel,accel=accel,dt=dt)
+                    dev.stop()
+                elif ramp == 'pos':
+                    metrics = bench_ramp_to_pos(dev,dist=dist*(-1)**i,accel=accel,pos_vel=vel,dt=dt)
+                else:
+                    raise ValueError, "unknown ramp %s"%(ramp,)
+                metrics['ramp'] = ramp
+                metrics['dt'] = dt
+                results.append(metrics)
+    dev.stop()
+    return results
+
+def summarize(results):
+    """
+    Averages benchmark results over runs with the same ramp and dt.
+
+    Arguments:
+      results = list of metric dictionaries from run_benchmark
+
+    Return: list of averaged metric dictionaries
+    """
+    groups = {}
+    order = []
+    for metrics in results:
+        key = (metrics['ramp'], metrics['dt'])
+        if not key in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(metrics)
+    summary = []
+    for key in order:
+        avg = {'ramp': key[0], 'dt': key[1], 'runs': len(groups[key])}
+        for name, fmt, units in METRIC_LIST:
+            vals = [m[name] for m in groups[key] if m[name] is not None]
+            if len(vals) == len(groups[key]):
+                avg[name] = _mean(vals)
+            else:
+                # Ramp failed to complete in at least one run
+                avg[name] = None
+        summary.append(avg)
+    return summary
+
+def print_report(results):
+    """
+    Prints a table of benchmark results averaged over runs.
+
+    Arguments:
+      results = list of metric dictionaries from run_benchmark
+
+    Return: None
+    """
+    summary = summarize(results)
+    header = '%-4s %6s'%('ramp','dt') + ''.join([' %17s'%(name,) for name, fmt, units in METRIC_LIST])
+    print header
+    print '-'*len(header)
+    for avg in summary:
+        line = '%-4s %6.3f'%(avg['ramp'], avg['dt'])
+        for name, fmt, units in METRIC_LIST:
+            if avg[name] is None:
+                line += ' %17s'%('-',)
+            else:
+                line += ' %17s'%(fmt%(avg[name],)).strip()
+        print line
+    print
+    print 'units: ' + ', '.join(['%s (%s)'%(name, units) for name, fmt, units in METRIC_LIST if units])
+    return
+
+def _sample_during(dev,func,args,kwargs,sample_dt,settle_time):
+    """
+    Runs func in a separate thread while sampling the device position,
+    velocity and direction. Sampling continues for settle_time after 
+    func returns.
+
+    Return: list of (time, position, velocity, direction) samples
+    """
+    error = []
+    def run():
+        try:
+            func(*args,**kwargs)
+        except Exception, err:
+            error.append(err)
+    thread = threading.Thread(target=run)
+    thread.setDaemon(True)
+    samples = []
+    thread.start()
+    t_done = None
+    while t_done is None or time.time() < t_done + settle_time:
+        t = time.time()
+        pos = dev.get_pos()
+        vel = dev.get_vel()
+        dir = dev.get_dir(ret_type='int')
+        samples.append((0.5*(t + time.time()), pos, vel, dir))
+        if t_done is None and not thread.isAlive():
+            t_done = time.time()
+        time.sleep(sample_dt)
+    thread.join()
+    if error:
+        raise error[0]
+    return samples
+
+def _ramp_metrics(cmd_list,vel_list,vel_ideal,accel_ideal,dt):
+    """
+    Computes the acceleration error, velocity error and update timing 
+    metrics from the commanded and achieved velocity timelines.
+    """
+    # Commanded acceleration between set-point updates. Starts at the 
+    # first update - the time from the start of the ramp to the first 
+    # update is the command latency, not part of the commanded ramp.
+    accel_err = []
+    if len(cmd_list) > 0:
+        t_prev, v_prev = cmd_list[0]
+    for t, v in cmd_list[1:]:
+        if t > t_prev:
+            accel = (v - v_prev)/(t - t_prev)
+            accel_err.append(accel - accel_ideal(0.5*(t + t_prev)))
+        t_prev, v_prev = t, v
+
+    # Update intervals - the last update of a ramp isn't periodic
+    dt_list = [t1 - t0 for (t0, v0), (t1, v1) in zip(cmd_list[:-1], cmd_list[1:])]
+    dt_list = dt_list[:-1]
+
+    vel_err = [v - vel_ideal(t) for t, v in vel_list]
+    return {
+        'accel_rms_err'     : _rms(accel_err),
+        'vel_rms_err'       : _rms(vel_err),
+        'update_dt_mean'    : _mean(dt_list),
+        'update_dt_std'     : _std(dt_list),
+        'update_jitter_max' : max([0.0] + [abs(x - dt) for x in dt_list]),
+        'num_updates'       : len(cmd_list),
+        }
+
+def _sub(x, y):
+    if x is None or y is None:
+        return None
+    return x - y
+
+def _mean(x):
+    if len(x) == 0:
+        return None
+    return sum(x)/float(len(x))
+
+def _std(x):
+    if len(x) < 2:
+        return None
+    m = _mean(x)
+    return math.sqrt(sum([(xi - m)**2 for xi in x])/float(len(x) - 1))
+
+def _rms(x):
+    if len(x) == 0:
+        return None
+    return math.sqrt(sum([xi**2 for xi in x])/float(len(x)))
@@ -0,0 +1,422 @@
+"""
+-----------------------------------------------------------------------
+simple_step
+Copyright (C) William Dickson, 2008.
+
+wbd@caltech.edu
+www.willdickson.com
+
+Released under the LGPL Licence, Version 3
+
+This file is part of simple_step.
+
+simple_step is free software: you can redistribute it and/or modify it
+under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+simple_step is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with simple_step.  If not, see
+<http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------------------
+
+Purpose: Provides a motion recorder for the at90usb based stepper motor
+controller. One or more devices are sampled at a fixed rate into
+preallocated column buffers. Full buffers are handed to a writer 
+thread, so that disk writes don't delay sampling, and written to disk 
+as .npy chunk files, one per column. A json index records the time 
+range of each chunk. Two sets of buffers are used, one being filled 
+while the other is written, so memory use is constant regardless of 
+the length of the recording. Recordings are read lazily, via memory mapping, with the
+Recording class.
+
+Requires numpy.
+
+Author: William Dickson
+
+------------------------------------------------------------------------
+"""
+import os
+import time
+import json
+import threading
+import Queue
+import numpy
+
+# Recorded fields - device getter method and data type
+FIELD_DICT = {
+    'pos'       : ('get_pos',       'int32'),
+    'vel'       : ('get_vel',       'int32'),
+    'pos_err'   : ('get_pos_err',   'int32'),
+    'pos_setpt' : ('get_pos_setpt', 'int32'),
+    'vel_setpt' : ('get_vel_setpt', 'int32'),
+    'eff_vel'   : ('get_eff_vel',   'float64'),
+    }
+DEFAULT_FIELDS = ('pos', 'vel')
+TIME_COLUMN = 't'
+
+# Defaults
+DEFAULT_RATE = 100.0
+DEFAULT_CHUNK_SIZE = 10000
+
+INDEX_FILE = 'index.json'
+CHUNK_FILE_FMT = '%s_%06d.npy'
+
+class Recorder:
+
+    """
+    Samples one or more devices at a fixed rate and records the samples
+    to a directory of .npy chunk files. The columns of the recording are
+    the host time of each sample, 't', and the fields of each device,
+    e.g. 'pos_0', 'vel_0', 'pos_1', ...  where the number is the index
+    of the device in the device list.
+    """
+
+    def __init__(self,dev_list,path,rate=DEFAULT_RATE,fields=DEFAULT_FIELDS,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Initialize recorder.
+
+        Arguments:
+          dev_list = list of Simple_Step devices (or a Simple_Step_Pool)
+          path     = recording directory. Created if it doesn't exist.
+
+        Keywords:
+          rate       = sample rate (Hz)
+          fields     = device fields to record - see FIELD_DICT
+          chunk_size = number of samples per chunk file
+
+        Return: None
+        """
+        self.dev_list = list(dev_list)
+        self.path = path
+        self.rate = float(rate)
+        self.chunk_size = int(chunk_size)
+        for field in fields:
+            if not field in FIELD_DICT:
+                raise ValueError, "unknown field %s"%(field,)
+        self.fields = tuple(fields)
+        if os.path.exists(os.path.join(self.path, INDEX_FILE)):
+            raise RuntimeError, "recording already exists in %s"%(self.path,)
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        # Preallocate column buffers - the buffers being filled and a 
+        # free set for when they are handed to the writer thread
+        self.columns = [(TIME_COLUMN, 'float64')]
+        for i in range(len(self.dev_list)):
+            for field in self.fields:
+                self.columns.append(('%s_%d'%(field,i), FIELD_DICT[field][1]))
+        self.buffers = self.__new_buffers()
+        self.free_buffers = Queue.Queue()
+        self.free_buffers.put(self.__new_buffers())
+        self.num = 0
+        self.num_chunks = 0
+        self.num_handed = 0
+
+        # Chunk writer thread and queue of (chunk number, buffers, number
+        # of samples) to write
+        self.writer = None
+        self.write_queue = Queue.Queue()
+        self.write_error = None
+
+        self.index = {
+            'rate'       : self.rate,
+            'fields'     : self.fields,
+            'columns'    : self.columns,
+            'serial_numbers' : [dev.get_serial_number() for dev in self.dev_list],
+            'chunks'     : [],
+            }
+        self.overruns = 0
+        self.errors = 0
+        self.thread = None
+        self.thread_stop = threading.Event()
+        self.__write_index()
+
+    def start(self):
+        """
+        Starts recording in a background thread.
+
+        Arguments: None
+
+        Return: None
+        """
+        if self.thread is not None:
+            return
+        self.thread_stop.clear()
+        self.thread = threading.Thread(target=self.__record_loop)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        return
+
+    def stop(self):
+        """
+        Stops recording, writes any buffered samples to disk and stops 
+        the writer thread. Raises any error which occured while writing.
+
+        Arguments: None
+
+        Return: None
+        """
+        if self.thread is not None:
+            self.thread_stop.set()
+            self.thread.join()
+            self.thread = None
+        self.flush()
+        if self.writer is not None:
+            self.write_queue.put(None)
+            self.writer.join()
+            self.writer = None
+        return
+
+    def sample(self):
+        """
+        Reads the recorded fields from all devices and adds the sample to
+        the buffers. The buffers are handed to the writer thread when 
+        full.
+
+        Arguments: None
+
+        Return: None
+        """
+        t0 = time.time()
+        values = []
+        for dev in self.dev_list:
+            for field in self.fields:
+                values.append(getattr(dev, FIELD_DICT[field][0])())
+        t1 = time.time()
+
+        n = self.num
+        self.buffers[TIME_COLUMN][n] = 0.5*(t0 + t1)
+        for (name, dtype), value in zip(self.columns[1:], values):
+            self.buffers[name][n] = value
+        self.num += 1
+        if self.num == self.chunk_size:
+            self.__hand_off()
+        return
+
+    def flush(self):
+        """
+        Writes buffered samples to a new chunk file and updates the index.
+        Returns once all chunks have been written. Raises any error which
+        occured while writing.
+
+        Arguments: None
+
+        Return: None
+        """
+        self.__hand_off()
+        self.write_queue.join()
+        err = self.write_error
+        if err is not None:
+            self.write_error = None
+            raise err
+        return
+
+    def get_stats(self):
+        """
+        Returns recording statistics.
+
+        Arguments: None
+
+        Return: dictionary with keys 'samples' (total number of samples),
+                'overruns' (number of missed sample times) and 'errors'
+                (number of failed samples).
+        """
+        samples = self.num_handed + self.num
+        return {'samples': samples, 'overruns': self.overruns, 'errors': self.errors}
+
+    def __new_buffers(self):
+        """
+        Returns a new set of column buffers.
+        """
+        buffers = {}
+        for name, dtype in self.columns:
+            buffers[name] = numpy.zeros((self.chunk_size,), dtype=dtype)
+        return buffers
+
+    def __hand_off(self):
+        """
+        Hands the buffered samples to the writer thread and switches to 
+        the free set of buffers. Waits if the writer is still writing the
+        previous chunk.
+        """
+        n = self.num
+        if n == 0:
+            return
+        if self.writer is None:
+            self.writer = threading.Thread(target=self.__write_loop)
+            self.writer.setDaemon(True)
+            self.writer.start()
+        self.write_queue.put((self.num_chunks, self.buffers, n))
+        self.num_chunks += 1
+        self.num_handed += n
+        self.buffers = self.free_buffers.get()
+        self.num = 0
+        return
+
+    def __write_loop(self):
+        """
+        Chunk writer thread. Writes the chunks handed off by __hand_off 
+        until it is given None. Write errors are kept and raised by flush.
+        """
+        while True:
+            item = self.write_queue.get()
+            try:
+                if item is None:
+                    return
+                chunk_num, buffers, n = item
+                try:
+                    self.__write_chunk(chunk_num, buffers, n)
+                except (IOError, OSError), err:
+                    self.write_error = err
+                self.free_buffers.put(buffers)
+            finally:
+                self.write_queue.task_done()
+
+    def __write_chunk(self,chunk_num,buffers,n):
+        """
+        Writes the first n samples of a set of buffers to chunk files and
+        updates the index.
+        """
+        for name, dtype in self.columns:
+            filename = os.path.join(self.path, CHUNK_FILE_FMT%(name, chunk_num))
+            numpy.save(filename, buffers[name][:n])
+        t = buffers[TIME_COLUMN]
+        self.index['chunks'].append({
+            'num'     : n,
+            't_start' : float(t[0]),
+            't_end'   : float(t[n-1]),
+            })
+        self.__write_index()
+        return
+
+    def __write_index(self):
+        """
+        Writes the index file. A temporary file is renamed into place so
+        that readers never see a partially written index.
+        """
+        filename = os.path.join(self.path, INDEX_FILE)
+        tmp_filename = filename + '.tmp'
+        fid = open(tmp_filename, 'w')
+        try:
+            json.dump(self.index, fid, indent=1)
+        finally:
+            fid.close()
+        os.rename(tmp_filename, filename)
+        return
+
+    def __record_loop(self):
+        """
+        Background recording thread. Samples are scheduled on a fixed
+        time grid so that the sample rate does not drift. If a sample
+        time is missed the sample is skipped.
+        """
+        dt = 1.0/self.rate
+        t_next = time.time()
+        while not self.thread_stop.isSet():
+            try:
+                self.sample()
+            except IOError, err:
+                self.errors += 1
+            t_next += dt
+            t_now = time.time()
+            if t_now > t_next:
+                missed = int((t_now - t_next)/dt) + 1
+                self.overruns += missed
+                t_next += missed*dt
+            self.thread_stop.wait(t_next - t_now)
+        return
+
+class Recording:
+
+    """
+    Lazy reader for recordings made with Recorder. Chunk files are memory
+    mapped and only the requested samples are read from disk.
+    """
+
+    def __init__(self,path):
+        """
+        Open recording.
+
+        Arguments:
+          path = recording directory
+
+        Return: None
+        """
+        self.path = path
+        self.reload()
+
+    def reload(self):
+        """
+        Rereads the index. Picks up chunks written since the recording
+        was opened, e.g., when reading a recording in progress.
+
+        Arguments: None
+
+        Return: None
+        """
+        fid = open(os.path.join(self.path, INDEX_FILE), 'r')
+        try:
+            self.index = json.load(fid)
+        finally:
+            fid.close()
+        self.chunks = self.index['chunks']
+        self.columns = [name for name, dtype in self.index['columns']]
+        return
+
+    def __len__(self):
+        return sum([c['num'] for c in self.chunks])
+
+    def get_chunk(self,name,chunk_num):
+        """
+        Returns a memory mapped array of a column for a single chunk.
+
+        Arguments:
+          name      = column name, e.g. 't' or 'pos_0'
+          chunk_num = chunk number
+
+        Return: read only memory mapped array
+        """
+        if not name in self.columns:
+            raise ValueError, "unknown column %s"%(name,)
+        filename = os.path.join(self.path, CHUNK_FILE_FMT%(name, chunk_num))
+        return numpy.load(filename, mmap_mode='r')
+
+    def get(self,name,t_start=None,t_end=None):
+        """
+        Returns column samples in the time range t_start <= t <= t_end.
+        Only chunks which overlap the time range are read.
+
+        Arguments:
+          name = column name, e.g. 't' or 'pos_0'
+
+        Keywords:
+          t_start = start time (sec). If None the start of the recording.
+          t_end   = end time (sec). If None the end of the recording.
+
+        Return: array of samples
+        """
+        parts = []
+        for chunk_num, chunk in enumerate(self.chunks):
+            if t_start is not None and chunk['t_end'] < t_start:
+                continue
+            if t_end is not None and chunk['t_start'] > t_end:
+                continue
+            t = self.get_chunk(TIME_COLUMN, chunk_num)
+            i0, i1 = 0, chunk['num']
+            if t_start is not None:
+                i0 = numpy.searchsorted(t, t_start, side='left')
+            if t_end is not None:
+                i1 = numpy.searchsorted(t, t_end, side='right')
+            parts.append(self.get_chunk(name, chunk_num)[i0:i1])
+        if len(parts) == 0:
+            dtype = dict(self.index['columns'])[name]
+            return numpy.zeros((0,), dtype=dtype)
+        return numpy.concatenate(parts)
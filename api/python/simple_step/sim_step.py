@@ -0,0 +1,344 @@
+"""
+-----------------------------------------------------------------------
+simple_step
+Copyright (C) William Dickson, 2008.
+
+wbd@caltech.edu
+www.willdickson.com
+
+Released under the LGPL Licence, Version 3
+
+This file is part of simple_step.
+
+simple_step is free software: you can redistribute it and/or modify it
+under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+simple_step is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with simple_step.  If not, see
+<http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------------------
+
+Purpose: Provides a simulated at90usb based stepper motor controller. 
+Sim_Step is a Simple_Step opened with a Sim_Transport in place of the
+usb device. The transport handles the usb command packets with a simple
+model of the firmware which integrates the motor position in host time.
+Commands take a configurable time, to model the usb round trip. The 
+simulated device is intended for benchmarking and testing host side 
+code, e.g., the soft ramp helpers, without hardware.
+
+Only the basic motion commands are simulated: modes, status, set-points,
+position, velocity, direction, enable, acceleration and the clock. 
+Staged moves, triggers, latches, homing, DIO patterns, input capture
+and motion programs are not.
+
+Author: William Dickson
+
+------------------------------------------------------------------------
+"""
+import time
+import math
+import random
+import struct
+import threading
+from simple_step import *
+
+# Simulated device velocity limits - as computed by the firmware
+SIM_MAX_VEL = 50000
+SIM_MIN_VEL = 16
+
+# Default simulated usb round trip time (sec)
+DEFAULT_SIM_LATENCY = 0.001
+
+class Sim_Step(Simple_Step):
+
+    """
+    Simulated stepper motor controller. 
+    """
+
+    def __init__(self,serial_number='sim',latency=DEFAULT_SIM_LATENCY,jitter=0.0,
+                 threaded=True):
+        """
+        Initialize simulated device. 
+
+        Keywords:
+          serial_number = serial number string returned by the simulated
+                          device.
+          latency       = usb round trip time (sec) of each command
+          jitter        = maximum random additional round trip time (sec)
+          threaded      = True (default) or False. If True the transfers
+                          are performed by the I/O worker thread so the 
+                          simulated device may be shared by many threads,
+                          see Simple_Step.
+
+        Return: None
+        """
+        transport = Sim_Transport(serial_number, latency=latency, jitter=jitter)
+        Simple_Step.__init__(self, transport=transport, threaded=threaded)
+        self.open_options = {
+            'serial_number' : serial_number,
+            'latency'       : latency,
+            'jitter'        : jitter,
+            'threaded'      : threaded,
+            }
+
+
+class Sim_Transport:
+
+    """
+    Simulated usb device. Stands in for the usb device, handling the 
+    command packets with a simple model of the firmware. Replies always 
+    carry an int32 value.
+    """
+
+    def __init__(self,serial_number='sim',latency=DEFAULT_SIM_LATENCY,jitter=0.0):
+        """
+        Initialize simulated usb device. 
+
+        Keywords:
+          serial_number = serial number string returned by the device
+          latency       = usb round trip time (sec) of each command
+          jitter        = maximum random additional round trip time (sec)
+
+        Return: None
+        """
+        self.serial_number = serial_number
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.reply = None
+        self.reply_dt = 0.0
+        self.sim_lock = threading.Lock()
+        self.sim_t0 = time.time()
+        self.sim_t_last = self.sim_t0
+        self.sim_state = {
+            'mode'      : VELOCITY_MODE,
+            'status'    : STOPPED,
+            'enable'    : ENABLED,
+            'ext_int'   : DISABLED,
+            'step_mode' : STEP_MODE_FIXED,
+            'pos'       : 0.0,
+            'vel'       : 0.0,
+            'ramp_vel'  : 0.0,
+            'pos_setpt' : 0,
+            'pos_vel'   : 5000,
+            'vel_setpt' : 0,
+            'dir_setpt' : POSITIVE,
+            'dir'       : POSITIVE,
+            'accel'     : 0,
+            }
+
+    def write(self,packet,timeout):
+        """
+        Simulated bulk out transfer. The command is processed half way
+        through the round trip time and the reply kept for read.
+        """
+        dt = self.latency
+        if self.jitter > 0:
+            dt += random.uniform(0.0, self.jitter)
+        time.sleep(0.5*dt)
+        cmd_id, ctl_byte = ord(packet[0]), ord(packet[1])
+        if cmd_id in SET_TYPE_DICT:
+            val = unpack_value(packet[2:6], SET_TYPE_DICT[cmd_id])
+        else:
+            val = None
+        self.sim_lock.acquire()
+        try:
+            t = time.time()
+            self.__advance(t)
+            ret = self.__process(cmd_id, val)
+            stamp = int(1.0e6*(t - self.sim_t0)) & 0xFFFF
+        finally:
+            self.sim_lock.release()
+        self.reply = struct.pack('<BBIH', cmd_id, USB_CTL_INT32, ret & 0xFFFFFFFF, stamp)
+        self.reply_dt = 0.5*dt
+        return len(packet)
+
+    def read(self,timeout):
+        """
+        Simulated bulk in transfer. Returns the reply to the last command
+        or None if there is none.
+        """
+        reply, self.reply = self.reply, None
+        if reply is None:
+            return None
+        time.sleep(self.reply_dt)
+        return reply
+
+    def get_serial_number(self):
+        return self.serial_number
+
+    def get_manufacturer(self):
+        return 'simulated'
+
+    def get_product(self):
+        return 'simulated simple_step'
+
+    def get_vendor_id(self):
+        return USB_VENDOR_ID
+
+    def get_product_id(self):
+        return USB_PRODUCT_ID
+
+    def close(self):
+        return
+
+    def __process(self,cmd_id,val):
+        """
+        Simulated firmware command processing. Returns the value which 
+        would be returned by the device. 
+        """
+        s = self.sim_state
+        if cmd_id == USB_CMD_GET_POS:
+            return int(round(s['pos']))
+        elif cmd_id == USB_CMD_SET_POS_SETPT:
+            s['pos_setpt'] = int(val)
+            return s['pos_setpt']
+        elif cmd_id == USB_CMD_GET_POS_SETPT:
+            return s['pos_setpt']
+        elif cmd_id == USB_CMD_SET_VEL_SETPT:
+            s['vel_setpt'] = min(max(int(val) & 0xFFFF, SIM_MIN_VEL), SIM_MAX_VEL)
+            return s['vel_setpt']
+        elif cmd_id == USB_CMD_GET_VEL_SETPT:
+            return s['vel_setpt']
+        elif cmd_id == USB_CMD_GET_VEL:
+            return int(abs(s['vel']))
+        elif cmd_id == USB_CMD_SET_DIR_SETPT:
+            if val in (POSITIVE, NEGATIVE):
+                s['dir_setpt'] = val
+            return s['dir_setpt']
+        elif cmd_id == USB_CMD_GET_DIR_SETPT:
+            return s['dir_setpt']
+        elif cmd_id == USB_CMD_SET_MODE:
+            if val in (VELOCITY_MODE, POSITION_MODE):
+                s['mode'] = val
+            return s['mode']
+        elif cmd_id == USB_CMD_GET_MODE:
+            return s['mode']
+        elif cmd_id == USB_CMD_SET_POS_VEL:
+            s['pos_vel'] = min(max(int(val), SIM_MIN_VEL), SIM_MAX_VEL)
+            return s['pos_vel']
+        elif cmd_id == USB_CMD_GET_POS_VEL:
+            return s['pos_vel']
+        elif cmd_id == USB_CMD_GET_POS_ERR:
+            return s['pos_setpt'] - int(round(s['pos']))
+        elif cmd_id == USB_CMD_SET_ZERO_POS:
+            s['pos_setpt'] -= int(val)
+            s['pos'] -= int(val)
+            return 0
+        elif cmd_id == USB_CMD_GET_MAX_VEL:
+            return SIM_MAX_VEL
+        elif cmd_id == USB_CMD_GET_MIN_VEL:
+            return SIM_MIN_VEL
+        elif cmd_id == USB_CMD_GET_BUILD_ID:
+            return 0
+        elif cmd_id == USB_CMD_GET_STATUS:
+            return s['status']
+        elif cmd_id == USB_CMD_SET_STATUS:
+            if val in (RUNNING, STOPPED, ARMED):
+                s['status'] = val
+            return s['status']
+        elif cmd_id == USB_CMD_GET_DIR:
+            return s['dir']
+        elif cmd_id == USB_CMD_SET_ENABLE:
+            if val in (ENABLED, DISABLED):
+                s['enable'] = val
+            return s['enable']
+        elif cmd_id == USB_CMD_GET_ENABLE:
+            return s['enable']
+        elif cmd_id in (USB_CMD_SET_DIO_HI, USB_CMD_SET_DIO_LO):
+            return 0
+        elif cmd_id == USB_CMD_SET_EXT_INT:
+            if val in VAL2EXT_INT_DICT:
+                s['ext_int'] = val
+            return s['ext_int']
+        elif cmd_id == USB_CMD_GET_EXT_INT:
+            return s['ext_int']
+        elif cmd_id == USB_CMD_SET_STEP_MODE:
+            if val in VAL2STEP_MODE_DICT:
+                s['step_mode'] = val
+            return s['step_mode']
+        elif cmd_id == USB_CMD_GET_STEP_MODE:
+            return s['step_mode']
+        elif cmd_id == USB_CMD_GET_EFF_VEL:
+            return int(abs(s['vel']))*1000
+        elif cmd_id == USB_CMD_SET_ACCEL:
+            s['accel'] = min(max(int(val), 0), 1000000)
+            return s['accel']
+        elif cmd_id == USB_CMD_GET_ACCEL:
+            return s['accel']
+        elif cmd_id == USB_CMD_GET_CLOCK:
+            return int(1.0e6*(time.time() - self.sim_t0)) & 0xFFFFFFFF
+        elif cmd_id == USB_CMD_TEST:
+            return 1
+        else:
+            raise RuntimeError, "command %d not supported by simulated device"%(cmd_id,)
+
+    def __advance(self,t):
+        """
+        Advances the simulated motor to time t. 
+        """
+        s = self.sim_state
+        dt = t - self.sim_t_last
+        self.sim_t_last = t
+        if dt <= 0:
+            return
+        if s['status'] != RUNNING:
+            s['vel'] = 0.0
+            s['ramp_vel'] = 0.0
+            return
+
+        if s['mode'] == VELOCITY_MODE:
+            target = float(s['vel_setpt'])
+            if s['dir_setpt'] == NEGATIVE:
+                target = -target
+            if s['accel'] == 0:
+                v0 = v1 = target
+                s['pos'] += target*dt
+            else:
+                # Constant acceleration toward set-point
+                v0 = s['ramp_vel']
+                t_ramp = abs(target - v0)/float(s['accel'])
+                if t_ramp >= dt:
+                    v1 = v0 + math.copysign(s['accel']*dt, target - v0)
+                    s['pos'] += 0.5*(v0 + v1)*dt
+                else:
+                    v1 = target
+                    s['pos'] += 0.5*(v0 + v1)*t_ramp + v1*(dt - t_ramp)
+                s['ramp_vel'] = v1
+            s['vel'] = v1
+        else:
+            # Move toward set-point at positioning velocity
+            err = s['pos_setpt'] - s['pos']
+            step = s['pos_vel']*dt
+            if abs(err) <= step:
+                s['pos'] = float(s['pos_setpt'])
+                s['vel'] = 0.0
+            else:
+                s['pos'] += math.copysign(step, err)
+                s['vel'] = math.copysign(s['pos_vel'], err)
+
+        if s['vel'] > 0:
+            s['dir'] = POSITIVE
+        elif s['vel'] < 0:
+            s['dir'] = NEGATIVE
+        return
+
+def unpack_value(data,int_type):
+    """
+    Unpacks the value of a usb command packet.
+
+    Arguments:
+      data     = the packet's data bytes
+      int_type = the integer type specifier 'uint8', 'uint16' or 'int32'
+
+    Return: the value
+    """
+    fmt = {'uint8': '<B', 'uint16': '<H', 'int32': '<i'}[int_type]
+    return struct.unpack(fmt, data[:struct.calcsize(fmt)])[0]
@@ -33,12 +33,22 @@ Author: William Dickson
 
 ------------------------------------------------------------------------
 """
-import pylibusb as usb
 import ctypes
 import sys
 import time
 import math
 import struct
+import threading
+import collections
+import weakref
+from lazy import Lazy_Module, Lazy_Attribute
+
+# Imported on first use - see lazy.py
+usb = Lazy_Module('pylibusb')
+motion_program = Lazy_Module('motion_program', globals())
+traffic = Lazy_Module('traffic', globals())
+profile_cache = Lazy_Module('profile_cache', globals())
+usbfs = Lazy_Module('usbfs', globals())
 
 def swap_dict(in_dict):
     """
@@ -62,7 +72,13 @@ USB_VENDOR_ID = 0x1781
 USB_PRODUCT_ID = 0x0BB0
 USB_BULKOUT_EP_ADDRESS = 0x01
 USB_BULKIN_EP_ADDRESS = 0x82
+USB_EVENT_EP_ADDRESS = 0x83
+USB_CAPTURE_EP_ADDRESS = 0x84
 USB_BUFFER_SIZE = 8
+USB_CAPTURE_BUFFER_SIZE = 64
+
+# Device clock frequency (Hz) - the device clock counts microseconds
+DEVICE_CLOCK_FREQ = 1.0e6
 
 # USB Command IDs
 USB_CMD_GET_POS = 0
@@ -90,6 +106,37 @@ USB_CMD_SET_DIO_HI=21
 USB_CMD_SET_DIO_LO=22
 USB_CMD_GET_EXT_INT=23
 USB_CMD_SET_EXT_INT=24
+USB_CMD_SET_STEP_MODE=25
+USB_CMD_GET_STEP_MODE=26
+USB_CMD_GET_EFF_VEL=27
+USB_CMD_SET_ACCEL=28
+USB_CMD_GET_ACCEL=29
+USB_CMD_FIRE_TRIG=30
+USB_CMD_GET_CLOCK=31
+USB_CMD_GET_STAGED=32
+USB_CMD_SET_POS_TRIG=33
+USB_CMD_SET_POS_TRIG_CFG=34
+USB_CMD_GET_POS_TRIG_CNT=35
+USB_CMD_GET_LATCH_CNT=36
+USB_CMD_GET_LATCH_TIME=37
+USB_CMD_GET_LATCH_POS=38
+USB_CMD_SET_HOME_PARAM=39
+USB_CMD_START_HOME=40
+USB_CMD_GET_HOME_STATE=41
+USB_CMD_SET_DIO_PORT=42
+USB_CMD_GET_DIO_PORT=43
+USB_CMD_SET_DIO_PAT=44
+USB_CMD_PLAY_DIO_PAT=45
+USB_CMD_GET_DIO_PAT=46
+USB_CMD_SET_CAPTURE=47
+USB_CMD_READ_CAPTURE=48
+USB_CMD_SET_PROG=49
+USB_CMD_RUN_PROG=50
+USB_CMD_GET_PROG=51
+USB_CMD_GET_BUILD_ID=52
+USB_CMD_SAVE_CONFIG=53
+USB_CMD_LOAD_CONFIG=54
+USB_CMD_STAGE_MOVE=55
 USB_CMD_AVR_RESET = 200
 USB_CMD_AVR_DFU_MODE = 201
 USB_CMD_TEST = 251
@@ -111,10 +158,18 @@ POSITION_MODE = 1
 POSITIVE = 0
 NEGATIVE = 1
 
+# Integer values for step generation modes - used in usb set/get
+STEP_MODE_FIXED = 0
+STEP_MODE_DDS = 1
+
 # Status Constants
+ARMED = 2
 RUNNING = 1
 STOPPED = 0
 
+# Default DIO pin used for sending trigger pulses
+DEFAULT_TRIG_PIN = 0
+
 # Enable Constants
 ENABLED = 1
 DISABLED = 0
@@ -126,6 +181,18 @@ ENABLE2VAL_DICT = {
 }
 VAL2ENABLE_DICT = swap_dict(ENABLE2VAL_DICT)
 
+# External interrupt latch-only mode - position is latched on each edge
+# but the motor is not stopped.
+EXT_INT_LATCH = 2
+
+# Dictionary of external interrupt settings
+EXT_INT2VAL_DICT = {
+    'enabled'  : ENABLED,
+    'disabled' : DISABLED,
+    'latch'    : EXT_INT_LATCH,
+}
+VAL2EXT_INT_DICT = swap_dict(EXT_INT2VAL_DICT)
+
 # Mapping from mode strings to integer values
 MODE2VAL_DICT = {
     'velocity' : VELOCITY_MODE,
@@ -133,6 +200,13 @@ MODE2VAL_DICT = {
 }
 VAL2MODE_DICT = swap_dict(MODE2VAL_DICT)
 
+# Mapping from step mode strings to integer values
+STEP_MODE2VAL_DICT = {
+    'fixed' : STEP_MODE_FIXED,
+    'dds'   : STEP_MODE_DDS,
+}
+VAL2STEP_MODE_DICT = swap_dict(STEP_MODE2VAL_DICT)
+
 # Mapping from direction strings to values
 DIR2VAL_DICT = {
     'positive' : POSITIVE,
@@ -154,6 +228,23 @@ SET_TYPE_DICT = {
     USB_CMD_SET_DIO_HI : 'uint8',
     USB_CMD_SET_DIO_LO : 'uint8',
     USB_CMD_SET_EXT_INT : 'uint8',
+    USB_CMD_SET_STEP_MODE : 'uint8',
+    USB_CMD_SET_ACCEL : 'int32',
+    USB_CMD_FIRE_TRIG : 'uint8',
+    USB_CMD_SET_POS_TRIG : 'int32',
+    USB_CMD_SET_POS_TRIG_CFG : 'uint16',
+    USB_CMD_SET_HOME_PARAM : 'int32',
+    USB_CMD_START_HOME : 'uint8',
+    USB_CMD_SET_DIO_PORT : 'uint8',
+    USB_CMD_SET_DIO_PAT : 'int32',
+    USB_CMD_PLAY_DIO_PAT : 'uint16',
+    USB_CMD_SET_CAPTURE : 'uint8',
+    USB_CMD_READ_CAPTURE : 'uint8',
+    USB_CMD_SET_PROG : 'int32',
+    USB_CMD_RUN_PROG : 'uint8',
+    USB_CMD_SAVE_CONFIG : 'uint8',
+    USB_CMD_LOAD_CONFIG : 'uint8',
+    USB_CMD_STAGE_MOVE : 'int32',
     }
 
 # Dictionary from type to USB_CTL values
@@ -164,13 +255,213 @@ TYPE2USB_CTL_DICT = {
     }
 USB_CTL2TYPE_DICT = swap_dict(TYPE2USB_CTL_DICT)
 
+# Position compare triggers
+POS_TRIG_TABLE_SIZE = 128
+DEFAULT_POS_TRIG_WIDTH = 20 # (us)
+POS_TRIG_WIDTH_MIN = 20 # (us)
+POS_TRIG_WIDTH_MAX = 2**16-1 
+
+# Dictionary of position trigger modes
+POS_TRIG_MODE2VAL_DICT = {
+    'off'    : 0,
+    'pulse'  : 1,
+    'toggle' : 2,
+    }
+VAL2POS_TRIG_MODE_DICT = swap_dict(POS_TRIG_MODE2VAL_DICT)
+
+# DIO pattern playback
+DIO_PAT_TABLE_SIZE = 64
+DIO_PAT_DURATION_MIN = 20 # (us)
+DIO_PAT_DURATION_MAX = 2**24-1 # (us)
+DIO_PAT_FOREVER = 2**16-1
+DIO_PAT_POLL_DT = 0.01
+
+# Homing parameter IDs and defaults
+HOME_PARAM_FAST_VEL = 0
+HOME_PARAM_SLOW_VEL = 1
+HOME_PARAM_BACKOFF = 2
+DEFAULT_HOME_FAST_VEL = 2000
+DEFAULT_HOME_SLOW_VEL = 100
+DEFAULT_HOME_BACKOFF = 200
+HOME_POLL_DT = 0.05
+
+# Dictionary of homing states 
+HOME_STATE2VAL_DICT = {
+    'none'    : 0,
+    'fast'    : 1,
+    'backoff' : 2,
+    'slow'    : 3,
+    'park'    : 4,
+    'done'    : 5,
+    'aborted' : 6,
+    'busy'    : 7,
+    }
+VAL2HOME_STATE_DICT = swap_dict(HOME_STATE2VAL_DICT)
+
+# Dictionary of motion program states
+PROG_STATE2VAL_DICT = {
+    'stopped' : 0,
+    'running' : 1,
+    'done'    : 2,
+    'aborted' : 3,
+    }
+VAL2PROG_STATE_DICT = swap_dict(PROG_STATE2VAL_DICT)
+PROG_POLL_DT = 0.01
+
+# Save configuration command values 
+CONFIG_ERASE = 0
+CONFIG_SAVE = 1
+
+# Event IDs for event records sent on the interrupt in endpoint
+EVENT_EXT_INT_STOP = 0
+EVENT_MOVE_DONE = 1
+EVENT_DIR_CHANGE = 2
+EVENT_TRIG_START = 3
+EVENT_NEXT_MOVE = 4
+EVENT_LATCH = 5
+EVENT_HOME_DONE = 6
+EVENT_DIO_PAT_DONE = 7
+EVENT_PROG_DONE = 8
+
+# Mapping from event strings to integer values
+EVENT2VAL_DICT = {
+    'ext_int_stop' : EVENT_EXT_INT_STOP,
+    'move_done'    : EVENT_MOVE_DONE,
+    'dir_change'   : EVENT_DIR_CHANGE,
+    'trig_start'   : EVENT_TRIG_START,
+    'next_move'    : EVENT_NEXT_MOVE,
+    'latch'        : EVENT_LATCH,
+    'home_done'    : EVENT_HOME_DONE,
+    'dio_pat_done' : EVENT_DIO_PAT_DONE,
+    'prog_done'    : EVENT_PROG_DONE,
+}
+VAL2EVENT_DICT = swap_dict(EVENT2VAL_DICT)
+
+# Events generated by the host rather than the device
+HOST_EVENT_LIST = ('reconnect',)
+
+# Idle timeout (sec) for the I/O worker thread. Sets how quickly the 
+# worker responds to being stopped.
+IO_WORKER_IDLE_TIMEOUT = 0.1
+
+# Set commands which may be coalesced - pending writes w/ the same command 
+# id are collapsed to the most recent value.
+COALESCE_CMD_IDS = (USB_CMD_SET_VEL_SETPT, USB_CMD_SET_POS_SETPT)
+
+# Safety commands and the values for which they are sent ahead of all
+# other queued commands by the I/O worker.
+PRIORITY_CMD_DICT = {
+    USB_CMD_SET_STATUS : STOPPED,
+    USB_CMD_SET_ENABLE : DISABLED,
+}
+
+# Commands, and the values, which would undo a safety command. Any still
+# queued when a safety command is submitted are failed rather than sent.
+UNDO_PRIORITY_CMD_DICT = {
+    USB_CMD_SET_STATUS : (RUNNING, ARMED),
+    USB_CMD_SET_ENABLE : (ENABLED,),
+}
+
+# Automatic reconnect - see set_reconnect. Settings written with these 
+# commands are restored after reconnecting, in this order. 
+RECONNECT_RESTORE_CMD_IDS = (
+    USB_CMD_SET_MODE,
+    USB_CMD_SET_STEP_MODE,
+    USB_CMD_SET_ACCEL,
+    USB_CMD_SET_ENABLE,
+    USB_CMD_SET_EXT_INT,
+    USB_CMD_SET_POS_VEL,
+    USB_CMD_SET_DIR_SETPT,
+    USB_CMD_SET_VEL_SETPT,
+    USB_CMD_SET_POS_SETPT,
+    )
+# Commands which change the device's state each time they are performed,
+# e.g., pop a FIFO, fire a pulse or write a table entry. They are not 
+# repeated after a reconnect as they may have reached the device before
+# it was lost.
+NO_REPLAY_CMD_IDS = (
+    USB_CMD_SET_ZERO_POS,
+    USB_CMD_FIRE_TRIG,
+    USB_CMD_SET_POS_TRIG,
+    USB_CMD_GET_LATCH_POS,
+    USB_CMD_START_HOME,
+    USB_CMD_SET_DIO_PAT,
+    USB_CMD_PLAY_DIO_PAT,
+    USB_CMD_SET_CAPTURE,
+    USB_CMD_READ_CAPTURE,
+    USB_CMD_SET_PROG,
+    USB_CMD_RUN_PROG,
+    USB_CMD_STAGE_MOVE,
+    USB_CMD_SAVE_CONFIG,
+    USB_CMD_LOAD_CONFIG,
+    USB_CMD_AVR_RESET,
+    USB_CMD_AVR_DFU_MODE,
+    )
+DEFAULT_RECONNECT_TIMEOUT = 5.0     # Give up after (sec)
+DEFAULT_RECONNECT_BACKOFF = 0.02    # Initial delay between attempts (sec)
+DEFAULT_RECONNECT_MAX_BACKOFF = 0.5 # Maximum delay between attempts (sec)
+
+# Input capture records - (pin, edge, device clock, position). Capture
+# packets start with the number of records and the number of dropped 
+# records. The device FIFO holds at most CAPTURE_FIFO_SIZE-1 records.
+CAPTURE_REC_FORMAT = '<BBIi'
+CAPTURE_REC_SIZE = struct.calcsize(CAPTURE_REC_FORMAT)
+CAPTURE_HEADER_SIZE = 2
+CAPTURE_FIFO_SIZE = 32
+CAPTURE_READ_TIMEOUT = 1000
+CAPTURE_EDGE_DICT = {0: 'falling', 1: 'rising'}
+
+# Poll period (sec) used by run_queue when waiting for staged moves
+QUEUE_POLL_DT = 0.01
+
+# Timeout (ms) for event endpoint reads - sets how quickly the event
+# listener thread responds to being stopped. 
+EVENT_READ_TIMEOUT = 100
+
 # Dictionary of status integets to strings 
 STATUS2VAL_DICT = {
     'running' : RUNNING,
     'stopped' : STOPPED,
+    'armed'   : ARMED,
 }
 VAL2STATUS_DICT = swap_dict(STATUS2VAL_DICT)
 
+# Registry of all open devices - used for broadcasting stop commands
+open_devices = weakref.WeakKeyDictionary()
+
+# Set once libusb has been initialized - it is initialized once per process
+libusb_initialized = False
+
+class IO_Request:
+
+    """
+    USB transfer submitted to the I/O worker thread. Holds the output 
+    packet and provides the reply slot for the submitting thread. 
+    """
+
+    def __init__(self,out_bytes,reply=True,key=None):
+        self.out_bytes = out_bytes
+        self.reply = reply
+        self.key = key
+        self.taken = False
+        self.detached = False
+        self.data = None
+        self.times = (None, None)
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self):
+        """
+        Wait for the transfer to complete. Raises any error which 
+        occured in the I/O worker in the waiting thread.
+
+        Return: the data returned by the usb device.
+        """
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.data
+
 def debug(val):
     if DEBUG==True:
         print >> sys.stderr, val
@@ -189,20 +480,179 @@ class Simple_Step:
     USB interface to the at90usb based stepper motor controller board.
     """
 
-    def __init__(self,serial_number=None):
+    def __init__(self,serial_number=None,threaded=False,transport=None,capture=None,
+                 lazy_limits=False,cache=False,rescan=True):
         """
         Open and initialize usb device.
         
         Arguments: None
+
+        Keywords:
+          serial_number = serial number of device to open. If None the
+                          first device found is opened.
+          threaded      = True or False (default). If True all usb 
+                          transfers are performed by a dedicated I/O worker
+                          thread so that the device can be shared safely 
+                          by many threads (see start_io_worker).
+          transport     = transport used in place of libusb, e.g. a 
+                          traffic.Replay_Transport or usbfs.Usbfs_Transport.
+                          If 'usbfs' the device is opened with a 
+                          Usbfs_Transport. If None (default) the device is 
+                          opened with libusb. A transport provides 
+                          write(packet,timeout), read(timeout), close() and 
+                          the device information methods get_serial_number
+                          etc. Events and input capture require the optional
+                          read_endpoint(endpoint,buf,timeout) and automatic
+                          reconnect the optional reopen().
+          capture       = traffic log file name. If not None usb traffic 
+                          is captured from the time the device is opened 
+                          (see start_capture). Logs to be replayed should
+                          be captured this way.
+          lazy_limits   = True or False (default). If True the maximum and
+                          minimum velocities, max_vel and min_vel, are 
+                          read from the device on first use rather than
+                          when the device is opened.
+          cache         = True, False (default) or cache file name. If not
+                          False static device information - descriptor 
+                          strings and velocity limits - is read from the 
+                          profile cache (see profile_cache.py) when the 
+                          firmware build identifier matches, and read from
+                          the device and cached otherwise. If True the 
+                          default cache file is used.
+          rescan        = True (default) or False. If True the usb busses
+                          are rescanned for devices before the device is
+                          found. If False the rescan is skipped when the 
+                          busses have already been scanned, e.g., when 
+                          opening several devices which are known to be
+                          present. Not used with a transport.
         
         Return: None.
         """
-        usb.init()
+        # Options for opening the device again - see get_open_options
+        self.open_options = {
+            'serial_number' : serial_number,
+            'threaded'      : threaded,
+            'transport'     : transport,
+            'lazy_limits'   : lazy_limits,
+            'cache'         : cache,
+            'rescan'        : rescan,
+            }
+
+        if transport == 'usbfs':
+            transport = usbfs.Usbfs_Transport(serial_number)
+        self.transport = transport
+        self.profile = None
+        if transport is None:
+            self.__open_libusb(serial_number, rescan=rescan)
+        else:
+            self.libusb_handle = None
+            self.dev = None
+
+        self.output_buffer = ctypes.create_string_buffer(USB_BUFFER_SIZE)
+        self.input_buffer = ctypes.create_string_buffer(USB_BUFFER_SIZE)
+        for i in range(USB_BUFFER_SIZE):
+            self.output_buffer[i] = chr(0x00)
+            self.input_buffer[i] = chr(0x00)
+
+        # Thread local storage for the device time stamp (lower 16 bits 
+        # of device clock) of the last reply and the host times at which 
+        # the command was sent and the reply received.
+        self.local = threading.local()
+
+        # I/O worker thread and submission queues 
+        self.io_priority_queue = collections.deque()
+        self.io_queue = collections.deque()
+        self.io_wakeup = threading.Event()
+        self.io_worker = None
+        self.io_worker_stop = threading.Event()
+        self.io_submit_lock = threading.Lock()
+
+        # Command coalescing - pending coalescable requests and statistics
+        self.coalesce = False
+        self.coalesce_wait = True
+        self.coalesce_lock = threading.Lock()
+        self.coalesce_pending = {}
+        self.coalesce_stats = {}
+        self.coalesce_error = None
+
+        # Set when the device is stopped or disabled - aborts high level 
+        # methods such as move_to_pos and soft_ramp_to_pos.
+        self.stop_requested = threading.Event()
+
+        # Stop latency statistics (sec)
+        self.stop_latency = {'last': None, 'max': None, 'total': 0.0, 'count': 0}
+
+        # Queue of (pos, pos_vel) moves for run_queue
+        self.move_queue = []
+
+        # Keeps latch position and time reads from different threads apart
+        self.latch_lock = threading.Lock()
+
+        # Event callbacks and listener thread
+        self.event_callbacks = {}
+        self.event_buffer = ctypes.create_string_buffer(USB_BUFFER_SIZE)
+        self.event_thread = None
+        self.event_thread_stop = threading.Event()
+
+        # Held by the event listener while it reads the event endpoint, 
+        # and by reconnect while it replaces the usb handle or transport
+        self.event_read_lock = threading.Lock()
+
+        # Traffic capture - see start_capture
+        self.trace_capture = None
+
+        # Communication error counts - see get_io_stats
+        self.io_stats = {'retries': 0, 'cmd_id_errors': 0, 'reconnects': 0}
+
+        # Automatic reconnect settings and the last value written with 
+        # each of the RECONNECT_RESTORE_CMD_IDS - see set_reconnect
+        self.reconnect = None
+        self.reconnect_lock = threading.Lock()
+        self.restore_state = {}
+
+        # Input capture buffer and dropped record count
+        self.capture_buffer = ctypes.create_string_buffer(USB_CAPTURE_BUFFER_SIZE)
+        self.capture_lock = threading.Lock()
+        self.capture_dropped = 0
+
+        open_devices[self] = True
+        if threaded == True:
+            self.start_io_worker()
+
+        if capture is not None:
+            self.start_capture(capture)
+
+        if cache:
+            self.__load_profile(cache, serial_number)
+
+        # Get max and min velocities - if lazy_limits these are read on
+        # first use, see max_vel and min_vel below.
+        if self.profile is None and not lazy_limits:
+            self.max_vel = self.get_max_vel()
+            self.min_vel = self.get_min_vel()
+
+    # Velocity limits. Set when the device is opened, or, if it was opened
+    # with lazy_limits=True, read from the device on first use.
+    max_vel = Lazy_Attribute('max_vel', 'get_max_vel')
+    min_vel = Lazy_Attribute('min_vel', 'get_min_vel')
+            
+    def __open_libusb(self,serial_number,rescan=True):
+        """
+        Finds the device, by serial number if given, and opens it with
+        libusb. If rescan is True (default) the usb busses are rescanned
+        for devices, so that devices which have been plugged in or 
+        re-enumerated are found. If False they are only scanned if they
+        have not been scanned before.
+        """
+        global libusb_initialized
+        if not libusb_initialized:
+            usb.init()
+            libusb_initialized = True
 
         #usb.set_debug(3)
         
         # Get usb busses
-        if not usb.get_busses():
+        if rescan or not usb.get_busses():
             usb.find_busses()            
             usb.find_devices()
         busses = usb.get_busses()
@@ -239,6 +689,7 @@ class Simple_Step:
                     break
                 else:
                     ret = usb.close(self.libusb_handle)
+                    self.libusb_handle = None
             if not found:
                 raise RuntimeError("Cannot find device w/ serial number %s."%(serial_number,))
 
@@ -256,17 +707,42 @@ class Simple_Step:
 
         usb.set_configuration(self.libusb_handle, dev.config[0].bConfigurationValue)
         usb.claim_interface(self.libusb_handle, interface_nr)
+        return
 
-        self.output_buffer = ctypes.create_string_buffer(USB_BUFFER_SIZE)
-        self.input_buffer = ctypes.create_string_buffer(USB_BUFFER_SIZE)
-        for i in range(USB_BUFFER_SIZE):
-            self.output_buffer[i] = chr(0x00)
-            self.input_buffer[i] = chr(0x00)
+    def __load_profile(self,cache,serial_number):
+        """
+        Loads the device profile from the profile cache, validated with 
+        the firmware build identifier. On a cache miss the profile is 
+        read from the device and added to the cache.
+        """
+        if cache is True:
+            cache = profile_cache.Profile_Cache()
+        else:
+            cache = profile_cache.Profile_Cache(cache)
+        if serial_number is None:
+            serial_number = self.get_serial_number()
+        build_id = self.get_build_id()
+        profile = cache.get(serial_number, build_id=build_id)
+        if profile is None:
+            profile = {
+                'serial_number' : serial_number,
+                'build_id'      : build_id,
+                'manufacturer'  : self.get_manufacturer(),
+                'product'       : self.get_product(),
+                'vendor_id'     : self.get_vendor_id(),
+                'product_id'    : self.get_product_id(),
+                'max_vel'       : self.get_max_vel(),
+                'min_vel'       : self.get_min_vel(),
+                }
+            try:
+                cache.put(profile)
+            except (IOError, OSError), err:
+                debug("unable to write profile cache: %s"%(err,))
+        self.profile = profile
+        self.max_vel = profile['max_vel']
+        self.min_vel = profile['min_vel']
+        return
 
-        # Get max and min velocities
-        self.max_vel = self.get_max_vel()
-        self.min_vel = self.get_min_vel()
-            
     def close(self):
         """
         Close usb device.
@@ -275,12 +751,545 @@ class Simple_Step:
         
         Return: None
         """
-        ret = usb.close(self.libusb_handle)
+        self.stop_event_listener()
+        self.stop_io_worker()
+        self.stop_capture()
+        open_devices.pop(self, None)
+        if self.transport is not None:
+            self.transport.close()
+        else:
+            ret = usb.close(self.libusb_handle)
+        return
+
+    def start_capture(self,filename):
+        """
+        Starts capturing usb traffic. Every packet sent to and received 
+        from the command endpoints is written, with the host time, to 
+        a binary traffic log. See the traffic module for reading and 
+        replaying logs.
+
+        Arguments:
+          filename = traffic log file name
+
+        Return: None
+        """
+        self.stop_capture()
+        info = {
+            'serial_number' : self.get_serial_number(),
+            'manufacturer'  : self.get_manufacturer(),
+            'product'       : self.get_product(),
+            'vendor_id'     : self.get_vendor_id(),
+            'product_id'    : self.get_product_id(),
+            }
+        self.trace_capture = traffic.Traffic_Capture(filename, info=info)
+        return
+
+    def stop_capture(self):
+        """
+        Stops capturing usb traffic and closes the traffic log.
+
+        Arguments: None
+
+        Return: None
+        """
+        trace_capture = self.trace_capture
+        self.trace_capture = None
+        if trace_capture is not None:
+            trace_capture.close()
         return
 
+    # -------------------------------------------------------------------------
+    # Methods for the I/O worker thread
+
+    def start_io_worker(self):
+        """
+        Starts the I/O worker thread. Once started all usb transfers are 
+        submitted to a queue and performed, one at a time, by the worker.
+        Each submitting thread waits on its own reply slot so any number 
+        of threads may share the device without interleaving packets. 
+
+        Arguments: None
+
+        Return: None
+        """
+        if self.io_worker is not None and self.io_worker.isAlive():
+            return
+        self.io_worker_stop.clear()
+        self.io_worker = threading.Thread(target=self.__io_worker_loop)
+        self.io_worker.setDaemon(True)
+        self.io_worker.start()
+        return
+
+    def stop_io_worker(self):
+        """
+        Stops the I/O worker thread after all submitted transfers have 
+        been performed. Transfers submitted once the worker has begun 
+        to stop are refused with an IOError, as are any left in the 
+        queues after the worker has exited.
+
+        Arguments: None
+
+        Return: None
+        """
+        if self.io_worker is None:
+            return
+        self.io_submit_lock.acquire()
+        self.io_worker_stop.set()
+        self.io_submit_lock.release()
+        self.io_wakeup.set()
+        if self.io_worker is not threading.currentThread():
+            self.io_worker.join()
+            self.__fail_pending(IOError("I/O worker stopped"))
+        self.io_worker = None
+        return
+
+    def __fail_pending(self,err):
+        """
+        Removes all requests from the submission queues and releases 
+        their waiting threads with an error.
+
+        Arguments:
+          err = the error raised in the waiting threads
+
+        Return: None
+        """
+        for queue in (self.io_priority_queue, self.io_queue):
+            while True:
+                try:
+                    req = queue.popleft()
+                except IndexError:
+                    break
+                req.error = err
+                req.done.set()
+        self.coalesce_lock.acquire()
+        self.coalesce_pending.clear()
+        self.coalesce_lock.release()
+        return
+
+    def __cancel_undo_requests(self):
+        """
+        Removes the queued requests which would undo a stop or disable,
+        i.e., starts, arms and enables, and releases their waiting 
+        threads with RuntimeError. Called with the io_submit_lock held 
+        when a safety command is submitted. A request the I/O worker has
+        already taken is sent before the safety command in any case.
+
+        Arguments: None
+
+        Return: None
+        """
+        for req in list(self.io_queue):
+            if not is_undo_priority_cmd(req.out_bytes):
+                continue
+            try:
+                self.io_queue.remove(req)
+            except ValueError:
+                # Already taken by the worker
+                continue
+            req.error = RuntimeError("cancelled by stop or disable")
+            req.done.set()
+        return
+
+    def set_coalesce(self,coalesce,wait=True):
+        """
+        Enables or disables command coalescing. When enabled, a set-point 
+        write (set_vel_setpt and set_pos_setpt) which is still waiting in
+        the I/O worker's queue is replaced by a newer write with the same 
+        command id, so only the most recent value is sent and the command
+        latency is bounded by one round trip regardless of the rate of 
+        updates. The newer value takes the place of the waiting write, so
+        it may be sent ahead of get commands, e.g. position polling, and 
+        other set-point writes submitted between the two. It is never 
+        sent ahead of any other set command - a new write is queued 
+        instead. Enabling coalescing starts the I/O worker.
+
+        Arguments:
+          coalesce = True or False
+
+        Keywords:
+          wait = True (default) or False. If False coalesced set-point 
+                 writes return None immediately rather than waiting for 
+                 the reply from the device. An error in such a write is 
+                 raised by the next usb command.
+
+        Return: None
+        """
+        if coalesce == True:
+            self.start_io_worker()
+        self.coalesce = coalesce
+        self.coalesce_wait = wait
+        return
+
+    def get_coalesce_stats(self):
+        """
+        Returns command coalescing statistics. 
+
+        Arguments: None
+
+        Return: dictionary keyed by command id. The values are 
+                dictionaries with keys 'sent', the number of writes sent
+                to the device, and 'dropped', the number of writes replaced
+                by a newer value before being sent.
+        """
+        self.coalesce_lock.acquire()
+        stats = dict([(k,dict(v)) for k,v in self.coalesce_stats.iteritems()])
+        self.coalesce_lock.release()
+        return stats
+
+    def __submit_coalesced(self,out_bytes,key):
+        """
+        Submits a coalescable request to the I/O worker. If a request 
+        with the same key is still queued, and only get commands or 
+        coalescable requests have been queued after it, its output is 
+        replaced and the caller shares its reply slot.
+
+        Arguments:
+          out_bytes = list of bytes to send to the device
+          key       = coalescing key (command id, control byte)
+
+        Return: the request
+        """
+        self.coalesce_lock.acquire()
+        stats = self.coalesce_stats.setdefault(key[0], {'sent': 0, 'dropped': 0})
+        req = self.coalesce_pending.get(key)
+        if req is not None and not req.taken and self.__can_replace(req):
+            req.out_bytes = out_bytes
+            req.detached = req.detached and not self.coalesce_wait
+            stats['dropped'] += 1
+            self.coalesce_lock.release()
+            return req
+        req = IO_Request(out_bytes, key=key)
+        req.detached = not self.coalesce_wait
+        self.coalesce_pending[key] = req
+        stats['sent'] += 1
+        self.io_queue.append(req)
+        self.coalesce_lock.release()
+        return req
+
+    def __can_replace(self,req):
+        """
+        Checks whether a queued coalescable request can be replaced, i.e.,
+        it is still in the queue and no set command, other than another 
+        coalescable request, has been queued after it. Called with the 
+        coalesce_lock held.
+        """
+        # The copy is made atomically - the worker may be taking requests
+        queued = list(self.io_queue)
+        queued.reverse()
+        for other in queued:
+            if other is req:
+                return True
+            if other.key is not None:
+                continue
+            if ord(other.out_bytes[0]) in SET_TYPE_DICT:
+                return False
+        # Already taken by the worker
+        return False
+
+    def __io_worker_loop(self):
+        """
+        I/O worker thread. Takes requests from the submission queues and
+        performs the usb transfers. Requests in the priority queue are 
+        always performed first. Submitting threads queue requests while 
+        holding the io_submit_lock, so they may briefly wait for each 
+        other, but never for a transfer. The worker takes requests with 
+        popleft, which is atomic, without the lock.
+        """
+        while True:
+            try:
+                req = self.io_priority_queue.popleft()
+            except IndexError:
+                try:
+                    req = self.io_queue.popleft()
+                except IndexError:
+                    if self.io_worker_stop.isSet():
+                        break
+                    self.io_wakeup.wait(IO_WORKER_IDLE_TIMEOUT)
+                    self.io_wakeup.clear()
+                    continue
+            if req.key is not None:
+                # Coalesced request - no further values may be merged 
+                self.coalesce_lock.acquire()
+                req.taken = True
+                if self.coalesce_pending.get(req.key) is req:
+                    del self.coalesce_pending[req.key]
+                self.coalesce_lock.release()
+            try:
+                req.data, req.times = self.__do_transfer(req.out_bytes, req.reply)
+            except Exception, err:
+                req.error = err
+                if req.detached:
+                    # No thread waits for the reply - raise on next command
+                    self.coalesce_error = err
+            req.done.set()
+        return
+
+    # -------------------------------------------------------------------------
+    # Methods for device events
+
+    def on(self,event,callback):
+        """
+        Registers a callback function for a device event. The callback is
+        called from the event listener thread, which is started if it is 
+        not already running. Errors raised by the callback are reported on
+        stderr and do not stop the listener. The callback is called as 
+        callback(event_dict) where event_dict has the keys:
+          'event' = the event name
+          'arg'   = the event argument - the operating mode for 
+                    'ext_int_stop', 'move_done' and 'trig_start', the new 
+                    direction for 'dir_change'.
+          'pos'   = the motor position at the time of the event (indices)
+          'stamp' = device time stamp of the event (usec, modulo 2**16)
+          'time'  = host time at which the event was received (sec)
+
+        Arguments:
+          event    = the event name 'ext_int_stop', 'move_done', 
+                     'dir_change' or 'trig_start', or the host event 
+                     'reconnect' (see set_reconnect).
+          callback = the callback function
+
+        Return: None
+        """
+        if event in HOST_EVENT_LIST:
+            self.event_callbacks.setdefault(event,[]).append(callback)
+            return
+        if not event in EVENT2VAL_DICT:
+            raise ValueError, "unknown event %s"%(event,)
+        self.event_callbacks.setdefault(event,[]).append(callback)
+        self.start_event_listener()
+        return
+
+    def off(self,event,callback=None):
+        """
+        Removes a callback function for a device event. If callback is 
+        None all callbacks for the event are removed.
+
+        Arguments:
+          event = the event name
+
+        Keywords:
+          callback = the callback function to remove
+
+        Return: None
+        """
+        if callback is None:
+            self.event_callbacks[event] = []
+        else:
+            self.event_callbacks[event].remove(callback)
+        return
+
+    def start_event_listener(self):
+        """
+        Starts the event listener thread if it is not already running.
+
+        Arguments: None
+
+        Return: None
+        """
+        if self.event_thread is not None and self.event_thread.isAlive():
+            return
+        if self.libusb_handle is None and not hasattr(self.transport, 'read_endpoint'):
+            raise RuntimeError, "event listener requires a libusb device"
+        self.event_thread_stop.clear()
+        self.event_thread = threading.Thread(target=self.__event_listener)
+        self.event_thread.setDaemon(True)
+        self.event_thread.start()
+        return
+
+    def stop_event_listener(self):
+        """
+        Stops the event listener thread.
+
+        Arguments: None
+
+        Return: None
+        """
+        if self.event_thread is None:
+            return
+        self.event_thread_stop.set()
+        if self.event_thread is not threading.currentThread():
+            self.event_thread.join()
+        self.event_thread = None
+        return
+
+    def __event_listener(self):
+        """
+        Event listener thread. Reads event records from the interrupt in
+        endpoint and dispatches them to the registered callbacks.
+        """
+        buf = self.event_buffer
+        while not self.event_thread_stop.isSet():
+            self.event_read_lock.acquire()
+            try:
+                val = self.__read_event(buf)
+            finally:
+                self.event_read_lock.release()
+            if val is False:
+                # Device lost - wait for it to be reconnected by __transfer
+                self.event_thread_stop.wait(0.001*EVENT_READ_TIMEOUT)
+                continue
+            if val is None:
+                continue
+            data = list(buf.raw)
+            event_dict = self.__get_event(data)
+            for callback in self.event_callbacks.get(event_dict['event'],[]):
+                try:
+                    callback(event_dict)
+                except Exception, err:
+                    # Report and keep listening
+                    print >> sys.stderr, "error in %s callback: %s"%(event_dict['event'],err)
+        return
+
+    def __read_event(self,buf):
+        """
+        Reads an event record from the interrupt in endpoint into buf. 
+        Returns the number of bytes read, None if no event was received
+        or False if the device has been lost and automatic reconnect is
+        enabled.
+        """
+        if self.transport is not None:
+            try:
+                return self.transport.read_endpoint(USB_EVENT_EP_ADDRESS, buf, EVENT_READ_TIMEOUT)
+            except IOError:
+                if self.reconnect is None:
+                    raise
+                return False
+        if self.libusb_handle is None:
+            return False
+        try:
+            return usb.interrupt_read(self.libusb_handle, 
+                                      USB_EVENT_EP_ADDRESS, 
+                                      buf, 
+                                      EVENT_READ_TIMEOUT)
+        except usb.USBNoDataAvailableError:
+            return None
+        except usb.USBError:
+            if self.reconnect is None:
+                raise
+            return False
+
+    def __get_event(self,data):
+        """
+        Get event dictionary from event record data.
+
+        Arguments:
+          data = the event record data
+
+        Return: event dictionary
+        """
+        event_val = self.__bytes_to_int(data[0:1],'uint8')
+        event_dict = {
+            'event' : VAL2EVENT_DICT.get(event_val, event_val),
+            'arg'   : self.__bytes_to_int(data[1:2],'uint8'),
+            'pos'   : self.__bytes_to_int(data[2:6],'int32'),
+            'stamp' : self.__bytes_to_int(data[6:8],'uint16'),
+            'time'  : time.time(),
+        }
+        return event_dict
+
     # -------------------------------------------------------------------------
     # Methods for low level USB communication 
         
+    def __transfer(self,out_bytes,reply=True):
+        """
+        Performs a usb transfer. If the I/O worker is running the transfer
+        is submitted to the worker, otherwise it is performed in the 
+        calling thread.
+
+        Arguments:
+          out_bytes = list of bytes to send to the device
+
+        Keywords:
+          reply = True (default) or False. Whether or not the device 
+                  sends a reply.
+
+        Return: the data returned by the usb device.
+        """
+        err = self.coalesce_error
+        if err is not None:
+            # Error in an earlier coalesced write which was not waited for
+            self.coalesce_error = None
+            raise err
+        if self.io_worker is not None:
+            cmd_id = ord(out_bytes[0])
+            self.io_submit_lock.acquire()
+            try:
+                if self.io_worker_stop.isSet():
+                    raise IOError, "I/O worker stopped"
+                if self.coalesce == True and cmd_id in COALESCE_CMD_IDS:
+                    req = self.__submit_coalesced(out_bytes, (cmd_id, out_bytes[1]))
+                elif is_priority_cmd(out_bytes):
+                    req = IO_Request(out_bytes, reply=reply)
+                    self.io_priority_queue.append(req)
+                    self.__cancel_undo_requests()
+                else:
+                    req = IO_Request(out_bytes, reply=reply)
+                    self.io_queue.append(req)
+            finally:
+                self.io_submit_lock.release()
+            self.io_wakeup.set()
+            if req.detached:
+                return None
+            data = req.wait()
+            times = req.times
+        else:
+            data, times = self.__do_transfer(out_bytes, reply)
+
+        if reply == True:
+            stamp = self.__bytes_to_int(data[6:8],'uint16')
+            self.local.last_stamp = (stamp,) + times
+        return data
+
+    def __do_transfer(self,out_bytes,reply):
+        """
+        Performs a usb transfer, see __send_packet. If automatic reconnect
+        is enabled and the device is lost it is reconnected and the 
+        transfer repeated. Commands in NO_REPLAY_CMD_IDS are not repeated,
+        as they may already have been performed - IOError is raised 
+        instead, once the device has been reconnected.
+        """
+        if self.reconnect is None:
+            return self.__send_packet(out_bytes, reply)
+        count = self.io_stats['reconnects']
+        if self.transport is None and self.libusb_handle is None:
+            # Lost and not yet reconnected
+            self.__reconnect(IOError("device lost"), count)
+            return self.__send_packet(out_bytes, reply)
+        try:
+            return self.__send_packet(out_bytes, reply)
+        except self.__loss_errors(), err:
+            self.__reconnect(err, count)
+        cmd_id = ord(out_bytes[0])
+        if cmd_id in NO_REPLAY_CMD_IDS:
+            raise IOError, "device lost during command %d (%s), reconnected but command not repeated"%(cmd_id, err)
+        return self.__send_packet(out_bytes, reply)
+
+    def __send_packet(self,out_bytes,reply):
+        """
+        Copies bytes to the output buffer and sends them. If a reply is 
+        expected it is received.
+
+        Arguments:
+          out_bytes = list of bytes to send to the device
+          reply     = True or False, whether or not to receive a reply
+
+        Return: (data, (t_send, t_recv)) 
+                 data   = the data returned by the usb device, or None
+                 t_send = host time command sent
+                 t_recv = host time reply received
+        """
+        for i in range(USB_BUFFER_SIZE):
+            if i < len(out_bytes):
+                self.output_buffer[i] = out_bytes[i]
+            else:
+                self.output_buffer[i] = chr(0x00)
+        if reply == True:
+            return self.__send_and_receive()
+        else:
+            t_send = time.time()
+            val = self.__send_output()
+            return None, (t_send, None)
+
     def __send_and_receive(self,in_timeout=200,out_timeout=9999):
         """
         Send bulkout and and receive bulkin as a response.
@@ -291,10 +1300,14 @@ class Simple_Step:
           in_timeout  = bulkin timeout in ms
           out_timeout = bilkin timeout in ms
           
-        Return: the data returned by the usb device.
+        Return: (data, (t_send, t_recv)) 
+                 data   = the data returned by the usb device.
+                 t_send = host time command sent
+                 t_recv = host time reply received
         """
         done = False
         while not done:
+            t_send = time.time()
             val = self.__send_output(timeout=out_timeout)
             if val < 0 :
                 raise IOError, "error sending usb output"
@@ -306,12 +1319,14 @@ class Simple_Step:
             if data == None:
                 debug_print('usb SR: fail', comma=False) 
                 sys.stdout.flush()
+                self.io_stats['retries'] += 1
                 continue
             else:
                 done = True
+                t_recv = time.time()
                 debug_print('usb SR cmd_id: %d'%(ord(data[0]),), comma=False) 
 
-        return data
+        return data, (t_send, t_recv)
 
     def __send_output(self,timeout=9999):
         """
@@ -325,7 +1340,13 @@ class Simple_Step:
         Return: number of bytes written on success or < 0 on error.
         """
         buf = self.output_buffer # shorthand
-        val = usb.bulk_write(self.libusb_handle, USB_BULKOUT_EP_ADDRESS, buf, timeout)
+        trace_capture = self.trace_capture
+        if trace_capture is not None:
+            trace_capture.record(traffic.TRAFFIC_OUT, time.time(), buf.raw)
+        if self.transport is not None:
+            val = self.transport.write(buf.raw, timeout)
+        else:
+            val = usb.bulk_write(self.libusb_handle, USB_BULKOUT_EP_ADDRESS, buf, timeout)
         return val
 
     def __read_input(self, timeout=1000):
@@ -340,12 +1361,22 @@ class Simple_Step:
         Return: the raw data read from the usb device.
         """
         buf = self.input_buffer
-        try:
-            val = usb.bulk_read(self.libusb_handle, USB_BULKIN_EP_ADDRESS, buf, timeout)
-            #print 'read', [ord(b) for b in buf]
-            data = [x for x in buf]
-        except usb.USBNoDataAvailableError:
-            data = None
+        if self.transport is not None:
+            packet = self.transport.read(timeout)
+            if packet is None:
+                return None
+            buf.raw = packet
+            data = list(packet)
+        else:
+            try:
+                val = usb.bulk_read(self.libusb_handle, USB_BULKIN_EP_ADDRESS, buf, timeout)
+                #print 'read', [ord(b) for b in buf]
+                data = list(buf.raw)
+            except usb.USBNoDataAvailableError:
+                data = None
+        trace_capture = self.trace_capture
+        if trace_capture is not None and data is not None:
+            trace_capture.record(traffic.TRAFFIC_IN, time.time(), buf.raw)
         return data
 
     def __get_usb_header(self,data):
@@ -439,7 +1470,211 @@ class Simple_Step:
         return val
 
 
-    def usb_set_cmd(self,cmd_id,val,io_update=True):
+    # -------------------------------------------------------------------------
+    # Methods for automatic reconnect
+
+    def set_reconnect(self,reconnect,timeout=DEFAULT_RECONNECT_TIMEOUT,
+                      backoff=DEFAULT_RECONNECT_BACKOFF,
+                      max_backoff=DEFAULT_RECONNECT_MAX_BACKOFF):
+        """
+        Enables or disables automatic reconnect. When enabled a command 
+        which fails because the device has been lost, e.g., it dropped 
+        off the bus, does not raise. Instead the device is re-enumerated,
+        found by serial number and reopened, the settings last written 
+        with the RECONNECT_RESTORE_CMD_IDS commands (mode, step mode,
+        acceleration, enable, external interrupt, positioning velocity 
+        and set-points) are restored, with io_update so that they take 
+        effect, and the command is repeated. Commands which change the 
+        device state each time they are performed, e.g., popping a latch
+        or writing a table entry (NO_REPLAY_CMD_IDS), are not repeated - 
+        they raise IOError once the device has been reconnected. The 
+        device status is not restored - a device which was reset comes 
+        back stopped. 
+
+        After a reconnect the 'reconnect' event callbacks (see on) are 
+        called with an event dictionary with the keys 'event', 'time', 
+        'downtime' (sec), 'attempts' and 'error' (the error which caused
+        the reconnect). If the I/O worker is running the callbacks are 
+        called from a separate thread, otherwise from the thread which 
+        detected the loss. In either case they may use the device.
+
+        Arguments:
+          reconnect = True or False
+
+        Keywords:
+          timeout     = time after which reconnecting is abandoned and 
+                        the command raises IOError (sec)
+          backoff     = initial delay between reconnect attempts (sec). 
+                        The delay doubles after each failed attempt.
+          max_backoff = maximum delay between reconnect attempts (sec)
+
+        Return: None
+        """
+        if reconnect == False:
+            self.reconnect = None
+            return
+        if self.transport is not None and not hasattr(self.transport, 'reopen'):
+            raise RuntimeError, "transport does not support reconnect"
+        if min(timeout, backoff, max_backoff) <= 0:
+            raise ValueError, "timeout and backoff must be > 0"
+        self.reconnect = {
+            'serial_number' : self.get_serial_number(),
+            'timeout'       : float(timeout),
+            'backoff'       : float(backoff),
+            'max_backoff'   : float(max_backoff),
+            }
+        return
+
+    def __loss_errors(self):
+        """
+        Returns the exception classes raised on loss of the device.
+        """
+        if self.transport is not None:
+            return (IOError,)
+        return (IOError, usb.USBError)
+
+    def __reconnect(self,err,count):
+        """
+        Reconnects to the device, with exponential backoff between 
+        attempts, and restores its settings. Raises IOError if the device
+        can't be reconnected within the reconnect timeout. count is the 
+        number of reconnects when the transfer which failed was started -
+        if another thread has since reconnected nothing is done.
+        """
+        self.reconnect_lock.acquire()
+        try:
+            if self.io_stats['reconnects'] != count:
+                return
+            settings = self.reconnect
+            t_start = time.time()
+            delay = settings['backoff']
+            attempts = 0
+
+            # The handle, or transport, is only closed and replaced while
+            # the event listener is not reading from it
+            self.event_read_lock.acquire()
+            try:
+                self.__close_handle()
+            finally:
+                self.event_read_lock.release()
+            while True:
+                attempts += 1
+                self.event_read_lock.acquire()
+                try:
+                    try:
+                        self.__reopen(settings['serial_number'])
+                        self.__restore()
+                        reopened = True
+                    except (RuntimeError, IOError), reopen_err:
+                        debug("reconnect attempt %d failed: %s"%(attempts, reopen_err))
+                        self.__close_handle()
+                        reopened = False
+                finally:
+                    self.event_read_lock.release()
+                if reopened:
+                    break
+                t_now = time.time()
+                if t_now + delay > t_start + settings['timeout']:
+                    raise IOError, "device lost (%s), unable to reconnect"%(err,)
+                time.sleep(delay)
+                delay = min(2*delay, settings['max_backoff'])
+            t_done = time.time()
+            self.io_stats['reconnects'] += 1
+        finally:
+            self.reconnect_lock.release()
+
+        event_dict = {
+            'event'    : 'reconnect',
+            'time'     : t_done,
+            'downtime' : t_done - t_start,
+            'attempts' : attempts,
+            'error'    : err,
+            }
+        if threading.currentThread() is self.io_worker:
+            # The worker must be free to perform any commands sent by the
+            # callbacks - call them from their own thread.
+            thread = threading.Thread(target=self.__call_host_event, args=(event_dict,))
+            thread.setDaemon(True)
+            thread.start()
+        else:
+            self.__call_host_event(event_dict)
+        return
+
+    def __call_host_event(self,event_dict):
+        """
+        Calls the callbacks for a host event. Errors raised by a callback
+        are reported on stderr.
+        """
+        for callback in self.event_callbacks.get(event_dict['event'],[]):
+            try:
+                callback(event_dict)
+            except Exception, err:
+                print >> sys.stderr, "error in %s callback: %s"%(event_dict['event'],err)
+        return
+
+    def __close_handle(self):
+        """
+        Closes the usb handle, or transport, of a lost device ignoring
+        any errors.
+        """
+        try:
+            if self.transport is not None:
+                self.transport.close()
+            elif self.libusb_handle is not None:
+                usb.close(self.libusb_handle)
+        except (RuntimeError, IOError):
+            pass
+        self.libusb_handle = None
+        return
+
+    def __reopen(self,serial_number):
+        """
+        Reopens the device after it has been lost. 
+        """
+        if self.transport is not None:
+            self.transport.reopen()
+        else:
+            self.__open_libusb(serial_number, rescan=True)
+        return
+
+    def __restore(self):
+        """
+        Restores the settings written with the RECONNECT_RESTORE_CMD_IDS
+        commands. Packets are sent directly, rather than with usb_set_cmd,
+        as this may be called from the I/O worker. Every value is sent 
+        with io_update so that it takes effect - values which were only
+        staged before the loss are applied as well.
+        """
+        for cmd_id in RECONNECT_RESTORE_CMD_IDS:
+            try:
+                val = self.restore_state[cmd_id]
+            except KeyError:
+                continue
+            out_bytes = self.__set_cmd_bytes(cmd_id, val, True)
+            data, times = self.__send_packet(out_bytes, True)
+            cmd_id_received, ctl_byte = self.__get_usb_header(data)
+            self.__check_cmd_id(cmd_id, cmd_id_received)
+        return
+
+    def __record_setting(self,cmd_id,val):
+        """
+        Records the value written with a set command for restoration 
+        after a reconnect. 
+        """
+        if cmd_id in RECONNECT_RESTORE_CMD_IDS:
+            self.restore_state[cmd_id] = val
+        elif cmd_id == USB_CMD_SET_ZERO_POS:
+            # Set-point is shifted with the zero position
+            try:
+                self.restore_state[USB_CMD_SET_POS_SETPT] -= val
+            except KeyError:
+                pass
+        return
+
+    # -------------------------------------------------------------------------
+    # Methods for generic usb commands 
+
+    def usb_set_cmd(self,cmd_id,val,io_update=True,aux=None):
         """
         Generic usb set command. Sends set command w/ value to device
         and extracts the value returned
@@ -452,30 +1687,43 @@ class Simple_Step:
           io_update = True or False. Determines whether or not thr 
                       change in value will have an immediate effect. 
                       The default value is True.
+          aux       = optional unsigned 16 bit value sent in the packet's
+                      auxiliary field, e.g., a table index.
+
+        """
+        # Send command + value and receive data
+        out_bytes = self.__set_cmd_bytes(cmd_id,val,io_update,aux)
+        data = self.__transfer(out_bytes)
+        self.__record_setting(cmd_id,val)
+        if data is None:
+            # Coalesced write w/o waiting for reply
+            return None
+
+        # Extract returned data
+        cmd_id_received, ctl_byte = self.__get_usb_header(data)
+        self.__check_cmd_id(cmd_id, cmd_id_received)
+        val = self.__get_usb_value(ctl_byte, data)
+        return val        
 
+    def __set_cmd_bytes(self,cmd_id,val,io_update,aux=None):
+        """
+        Returns the list of bytes sent for a set command.
         """
         # Get value type from CMD_ID and convert to CTL_VAL
         val_type = SET_TYPE_DICT[cmd_id]
-    
-        # Send command + value and receive data
-        self.output_buffer[0] = chr(cmd_id%0x100)
         if io_update == True:
             ctl_val = USB_CTL_UPDATE
         elif io_update == False:
             ctl_val = USB_CTL_NO_UPDATE
         else:
             raise ValueError, "io_update must be True or False"
-        self.output_buffer[1] = chr(ctl_val%0x100)
-        val_bytes = self.__int_to_bytes(val,val_type)
-        for i,byte in enumerate(val_bytes):
-            self.output_buffer[i+2] = byte
-        data = self.__send_and_receive()
-
-        # Extract returned data
-        cmd_id_received, ctl_byte = self.__get_usb_header(data)
-        check_cmd_id(cmd_id, cmd_id_received)
-        val = self.__get_usb_value(ctl_byte, data)
-        return val        
+        out_bytes = [chr(cmd_id%0x100), chr(ctl_val%0x100)]
+        out_bytes.extend(self.__int_to_bytes(val,val_type))
+        if aux is not None:
+            # Aux field follows the 4 byte data field 
+            out_bytes.extend([chr(0x00)]*(6 - len(out_bytes)))
+            out_bytes.extend(self.__int_to_bytes(aux,'uint16'))
+        return out_bytes
 
     def usb_get_cmd(self,cmd_id):
         """
@@ -488,14 +1736,68 @@ class Simple_Step:
         Return: the value returned fromt the usb device.
         """
         # Send command and receive data
-        self.output_buffer[0] = chr(cmd_id%0x100)
-        data = self.__send_and_receive()
+        out_bytes = [chr(cmd_id%0x100), chr(USB_CTL_UPDATE)]
+        data = self.__transfer(out_bytes)
         # Extract returned data
         cmd_id_received, ctl_byte = self.__get_usb_header(data)
-        check_cmd_id(cmd_id, cmd_id_received)
+        self.__check_cmd_id(cmd_id, cmd_id_received)
         val = self.__get_usb_value(ctl_byte, data)
         return val
 
+    def __check_cmd_id(self,expected_id,received_id):
+        """
+        Checks the command id of a reply, counting mismatches. 
+        """
+        if expected_id != received_id:
+            self.io_stats['cmd_id_errors'] += 1
+        check_cmd_id(expected_id, received_id)
+
+    def get_io_stats(self):
+        """
+        Returns the counts of usb communication errors since the device
+        was opened.
+
+        Arguments: None
+
+        Return: dictionary with keys 'retries' (commands resent after a 
+                missing reply), 'cmd_id_errors' (replies with the wrong
+                command id) and 'reconnects' (automatic reconnects, see
+                set_reconnect).
+        """
+        return dict(self.io_stats)
+
+    def get_last_stamp(self):
+        """
+        Returns the device time stamp of the last reply received by the
+        calling thread along with the host times at which the command was sent and 
+        the reply was received. The time stamp is the lower 16 bits of the
+        device clock (microseconds) at the time the command was processed. 
+        See the clock_sync module for placing time stamps on the host 
+        timeline.
+
+        Arguments: None
+
+        Return: (stamp, t_send, t_recv)
+                 stamp  = device time stamp (usec, modulo 2**16)
+                 t_send = host time command sent (sec)
+                 t_recv = host time reply received (sec)
+        """
+        return getattr(self.local, 'last_stamp', (None, None, None))
+
+    def get_open_options(self):
+        """
+        Returns the keyword arguments with which the device was opened, 
+        other than capture, so that it can be opened again with 
+        dev.__class__(**options). A transport object is returned as is - 
+        if the device has been closed it must be reopened (see the 
+        transport's reopen method) before it is used again.
+
+        Arguments: None
+
+        Return: dictionary of keyword arguments
+        """
+        return dict(self.open_options)
+
     def get_serial_number(self):
         """
         Get serial number of device.
@@ -504,6 +1806,10 @@ class Simple_Step:
 
         Return: serial number of device - a string
         """
+        if self.profile is not None:
+            return self.profile['serial_number']
+        if self.transport is not None:
+            return self.transport.get_serial_number()
         return  usb.get_string_simple(self.libusb_handle, self.dev.descriptor.iSerialNumber)
 
     def get_manufacturer(self):
@@ -514,6 +1820,10 @@ class Simple_Step:
 
         Return: manufacturer string
         """
+        if self.profile is not None:
+            return self.profile['manufacturer']
+        if self.transport is not None:
+            return self.transport.get_manufacturer()
         return usb.get_string_simple(self.libusb_handle, self.dev.descriptor.iManufacturer)
 
     def get_product(self):
@@ -524,18 +1834,30 @@ class Simple_Step:
 
         Return: product string
         """
+        if self.profile is not None:
+            return self.profile['product']
+        if self.transport is not None:
+            return self.transport.get_product()
         return usb.get_string_simple(self.libusb_handle, self.dev.descriptor.iProduct)
 
     def get_vendor_id(self):
         """
         Get device vendor ID.
         """
+        if self.profile is not None:
+            return self.profile['vendor_id']
+        if self.transport is not None:
+            return self.transport.get_vendor_id()
         return self.dev.descriptor.idVendor
 
     def get_product_id(self):
         """
         Get device product ID.
         """
+        if self.profile is not None:
+            return self.profile['product_id']
+        if self.transport is not None:
+            return self.transport.get_product_id()
         return self.dev.descriptor.idProduct
 
     # -----------------------------------------------------------------
@@ -551,8 +1873,7 @@ class Simple_Step:
         
         Return: None
         """
-        self.output_buffer[0] = chr(USB_CMD_AVR_DFU_MODE%0x100)
-        val = self.__send_output()
+        self.__transfer([chr(USB_CMD_AVR_DFU_MODE%0x100)], reply=False)
         return
 
     def reset_device(self):
@@ -572,8 +1893,7 @@ class Simple_Step:
         # DEBUG - has issues, see above
         ###############################
 
-        self.output_buffer[0] = chr(USB_CMD_AVR_RESET%0x100)
-        val = self.__send_output()        
+        self.__transfer([chr(USB_CMD_AVR_RESET%0x100)], reply=False)
         self.close()
         return
 
@@ -901,6 +2221,59 @@ class Simple_Step:
         min_vel = self.usb_get_cmd(USB_CMD_GET_MIN_VEL)
         return min_vel
 
+    def get_build_id(self):
+        """
+        Returns the firmware build identifier - the time, in seconds since
+        the epoch, at which the firmware was built.
+
+        Arguments: None
+
+        Return: build identifier
+        """
+        return self.usb_get_cmd(USB_CMD_GET_BUILD_ID)
+
+    def save_config(self):
+        """
+        Saves the current operating mode, positioning velocity, enable 
+        state, external interrupt mode, step mode and acceleration to the
+        device EEPROM. The saved configuration is applied whenever the 
+        device starts up. Writing the EEPROM takes a few tens of ms.
+
+        Arguments: None
+
+        Return: None
+        """
+        ok = self.usb_set_cmd(USB_CMD_SAVE_CONFIG,CONFIG_SAVE,io_update=False)
+        if not ok:
+            raise RuntimeError, "unable to save configuration to EEPROM"
+        return
+
+    def load_config(self):
+        """
+        Applies the configuration saved in the device EEPROM, by 
+        save_config, to the device. Intended for use when the device
+        is stopped.
+
+        Arguments: None
+
+        Return: True if a saved configuration was applied and False if
+                there is no saved configuration.
+        """
+        ok = self.usb_set_cmd(USB_CMD_LOAD_CONFIG,0)
+        return bool(ok)
+
+    def clear_config(self):
+        """
+        Erases the configuration saved in the device EEPROM. The device 
+        will start up with the firmware defaults. 
+
+        Arguments: None
+
+        Return: None
+        """
+        self.usb_set_cmd(USB_CMD_SAVE_CONFIG,CONFIG_ERASE,io_update=False)
+        return
+
     def get_status(self,ret_type='str'):
         """
         Returns the device status. 
@@ -919,15 +2292,17 @@ class Simple_Step:
 
     def set_status(self, status):
         """
-        Sets the device status. 
+        Sets the device status. An 'armed' device is stopped until a
+        rising edge occurs on its trigger input at which point its
+        status changes to 'running' (see arm and fire_trig).
 
         Argument:
-          status = the device status either a string, 'running'/'stopped',
-                   or an integer,RUNNING/STOPPED.
+          status = the device status either a string, 'running'/'stopped'/
+                   'armed', or an integer,RUNNING/STOPPED/ARMED.
 
         Return: the new device status. 
-                'running' or 'stopped' if type(status) == str
-                 RUNNING  or  STOPPED  if type(status) == int 
+                'running', 'stopped' or 'armed' if type(status) == str
+                 RUNNING,   STOPPED  or  ARMED  if type(status) == int 
         """
         if type(status) == str:
             try:
@@ -939,10 +2314,12 @@ class Simple_Step:
                 status_val = int(status)
             except:
                 raise ValueError, "unable to convert status to integer"
-            if not (status_val in (RUNNING,STOPPED)):
+            if not (status_val in (RUNNING,STOPPED,ARMED)):
                 raise ValueError, "unknown status integer %d"%(status_val,)
         
         # Send usb command
+        if status_val == STOPPED:
+            self.stop_requested.set()
         status_val = self.usb_set_cmd(USB_CMD_SET_STATUS,status_val)
         if type(status) == str:
             return VAL2STATUS_DICT[status_val]
@@ -962,15 +2339,179 @@ class Simple_Step:
 
     def stop(self):
         """
-        Stops the device - sets system status to stop.
+        Stops the device - sets system status to stop. The time taken is 
+        recorded in the stop latency statistics (see get_stop_latency).
+
+        Stop commands are only sent ahead of other queued commands when 
+        the I/O worker is running (see start_io_worker). Any start, arm 
+        or enable still queued is then dropped, and raises RuntimeError
+        in the thread which issued it, so that it can't restart the 
+        motor. Otherwise the command is sent in the calling thread after
+        any transfer already in progress. 
         
         Arguments: None
         
         Return: None
         """
+        t0 = time.time()
         self.set_status('stopped')
+        self.__update_stop_latency(time.time() - t0)
+        return
+
+    def get_stop_latency(self):
+        """
+        Returns stop latency statistics. The stop latency is the time from
+        stop, or stop_all, being called until the device's reply is 
+        received. Stops issued internally, e.g., at the end of 
+        move_to_pos, are not recorded. When the I/O worker is running 
+        stop and disable commands are sent ahead of all other queued 
+        commands, otherwise they are sent in the order issued.
+
+        Arguments: None
+
+        Return: dictionary with keys 'last', 'max' and 'mean' (sec) and
+                'count'. The times are None if no stop has been issued.
+        """
+        stats = dict(self.stop_latency)
+        if stats['count'] > 0:
+            stats['mean'] = stats['total']/stats['count']
+        else:
+            stats['mean'] = None
+        del stats['total']
+        return stats
+
+    def __update_stop_latency(self,dt):
+        """
+        Updates stop latency statistics.
+        """
+        self.stop_latency['last'] = dt
+        self.stop_latency['max'] = max(dt, self.stop_latency['max'])
+        self.stop_latency['total'] += dt
+        self.stop_latency['count'] += 1
+        return
+
+    def arm(self):
+        """
+        Arms the device - sets system status to armed. The device
+        will start running on the next rising edge of its trigger 
+        input. 
+
+        Arguments: None
+
+        Return: None
+        """
+        status = self.set_status('armed')
+        if status != 'armed':
+            raise RuntimeError, "unable to arm device, status is %s"%(status,)
+        return
+
+    def fire_trig(self,pin=DEFAULT_TRIG_PIN):
+        """
+        Sends a trigger pulse (rising edge) on the given DIO pin. All 
+        armed devices whose trigger inputs are wired to this pin start 
+        running at the same time. This device is started by the pulse 
+        if it is armed regardless of the wiring of its trigger input.
+
+        Keywords:
+          pin = DIO pin number (0-7) used for the trigger pulse 
+
+        Return: the device status after the trigger, 'running' or 
+                'stopped' 
+        """
+        if pin < 0 or pin > 7:
+            raise ValueError, "pin # out of range"
+        status_val = self.usb_set_cmd(USB_CMD_FIRE_TRIG,pin)
+        return VAL2STATUS_DICT[status_val]
+
+    def set_position_triggers(self,pos_list,pin,width=DEFAULT_POS_TRIG_WIDTH,mode='pulse'):
+        """
+        Sets position compare triggers. The device pulses, or toggles, the 
+        given DIO pin when the motor reaches each of the trigger positions.
+        The triggers are checked by the device every step, so they fire 
+        within one step period of the target position without any host 
+        involvement. Triggers fire in either direction of motion. 
+
+        Arguments:
+          pos_list = list of trigger positions (indices). At most
+                     POS_TRIG_TABLE_SIZE positions. 
+          pin      = DIO pin number (0-7) 
+
+        Keywords:
+          width = trigger pulse width (us) - only used in 'pulse' mode.
+                  Range POS_TRIG_WIDTH_MIN to POS_TRIG_WIDTH_MAX.
+          mode  = 'pulse' (default) or 'toggle'
+
+        Return: number of trigger positions. If writing the triggers 
+                fails the triggers are left disabled.
+        """
+        try:
+            pin = int(pin)
+        except:
+            raise ValueError, "unable to convert pin to integer"
+        if pin < 0 or pin > 7:
+            raise ValueError, "pin # out of range"
+        if not mode in ('pulse', 'toggle'):
+            raise ValueError, "mode must be 'pulse' or 'toggle'"
+        width = int(width)
+        if width < POS_TRIG_WIDTH_MIN or width > POS_TRIG_WIDTH_MAX:
+            raise ValueError, "width must be in range %d-%d us"%(POS_TRIG_WIDTH_MIN,POS_TRIG_WIDTH_MAX)
+        try:
+            pos_list = sorted(set([int(pos) for pos in pos_list]))
+        except:
+            raise ValueError, "unable to convert positions to integers"
+        if len(pos_list) > POS_TRIG_TABLE_SIZE:
+            raise ValueError, "number of positions must be <= %d"%(POS_TRIG_TABLE_SIZE,)
+        for pos in pos_list:
+            if pos < -INT32_MAX-1 or pos > INT32_MAX:
+                raise ValueError, "trigger position %d out of range"%(pos,)
+
+        # Upload table - triggers are disabled while the table is written
+        self.clear_position_triggers()
+        try:
+            for i, pos in enumerate(pos_list):
+                num = self.usb_set_cmd(USB_CMD_SET_POS_TRIG,pos,io_update=False,aux=i)
+                if num != i+1:
+                    raise IOError, "failed to set position trigger %d"%(i,)
+
+            # Enable triggers
+            if len(pos_list) > 0:
+                cfg = pin | (POS_TRIG_MODE2VAL_DICT[mode] << 8)
+                mode_val = self.usb_set_cmd(USB_CMD_SET_POS_TRIG_CFG,cfg,io_update=False,aux=width)
+                if mode_val != POS_TRIG_MODE2VAL_DICT[mode]:
+                    raise IOError, "failed to enable position triggers"
+        except:
+            # Don't leave a partially written table armed
+            exc_info = sys.exc_info()
+            try:
+                self.clear_position_triggers()
+            except Exception:
+                pass
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return len(pos_list)
+
+    def clear_position_triggers(self):
+        """
+        Disables position compare triggers.
+
+        Arguments: None
+
+        Return: None
+        """
+        cfg = POS_TRIG_MODE2VAL_DICT['off'] << 8
+        self.usb_set_cmd(USB_CMD_SET_POS_TRIG_CFG,cfg,io_update=False)
         return
 
+    def get_position_trigger_count(self):
+        """
+        Returns the number of position triggers fired since the triggers
+        were set. The count wraps at 2**16.
+
+        Arguments: None
+
+        Return: trigger count
+        """
+        return self.usb_get_cmd(USB_CMD_GET_POS_TRIG_CNT)
+
     def get_dir(self,ret_type='str'):
         """
         Gets the current motor direction. Can return either a string value,
@@ -1024,6 +2565,8 @@ class Simple_Step:
                 raise ValueError, "unknown enable integer %d"%(enable_val,)
         
         # Send usb command
+        if enable_val == DISABLED:
+            self.stop_requested.set()
         enable_val = self.usb_set_cmd(USB_CMD_SET_ENABLE,enable_val)
         if type(enable) == str:
             return VAL2ENABLE_DICT[enable_val]
@@ -1050,26 +2593,230 @@ class Simple_Step:
             raise ValueError, "unknown ret_type %s"%(ret_type,)
 
 
-    def enable(self):
+    def enable(self):
+        """
+        Enables stepper motor drive.
+        
+        Arguments: None
+        
+        Return: None
+        """
+        self.set_enable('enabled')
+        
+    def disable(self):
+        """
+        Disables stepper motor drive.
+        
+        Arguments: None
+        
+        Return: None
+        """
+        self.set_enable('disabled')
+
+
+    def set_dio_port(self,mask):
+        """
+        Sets all DIO pins at once. The pins change at the same time.
+
+        Arguments:
+         mask = DIO port mask (0-255). Bit i sets the value of DIO pin i.
+
+        Return: the DIO port mask
+        """
+        mask = int(mask)
+        if mask < 0 or mask > 0xFF:
+            raise ValueError, "mask out of range"
+        return self.usb_set_cmd(USB_CMD_SET_DIO_PORT,mask)
+
+    def get_dio_port(self):
+        """
+        Returns the DIO port mask. Bit i is the value of DIO pin i.
+
+        Arguments: None
+
+        Return: the DIO port mask
+        """
+        return self.usb_get_cmd(USB_CMD_GET_DIO_PORT)
+
+    def set_input_capture(self,mask):
+        """
+        Enables edge time stamped input capture on the capture port pins.
+        On each edge of an enabled pin the device records the pin, the 
+        edge, the device clock and the motor position. Records are read 
+        with read_input_events. Setting the mask clears any unread records.
+
+        Arguments:
+         mask = capture pin mask (0-255). Bit i enables capture on pin i.
+                A mask of 0 disables input capture.
+
+        Return: the capture pin mask
+        """
+        mask = int(mask)
+        if mask < 0 or mask > 0xFF:
+            raise ValueError, "mask out of range"
+        # Not while read_input_events is reading the capture endpoint
+        self.capture_lock.acquire()
+        try:
+            self.capture_dropped = 0
+            mask = self.usb_set_cmd(USB_CMD_SET_CAPTURE,mask,io_update=False)
+        finally:
+            self.capture_lock.release()
+        return mask
+
+    def read_input_events(self):
+        """
+        Reads and removes all input capture records from the device. The 
+        records are transferred in bulk on the capture endpoint, several 
+        records per usb packet. 
+
+        Arguments: None
+
+        Return: list of event dictionaries, oldest first, with keys 'pin', 
+                'edge' ('rising' or 'falling'), 'time' (device clock, usec)
+                and 'pos' (motor position, indices).
+        """
+        if self.libusb_handle is None and not hasattr(self.transport, 'read_endpoint'):
+            raise RuntimeError, "input capture requires a libusb device"
+        event_list = []
+        self.capture_lock.acquire()
+        try:
+            while 1:
+                num = self.usb_set_cmd(USB_CMD_READ_CAPTURE,CAPTURE_FIFO_SIZE-1,io_update=False)
+                if num == 0:
+                    break
+                event_list.extend(self.__read_capture(num))
+                if num < CAPTURE_FIFO_SIZE-1:
+                    break
+        finally:
+            self.capture_lock.release()
+        return event_list
+
+    def get_input_capture_dropped(self):
+        """
+        Returns the number of input capture records dropped by the device, 
+        because its record buffer was full, since input capture was set.
+
+        Arguments: None
+
+        Return: number of dropped records
+        """
+        return self.capture_dropped
+
+    def __read_capture(self,num):
+        """
+        Reads num input capture records from the capture endpoint.
+
+        Arguments:
+          num = number of records requested with USB_CMD_READ_CAPTURE
+
+        Return: list of event dictionaries
         """
-        Enables stepper motor drive.
-        
-        Arguments: None
-        
+        buf = self.capture_buffer
+        event_list = []
+        while len(event_list) < num:
+            if self.transport is not None:
+                val = self.transport.read_endpoint(USB_CAPTURE_EP_ADDRESS, buf, CAPTURE_READ_TIMEOUT)
+            else:
+                try:
+                    val = usb.bulk_read(self.libusb_handle, USB_CAPTURE_EP_ADDRESS, buf, CAPTURE_READ_TIMEOUT)
+                except usb.USBNoDataAvailableError:
+                    val = None
+            if val is None:
+                raise IOError, "timeout reading input capture records"
+            data = buf.raw
+            rec_num, dropped = ord(data[0]), ord(data[1])
+            self.capture_dropped += dropped
+            for i in range(rec_num):
+                n = CAPTURE_HEADER_SIZE + i*CAPTURE_REC_SIZE
+                pin, edge, clock, pos = struct.unpack(CAPTURE_REC_FORMAT, data[n:n+CAPTURE_REC_SIZE])
+                event_list.append({
+                    'pin'  : pin,
+                    'edge' : CAPTURE_EDGE_DICT[edge],
+                    'time' : clock,
+                    'pos'  : pos,
+                    })
+        return event_list
+
+    def play_dio_pattern(self,pattern,repeat=1,wait=False):
+        """
+        Plays a timed DIO pattern. Each entry of the pattern sets all DIO 
+        pins at once and holds them for the entry's duration. The entries
+        are timed by the device clock so timing errors do not accumulate.
+        After the last entry the DIO pins are left as set by the last 
+        entry. Any pattern already playing is stopped.
+
+        Arguments:
+         pattern = list of (mask, duration) entries where mask is the DIO
+                   port mask (see set_dio_port) and duration is in usec, 
+                   DIO_PAT_DURATION_MIN to DIO_PAT_DURATION_MAX. At most
+                   DIO_PAT_TABLE_SIZE entries.
+
+        Keywords:
+         repeat = number of times to play the pattern. If None the pattern
+                  is played until stopped with stop_dio_pattern.
+         wait   = True or False (default). If True wait for the pattern
+                  to finish playing.
+
         Return: None
         """
-        self.set_enable('enabled')
-        
-    def disable(self):
+        if len(pattern) == 0 or len(pattern) > DIO_PAT_TABLE_SIZE:
+            raise ValueError, "pattern must have 1-%d entries"%(DIO_PAT_TABLE_SIZE,)
+        if repeat == None:
+            repeat = DIO_PAT_FOREVER
+            if wait == True:
+                raise ValueError, "can't wait for pattern which repeats forever"
+        repeat = int(repeat)
+        if repeat < 1 or repeat >= DIO_PAT_FOREVER:
+            raise ValueError, "repeat must be in range 1-%d"%(DIO_PAT_FOREVER-1,)
+
+        entry_list = []
+        for mask, duration in pattern:
+            mask, duration = int(mask), int(duration)
+            if mask < 0 or mask > 0xFF:
+                raise ValueError, "mask out of range"
+            if duration < DIO_PAT_DURATION_MIN or duration > DIO_PAT_DURATION_MAX:
+                raise ValueError, "duration must be in range %d-%d us"%(DIO_PAT_DURATION_MIN,DIO_PAT_DURATION_MAX)
+            entry_list.append((duration << 8) | mask)
+
+        # Upload pattern - writing entry 0 stops playback 
+        for i, entry in enumerate(entry_list):
+            num = self.usb_set_cmd(USB_CMD_SET_DIO_PAT,entry,io_update=False,aux=i)
+            if num != i+1:
+                raise IOError, "failed to set DIO pattern entry %d"%(i,)
+
+        # Play pattern
+        playing = self.usb_set_cmd(USB_CMD_PLAY_DIO_PAT,repeat,io_update=False)
+        if playing != 1:
+            raise IOError, "failed to start DIO pattern"
+        if wait == True:
+            while self.get_dio_pattern_status() == 'playing':
+                time.sleep(DIO_PAT_POLL_DT)
+        return
+
+    def stop_dio_pattern(self):
         """
-        Disables stepper motor drive.
-        
+        Stops DIO pattern playback. The DIO pins are left as they are.
+
         Arguments: None
-        
+
         Return: None
         """
-        self.set_enable('disabled')
+        self.usb_set_cmd(USB_CMD_PLAY_DIO_PAT,0,io_update=False)
+        return
+
+    def get_dio_pattern_status(self):
+        """
+        Returns the DIO pattern playback status.
+
+        Arguments: None
 
+        Return: 'playing' or 'stopped'
+        """
+        playing = self.usb_get_cmd(USB_CMD_GET_DIO_PAT)
+        if playing == 1:
+            return 'playing'
+        else:
+            return 'stopped'
 
     def set_dio_hi(self,pin):
         """
@@ -1099,19 +2846,24 @@ class Simple_Step:
 
     def set_ext_int(self,ext_int):
         """
-        Enable or disables external interrupts.
+        Enable or disables external interrupts. When enabled an external
+        interrupt edge stops the motor. In the 'latch' setting the motor
+        is not stopped. In both the 'enabled' and 'latch' settings the 
+        position of the motor at the edge is latched, see 
+        get_latched_positions. Enabling clears any latched positions.
 
         Argument:
-         ext_int = ENABLE or DISABLE, 'enable' or 'disable'
+         ext_int = ENABLE, EXT_INT_LATCH or DISABLE, 'enabled', 'latch' 
+                   or 'disabled'
 
         Return: the new external interrupt setting 
-                'enable' or 'disable' if type(val) == str
-                 ENABLE  or  DISABLE  if type(val) == int
+                'enabled', 'latch' or 'disabled' if type(val) == str
+                 ENABLE, EXT_INT_LATCH or  DISABLE  if type(val) == int
         """
 
         if type(ext_int) == str:
             try:
-                ext_int_val = ENABLE2VAL_DICT[ext_int.lower()]
+                ext_int_val = EXT_INT2VAL_DICT[ext_int.lower()]
             except:
                 raise ValueError, "unknown ext_int string %s"%(ext_int,)
         else:
@@ -1119,13 +2871,13 @@ class Simple_Step:
                 ext_int_val = int(ext_int)
             except:
                 raise ValueError, "unable to convert ext_int to integer"
-            if not (ext_int_val in (ENABLED,DISABLED)):
+            if not (ext_int_val in VAL2EXT_INT_DICT):
                 raise ValueError, "unknown ext_int integer %d"%(ext_int_val,)
         
         # Send usb command
         ext_int_val = self.usb_set_cmd(USB_CMD_SET_EXT_INT,ext_int_val)
         if type(ext_int) == str:
-            return VAL2ENABLE_DICT[ext_int_val]
+            return VAL2EXT_INT_DICT[ext_int_val]
         else:
             return ext_int_val
 
@@ -1136,18 +2888,216 @@ class Simple_Step:
         Arguments: None
         
         Return: current external interrupt setting. 
-                'ext_int' or 'disable' if ret_type == 'str'
-                 ENABLE  or  DISABLE  if ret_type == 'int'
+                'enabled', 'latch' or 'disabled' if ret_type == 'str'
+                 ENABLE, EXT_INT_LATCH or DISABLE  if ret_type == 'int'
                 
         """
         ext_int_val = self.usb_get_cmd(USB_CMD_GET_EXT_INT)
         if ret_type == 'str':
-            return VAL2ENABLE_DICT[ext_int_val]
+            return VAL2EXT_INT_DICT[ext_int_val]
         elif ret_type == 'int':
             return ext_int_val
         else:
             raise ValueError, "unknown ret_type %s"%(ret_type,)
-        
+
+    def get_latch_count(self):
+        """
+        Returns the number of latched positions waiting to be read. The
+        device holds at most 7 latched positions - when full the oldest
+        latch is discarded.
+
+        Arguments: None
+
+        Return: number of latched positions
+        """
+        return self.usb_get_cmd(USB_CMD_GET_LATCH_CNT)
+
+    def get_latched_positions(self,times=False):
+        """
+        Reads and removes the latched positions from the device. A position
+        is latched by the device on each external interrupt edge when the 
+        external interrupts are 'enabled' or set to 'latch'. 
+
+        Keywords:
+          times = True or False (default). If True the device clock at 
+                  each latch is also returned.
+
+        Return: list of latched positions, oldest first, or list of
+                (position, device clock (usec)) if times == True.
+        """
+        latch_list = []
+        self.latch_lock.acquire()
+        try:
+            for i in range(self.get_latch_count()):
+                # Removes the latch - the device keeps its time for 
+                # USB_CMD_GET_LATCH_TIME 
+                pos = self.usb_get_cmd(USB_CMD_GET_LATCH_POS)
+                if times == True:
+                    clock = self.usb_get_cmd(USB_CMD_GET_LATCH_TIME) & 0xFFFFFFFF
+                    latch_list.append((pos,clock))
+                else:
+                    latch_list.append(pos)
+        finally:
+            self.latch_lock.release()
+        return latch_list
+
+    def set_step_mode(self,step_mode):
+        """
+        Sets the step generation mode. In 'fixed' mode each step period
+        is an integer number of timer counts so the obtained velocity is
+        quantized - coarsely so at high velocities. In 'dds' mode the
+        firmware uses a phase accumulator to alternate between adjacent
+        step periods so that the average velocity is exactly the velocity
+        set-point. The new mode takes effect on the next io update.
+
+        Argument:
+          step_mode = the step generation mode either strings, 'fixed'/'dds',
+                      or integers, STEP_MODE_FIXED/STEP_MODE_DDS.
+
+        Return: the new step generation mode 
+                'fixed' or 'dds' if type(step_mode) == str
+                 STEP_MODE_FIXED or STEP_MODE_DDS if type(step_mode) == int
+        """
+        if type(step_mode) == str:
+            try:
+                step_mode_val = STEP_MODE2VAL_DICT[step_mode.lower()]
+            except:
+                raise ValueError, "unknown step_mode string %s"%(step_mode,)
+        else:
+            try:
+                step_mode_val = int(step_mode)
+            except:
+                raise ValueError, "unable to convert step_mode to integer"
+            if not (step_mode_val in (STEP_MODE_FIXED,STEP_MODE_DDS)):
+                raise ValueError, "unknown step_mode integer %d"%(step_mode_val,)
+
+        # Send usb command
+        step_mode_val = self.usb_set_cmd(USB_CMD_SET_STEP_MODE,step_mode_val)
+        if type(step_mode) == str:
+            return VAL2STEP_MODE_DICT[step_mode_val]
+        else:
+            return step_mode_val
+
+    def get_step_mode(self,ret_type='str'):
+        """
+        Returns the current step generation mode.
+
+        Keywords:
+          ret_type = sets the return type 'str' or 'int'
+
+        Return: the step generation mode.
+                'fixed' or 'dds' if ret_type == 'str'
+                 STEP_MODE_FIXED or STEP_MODE_DDS if ret_type == 'int'
+        """
+        step_mode_val = self.usb_get_cmd(USB_CMD_GET_STEP_MODE)
+        if ret_type == 'str':
+            return VAL2STEP_MODE_DICT[step_mode_val]
+        elif ret_type == 'int':
+            return step_mode_val
+        else:
+            raise ValueError, "unknown ret_type %s"%(ret_type,)
+
+    def get_eff_vel(self):
+        """
+        Returns the effective (average) step rate produced by the current
+        timer settings in indices/sec. In 'fixed' step mode this is the
+        quantized velocity actually obtained for the velocity set-point. 
+        In 'dds' step mode it is equal to the velocity set-point.
+
+        Arguments: None
+
+        Return: effective velocity (indices/sec), a float.
+        """
+        eff_vel = self.usb_get_cmd(USB_CMD_GET_EFF_VEL)
+        return eff_vel/1000.0
+
+    def set_accel(self,accel):
+        """
+        Sets the velocity mode acceleration in indices/sec**2. When the
+        acceleration is nonzero the firmware ramps the motor velocity
+        toward the velocity set-point, passing through zero and reversing
+        direction if necessary, rather than changing it instantaneously.
+        Setting the acceleration to zero disables the ramp.
+
+        Argument:
+          accel = the acceleration (indices/sec**2), always >= 0
+
+        Return: the acceleration (indices/sec**2). 
+        """
+        try:
+            accel = int(accel)
+        except:
+            raise ValueError, "unable to convert accel to integer"
+        if accel < 0:
+            raise ValueError, "accel must be >= 0"
+
+        # Send usb command
+        accel = self.usb_set_cmd(USB_CMD_SET_ACCEL,accel)
+        return accel
+
+    def get_accel(self):
+        """
+        Returns the velocity mode acceleration in indices/sec**2. A 
+        value of 0 means velocity changes are instantaneous.
+
+        Arguments: None
+
+        Return: the acceleration (indices/sec**2)
+        """
+        accel = self.usb_get_cmd(USB_CMD_GET_ACCEL)
+        return accel
+
+    def get_clock(self):
+        """
+        Returns the device clock. The device clock is a free running 32 bit
+        microsecond counter which wraps every 2**32 usec (71.6 minutes).
+
+        Arguments: None
+
+        Return: device clock (usec) 
+        """
+        clock = self.usb_get_cmd(USB_CMD_GET_CLOCK)
+        return clock & 0xFFFFFFFF
+
+    def stage_move(self,pos,pos_vel):
+        """
+        Stages the next move on the device. The device switches to the
+        staged move as soon as the current move is complete, so there is
+        no stop/start gap between the moves. Staging a move replaces any
+        move already staged. The device must be in position mode. 
+
+        Arguments:
+          pos     = position set-point for the move (indices)
+          pos_vel = positioning velocity for the move (indices/sec)
+
+        Return: None
+        """
+        try:
+            pos = int(pos)
+        except:
+            raise ValueError, "unable to convert pos to integer"
+        try:
+            pos_vel = int(pos_vel)
+        except:
+            raise ValueError, "unable to convert pos_vel to integer"
+        if pos_vel < 0 or pos_vel > 0xFFFF:
+            raise ValueError, "pos_vel out of range"
+        staged = self.usb_set_cmd(USB_CMD_STAGE_MOVE,pos,io_update=False,aux=pos_vel)
+        if staged != 1:
+            raise RuntimeError, "device must be in position mode to stage a move"
+        return
+
+    def get_staged(self):
+        """
+        Returns whether or not a move is staged on the device, i.e. a
+        move was staged with stage_move and has not yet been started.
+
+        Arguments: None
+
+        Return: True or False
+        """
+        staged = self.usb_get_cmd(USB_CMD_GET_STAGED)
+        return staged == 1
 
     def cmd_test(self):
         """
@@ -1178,9 +3128,10 @@ class Simple_Step:
           
         Return: None
         """
+        self.stop_requested.clear()
         
         # Stop device and setting to positioning mode
-        self.set_status('stopped')
+        self.__setup_stop()
         self.set_mode('position')
 
         # Set position set-point and positioning velocity
@@ -1191,15 +3142,30 @@ class Simple_Step:
         self.set_pos_setpt(pos)
         
         # Perform move
+        if self.stop_requested.isSet():
+            # Stopped by another thread - abort
+            return
         self.start()
         while abs(self.get_pos_err())!=0:
+            if self.stop_requested.isSet():
+                # Stopped by another thread - abort
+                return
             time.sleep(0.1)
 
         # Stop device
-        self.stop()
+        self.set_status('stopped')
         return        
         
 
+    def __setup_stop(self):
+        """
+        Stops the device while a high level method sets up a move. Unlike
+        stop this doesn't request that the method be aborted, so a stop
+        from another thread made after the method began is not lost.
+        """
+        self.usb_set_cmd(USB_CMD_SET_STATUS,STOPPED)
+        return
+
     def move_by(self,pos,pos_vel=None):
         """
         Move the motor by the specified ammount.  The motor is stopped
@@ -1225,6 +3191,276 @@ class Simple_Step:
         return
 
 
+    def home(self,dir='negative',fast_vel=DEFAULT_HOME_FAST_VEL,
+             slow_vel=DEFAULT_HOME_SLOW_VEL,backoff=DEFAULT_HOME_BACKOFF,
+             wait=True):
+        """
+        Homes the motor using a switch wired to the external interrupt 
+        pin. The homing sequence is run by the device: a fast approach 
+        to the switch, a back off, and a slow re-approach. The position 
+        at which the switch is reached during the slow re-approach 
+        becomes the zero position, and the motor is then parked backoff 
+        indices away from the switch. The external interrupt setting, 
+        the mode, the positioning velocity and the velocity mode 
+        set-points are restored after homing, and the position set-point
+        is left at the final motor position. Stopping the device aborts 
+        homing. Homing can't be started while a motion program is 
+        running.
+
+        Keywords:
+          dir      = direction of the switch 'positive' or 'negative'
+          fast_vel = fast approach velocity (indices/sec)
+          slow_vel = slow re-approach velocity (indices/sec)
+          backoff  = back off distance (indices). Must be large enough 
+                     to release the switch.
+          wait     = True (default) or False. If True wait for homing
+                     to complete. 
+
+        Return: homing state, 'done' or 'aborted' if wait == True.
+        """
+        if type(dir) == str:
+            try:
+                dir_val = DIR2VAL_DICT[dir.lower()]
+            except KeyError:
+                raise ValueError, "unknown direction string %s"%(dir,)
+        else:
+            dir_val = int(dir)
+            if not dir_val in VAL2DIR_DICT:
+                raise ValueError, "unknown direction integer %d"%(dir_val,)
+        for name, val in (('fast_vel',fast_vel),('slow_vel',slow_vel),('backoff',backoff)):
+            if int(val) <= 0:
+                raise ValueError, "%s must be > 0"%(name,)
+
+        # Set homing parameters and start
+        self.usb_set_cmd(USB_CMD_SET_HOME_PARAM,int(fast_vel),aux=HOME_PARAM_FAST_VEL)
+        self.usb_set_cmd(USB_CMD_SET_HOME_PARAM,int(slow_vel),aux=HOME_PARAM_SLOW_VEL)
+        self.usb_set_cmd(USB_CMD_SET_HOME_PARAM,int(backoff),aux=HOME_PARAM_BACKOFF)
+        state_val = self.usb_set_cmd(USB_CMD_START_HOME,dir_val)
+        state = VAL2HOME_STATE_DICT[state_val]
+        if state == 'busy':
+            raise RuntimeError, "unable to start homing - motion program running"
+        if wait == False:
+            return state
+
+        # Wait for homing to complete
+        while not state in ('done', 'aborted'):
+            time.sleep(HOME_POLL_DT)
+            state = self.get_home_state()
+        return state
+
+    def get_home_state(self,ret_type='str'):
+        """
+        Returns the state of the homing sequence: 'none' (never homed),
+        'fast', 'backoff', 'slow', 'park' (homing in progress), 'done' 
+        or 'aborted'. 
+
+        Keywords:
+          ret_type = sets the return type 'str' or 'int' 
+
+        Return: homing state
+        """
+        state_val = self.usb_get_cmd(USB_CMD_GET_HOME_STATE)
+        if ret_type == 'str':
+            return VAL2HOME_STATE_DICT[state_val]
+        elif ret_type == 'int':
+            return state_val
+        else:
+            raise ValueError, "unknown ret_type %s"%(ret_type,)
+
+    def load_program(self,program):
+        """
+        Uploads a motion program to the device. The program is run by 
+        the device's motion program interpreter, alongside command 
+        processing, so its timing doesn't depend on the host or usb 
+        latency. See the motion_program module for the instructions.
+
+        Arguments:
+          program = list of instruction tuples, or program code compiled
+                    with motion_program.compile_program
+
+        Return: the compiled program code
+        """
+        if len(program) > 0 and type(program[0][0]) == str:
+            code = motion_program.compile_program(program)
+        else:
+            code = list(program)
+        if len(code) == 0 or len(code) > motion_program.PROG_TABLE_SIZE:
+            raise ValueError, "program length must be in range 1-%d"%(motion_program.PROG_TABLE_SIZE,)
+        # Writing instruction 0 clears the program 
+        for i, (op, arg) in enumerate(code):
+            num = self.usb_set_cmd(USB_CMD_SET_PROG,arg,io_update=False,aux=(op << 8) | i)
+            if num != i+1:
+                raise IOError, "failed to set program instruction %d"%(i,)
+        return code
+
+    def run_program(self,program=None,wait=False):
+        """
+        Starts the motion program from its first instruction. The motor 
+        is put into position mode at its current position. Stopping the 
+        device aborts the program.
+
+        Keywords:
+          program = program to load before starting. If None (default)
+                    the loaded program is run.
+          wait    = True or False (default). If True wait for the program 
+                    to finish.
+
+        Return: program state, 'done' or 'aborted' if wait == True.
+        """
+        if program is not None:
+            self.load_program(program)
+        self.stop_requested.clear()
+        state_val = self.usb_set_cmd(USB_CMD_RUN_PROG,1,io_update=False)
+        state = VAL2PROG_STATE_DICT[state_val]
+        if state != 'running':
+            raise RuntimeError, "unable to start program"
+        if wait == False:
+            return state
+        while state == 'running':
+            if self.stop_requested.isSet():
+                # Stopping the device aborts the program
+                state = self.get_program_state()
+                break
+            time.sleep(PROG_POLL_DT)
+            state = self.get_program_state()
+        return state
+
+    def stop_program(self):
+        """
+        Aborts the running motion program and stops the motor.
+
+        Arguments: None
+
+        Return: program state
+        """
+        state_val = self.usb_set_cmd(USB_CMD_RUN_PROG,0,io_update=False)
+        return VAL2PROG_STATE_DICT[state_val]
+
+    def get_program_state(self,ret_type='str'):
+        """
+        Returns the motion program state.
+
+        Keywords:
+          ret_type = 'str' or 'int'
+
+        Return: 'stopped', 'running', 'done' or 'aborted'
+        """
+        state_val = self.usb_get_cmd(USB_CMD_GET_PROG) & 0xFF
+        if ret_type == 'str':
+            return VAL2PROG_STATE_DICT[state_val]
+        elif ret_type == 'int':
+            return state_val
+        else:
+            raise ValueError, "unknown ret_type %s"%(ret_type,)
+
+    def get_program_counter(self):
+        """
+        Returns the index of the motion program instruction being run.
+
+        Arguments: None
+
+        Return: program counter 
+        """
+        return self.usb_get_cmd(USB_CMD_GET_PROG) >> 8
+
+    def queue_move(self,pos,pos_vel=None):
+        """
+        Adds a move to the move queue. The queued moves are performed
+        by run_queue.
+
+        Arguments:
+          pos = motor position for move (indices)
+
+        Keywords:
+          pos_vel = positioning velocity for move. Default = None. If 
+                    pos_vel is equal to None then half the maximum allowed
+                    motor velocity is used for the move.
+
+        Return: number of moves in the queue.
+        """
+        try:
+            pos = int(pos)
+        except:
+            raise ValueError, "unable to convert pos to integer"
+        if pos_vel == None:
+            pos_vel = self.max_vel/2.0
+        try:
+            pos_vel = int(pos_vel)
+        except:
+            raise ValueError, "unable to convert pos_vel to integer"
+        if pos_vel < 0:
+            raise ValueError, "pos_vel must be >= 0"
+        self.move_queue.append((pos,pos_vel))
+        return len(self.move_queue)
+
+    def clear_queue(self):
+        """
+        Removes all moves from the move queue.
+
+        Arguments: None
+
+        Return: None
+        """
+        self.move_queue = []
+        return
+
+    def run_queue(self,poll_dt=QUEUE_POLL_DT):
+        """
+        Performs the moves in the move queue back to back. The motor is
+        placed in stopped and positioning mode and the first move is 
+        started. Each following move is staged on the device while the
+        previous move is running and the device switches to it the moment 
+        the previous move completes, so there is no stop/start gap between 
+        moves. After the last move is complete the motor is stopped and
+        the queue is cleared.
+
+        Keywords:
+          poll_dt = poll period (sec) used when waiting for the device to 
+                    start a staged move. Must be shorter than the duration
+                    of the moves.
+
+        Return: None
+        """
+        move_list = self.move_queue
+        self.move_queue = []
+        if len(move_list) == 0:
+            return
+        self.stop_requested.clear()
+
+        # Stop device and set to positioning mode
+        self.__setup_stop()
+        self.set_mode('position')
+
+        # Start first move
+        pos, pos_vel = move_list[0]
+        self.set_pos_vel(pos_vel)
+        self.set_pos_setpt(pos)
+        if self.stop_requested.isSet():
+            return
+        self.start()
+
+        for pos, pos_vel in move_list[1:]:
+
+            # Stage next move and wait until device starts it
+            if self.stop_requested.isSet():
+                return
+            self.stage_move(pos, pos_vel)
+            while self.get_staged() == True:
+                if self.stop_requested.isSet():
+                    # Stopped by another thread - abort
+                    return
+                time.sleep(poll_dt)
+
+        # Wait for last move to complete 
+        while abs(self.get_pos_err())!=0:
+            if self.stop_requested.isSet():
+                return
+            time.sleep(poll_dt)
+
+        # Stop device
+        self.set_status('stopped')
+        return
+
     def set_vel_and_dir(self,vel,dir):
         """
         Sets the velocity and direction of the motor. The motor is placed in 
@@ -1252,16 +3488,22 @@ class Simple_Step:
         return
 
 
-    def soft_ramp_to_vel(self,vel,dir,accel,dt=0.1):
+    def soft_ramp_to_vel(self,vel,dir,accel,dt=0.1,firmware=False):
         """
         Performs a ramp (constant acceleration) from the current
-        velocity to the specified velocity. The ramp is performed in
-        software on the PC side by setting a time course of velocity
-        set-points.  For this reason the time course of accelerations
-        will not be exact.  The purpose of this function is to aid
-        changing the velocity of loads with a lot of inertia.  Note,
-        this function will place the at90usb device in velocity mode
-        and will start the device.
+        velocity to the specified velocity. By default the ramp is
+        performed in software on the PC side by setting a time course 
+        of velocity set-points. For this reason the time course of 
+        accelerations will not be exact. Any firmware acceleration (see
+        set_accel) is turned off during the ramp and restored after it.
+        If firmware=True the ramp is performed by the firmware - the 
+        acceleration is set using set_accel and the velocity set-point 
+        is sent once. Note, the acceleration then remains set after the
+        call, so later velocity changes are also ramped - use 
+        set_accel(0) to restore instantaneous velocity changes. The 
+        purpose of this function is to aid changing the velocity of 
+        loads with a lot of inertia. Note, this function will place the
+        at90usb device in velocity mode and will start the device.
 
         Arguments:
           vel   = the desired velocity in ind/sec
@@ -1270,7 +3512,10 @@ class Simple_Step:
           accel = the desired acceleration in ind/sec**2
           
         Keywords:
-          dt    = time step for velocity updates is sec.  
+          dt       = time step for velocity updates is sec. Only used
+                     when firmware=False.
+          firmware = True or False (default). Determines whether the
+                     ramp is performed by the firmware or by the PC.
                   
         Return: None.
         """
@@ -1298,13 +3543,38 @@ class Simple_Step:
             vel_new = vel
         else:
             vel_new = -vel
+        self.stop_requested.clear()
 
         # Set stop device and set mode if necessary
         if self.get_mode() == 'position':
-            self.stop()
+            self.__setup_stop()
             self.set_vel_setpt(0)
             self.set_mode('velocity')
-            
+
+        if firmware == True:
+            # Let the firmware perform the ramp
+            self.set_accel(accel)
+            self.set_dir_setpt(dir, io_update=False)
+            self.set_vel_setpt(vel)
+            if self.get_status() == 'stopped' and not self.stop_requested.isSet():
+                self.start()
+            return
+
+        # Software ramp - disable firmware ramp while ramping
+        accel_prev = self.get_accel()
+        if accel_prev != 0:
+            self.set_accel(0)
+        try:
+            self.__soft_ramp_vel(vel, vel_new, dir, accel, dt)
+        finally:
+            if accel_prev != 0:
+                self.set_accel(accel_prev)
+        return
+
+    def __soft_ramp_vel(self,vel,vel_new,dir,accel,dt):
+        """
+        Software velocity ramp, see soft_ramp_to_vel.
+        """
         # Get signed version of current velocity 
         dir_cur = self.get_dir()
         if dir_cur == 'positive':
@@ -1328,12 +3598,19 @@ class Simple_Step:
         dt_last = abs(vel_new - int(vel_cur + dt*N*accel))/abs(float(accel))
 
         # Start device if it is stopped
+        if self.stop_requested.isSet():
+            # Stopped by another thread - abort
+            return
         if self.get_status() == 'stopped':
             self.start()
 
         # Ramp to desired velocity
         for i in range(0,N):
 
+            if self.stop_requested.isSet():
+                # Stopped by another thread - abort
+                return
+
             # Set direction and velocity
             v = int(vel_cur + dt*(i+1)*accel)
             if v < 0:
@@ -1396,9 +3673,10 @@ class Simple_Step:
         dt = float(dt)
         if dt <= 0:
             raise ValueError, "dt must be > 0"
+        self.stop_requested.clear()
 
         # Stop device, set to positioning mode and set position set-point 
-        self.set_status('stopped')
+        self.__setup_stop()
         self.set_mode('position')
         self.set_pos_setpt(pos)
         
@@ -1414,11 +3692,18 @@ class Simple_Step:
 
         # Set intial velocity
         self.set_pos_vel(0)
+        if self.stop_requested.isSet():
+            # Stopped by another thread - abort
+            return
         self.start()        
 
         # Ramp to position
         cnt = 0
         while abs(self.get_pos_err()) != 0:
+
+            if self.stop_requested.isSet():
+                # Stopped by another thread - abort
+                return
             
             # Get current position
             pos_cur = self.get_pos()
@@ -1454,7 +3739,7 @@ class Simple_Step:
             time.sleep(dt)
             
         # Ramp complete
-        self.stop()    
+        self.set_status('stopped')    
         return
             
     def print_values(self):
@@ -1486,6 +3771,8 @@ class Simple_Step:
         print '   maximum velocity:', self.get_max_vel()
         print '   minimum velocity:', self.get_min_vel()
         print '   external interrupts:', self.get_ext_int()
+        print '   step mode:', self.get_step_mode()
+        print '   effective velocity:', self.get_eff_vel()
         
         print 
         print ' position mode settings'
@@ -1497,8 +3784,73 @@ class Simple_Step:
         print ' ' + '-'*35
         print '   velocity set-point:', self.get_vel_setpt()
         print '   direction set-point:', self.get_dir_setpt()
+        print '   acceleration:', self.get_accel()
         
         
+def is_priority_cmd(out_bytes):
+    """
+    Checks whether a usb output packet is a safety command, i.e., a stop
+    or disable, which should be sent ahead of other commands.
+
+    Arguments:
+      out_bytes = list of bytes to send to the device
+
+    Return: True or False
+    """
+    if len(out_bytes) < 3:
+        return False
+    cmd_id = ord(out_bytes[0])
+    if not cmd_id in PRIORITY_CMD_DICT:
+        return False
+    return ord(out_bytes[2]) == PRIORITY_CMD_DICT[cmd_id]
+
+def is_undo_priority_cmd(out_bytes):
+    """
+    Checks whether a usb output packet would undo a safety command, i.e.,
+    it starts, arms or enables the device.
+
+    Arguments:
+      out_bytes = list of bytes to send to the device
+
+    Return: True or False
+    """
+    if len(out_bytes) < 3:
+        return False
+    cmd_id = ord(out_bytes[0])
+    if not cmd_id in UNDO_PRIORITY_CMD_DICT:
+        return False
+    return ord(out_bytes[2]) in UNDO_PRIORITY_CMD_DICT[cmd_id]
+
+def stop_all(dev_list=None,disable=False):
+    """
+    Emergency stop. Stops, and optionally disables, all open devices. The
+    commands are issued to the devices in parallel.
+
+    Keywords:
+      dev_list = list of devices to stop. If None (default) all open
+                 devices are stopped.
+      disable  = True or False (default). If True the drives are also 
+                 disabled.
+
+    Return: None
+    """
+    if dev_list is None:
+        dev_list = open_devices.keys()
+
+    def stop_dev(dev):
+        dev.stop()
+        if disable == True:
+            dev.disable()
+
+    thread_list = []
+    for dev in dev_list:
+        thread = threading.Thread(target=stop_dev, args=(dev,))
+        thread.start()
+        thread_list.append(thread)
+    for thread in thread_list:
+        thread.join()
+    return
+
 def check_cmd_id(expected_id,received_id):
     """
     Compares expected and received command ids.
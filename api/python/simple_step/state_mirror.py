@@ -0,0 +1,372 @@
+"""
+-----------------------------------------------------------------------
+simple_step
+Copyright (C) William Dickson, 2008.
+
+wbd@caltech.edu
+www.willdickson.com
+
+Released under the LGPL Licence, Version 3
+
+This file is part of simple_step.
+
+simple_step is free software: you can redistribute it and/or modify it
+under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+simple_step is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with simple_step.  If not, see
+<http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------------------
+
+Purpose: Provides a shared memory mirror of the state of the at90usb
+based stepper motor controller. Only one process can own the device's
+usb handle. The State_Publisher, running in that process, polls the
+device and writes the latest state into a memory mapped file. Any
+number of State_Reader objects, in other processes, can then read the
+state locally without any usb or ipc round trips.
+
+The shared memory block is protected by a sequence lock. The publisher
+makes the sequence number odd while writing and even when done. Readers
+retry if the sequence number is odd or changes during the read. 
+
+Note, the sequence lock makes the published record consistent, i.e., 
+all of its fields come from the same publish, but the fields are not 
+sampled at the same instant. Each field is read from the device with 
+its own usb command, so a publish of the dozen fields takes a dozen 
+usb round trips, and the fields are spread over that time.
+
+Author: William Dickson
+
+------------------------------------------------------------------------
+"""
+import os
+import mmap
+import struct
+import threading
+import time
+from simple_step import VAL2DIR_DICT
+from simple_step import VAL2MODE_DICT
+from simple_step import VAL2STATUS_DICT
+from simple_step import VAL2ENABLE_DICT
+
+# Directory for shared memory files - use tmpfs when available
+if os.path.isdir('/dev/shm'):
+    SHM_DIR = '/dev/shm'
+else:
+    import tempfile
+    SHM_DIR = tempfile.gettempdir()
+
+# Default publisher poll period (sec). Longer than a publish takes - one
+# usb round trip per field, roughly 15-30 ms for all fields - so that 
+# the publisher leaves the device free for other commands.
+DEFAULT_PERIOD = 0.05
+
+# Maximum number of read attempts before giving up on a consistent read
+MAX_READ_TRIES = 1000
+
+# State record layout. The sequence number is stored separately, in
+# front of the record, so that it can be read and written on its own.
+SEQ_FORMAT = '<I'
+SEQ_SIZE = struct.calcsize(SEQ_FORMAT)
+STATE_FIELDS = (
+    ('count',     'I'),
+    ('time',      'd'),
+    ('pos',       'i'),
+    ('vel',       'i'),
+    ('dir',       'B'),
+    ('mode',      'B'),
+    ('status',    'B'),
+    ('enable',    'B'),
+    ('pos_setpt', 'i'),
+    ('pos_err',   'i'),
+    ('pos_vel',   'i'),
+    ('vel_setpt', 'i'),
+    ('dir_setpt', 'B'),
+    )
+STATE_NAMES = [name for name, fmt in STATE_FIELDS]
+STATE_FORMAT = '<' + ''.join([fmt for name, fmt in STATE_FIELDS])
+STATE_SIZE = struct.calcsize(STATE_FORMAT)
+SHM_SIZE = SEQ_SIZE + STATE_SIZE
+
+def get_shm_path(serial_number):
+    """
+    Returns the default shared memory file path for the device with the
+    given serial number.
+    """
+    return os.path.join(SHM_DIR, 'simple_step_%s'%(serial_number,))
+
+class State_Publisher:
+
+    """
+    Polls a Simple_Step device and publishes its state to a shared
+    memory block. The device should be opened with threaded=True if
+    other threads in the owning process also use it.
+    """
+
+    def __init__(self,dev,path=None,period=DEFAULT_PERIOD):
+        """
+        Initialize state publisher.
+
+        Arguments:
+          dev = Simple_Step device
+
+        Keywords:
+          path   = shared memory file path. If None (default) the path is
+                   derived from the device's serial number.
+          period = poll period (sec). Should be longer than a publish
+                   takes, see publish.
+
+        Return: None
+        """
+        self.dev = dev
+        if path == None:
+            path = get_shm_path(dev.get_serial_number())
+        self.path = path
+        self.period = period
+        self.seq = 0
+        self.count = 0
+        self.thread = None
+        self.thread_stop = threading.Event()
+
+        # Create and map shared memory file
+        fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0644)
+        try:
+            os.ftruncate(fd, SHM_SIZE)
+            self.shm = mmap.mmap(fd, SHM_SIZE)
+        finally:
+            os.close(fd)
+        self.shm[:SEQ_SIZE] = struct.pack(SEQ_FORMAT, self.seq)
+
+    def close(self):
+        """
+        Stops publishing and unmaps the shared memory. The shared memory
+        file is left in place, with the last published state, for the
+        readers.
+
+        Arguments: None
+
+        Return: None
+        """
+        self.stop()
+        self.shm.close()
+        return
+
+    def start(self):
+        """
+        Starts publishing in a background thread.
+
+        Arguments: None
+
+        Return: None
+        """
+        if self.thread is not None:
+            return
+        self.thread_stop.clear()
+        self.thread = threading.Thread(target=self.__publish_loop)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        return
+
+    def stop(self):
+        """
+        Stops the background publishing thread.
+
+        Arguments: None
+
+        Return: None
+        """
+        if self.thread is None:
+            return
+        self.thread_stop.set()
+        self.thread.join()
+        self.thread = None
+        return
+
+    def publish(self):
+        """
+        Reads the device state and writes it to shared memory. The 
+        fields are read one after the other, with one usb command each, 
+        so they are not sampled at the same instant.
+
+        Arguments: None
+
+        Return: dictionary of published state values
+        """
+        dev = self.dev
+        state = {
+            'count'     : self.count,
+            'pos'       : dev.get_pos(),
+            'vel'       : dev.get_vel(),
+            'dir'       : dev.get_dir(ret_type='int'),
+            'mode'      : dev.get_mode(ret_type='int'),
+            'status'    : dev.get_status(ret_type='int'),
+            'enable'    : dev.get_enable(ret_type='int'),
+            'pos_setpt' : dev.get_pos_setpt(),
+            'pos_err'   : dev.get_pos_err(),
+            'pos_vel'   : dev.get_pos_vel(),
+            'vel_setpt' : dev.get_vel_setpt(),
+            'dir_setpt' : dev.get_dir_setpt(ret_type='int'),
+            }
+        state['time'] = time.time()
+        data = struct.pack(STATE_FORMAT, *[state[name] for name in STATE_NAMES])
+
+        # Sequence lock write - odd sequence number while writing
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        self.shm[:SEQ_SIZE] = struct.pack(SEQ_FORMAT, self.seq)
+        self.shm[SEQ_SIZE:SHM_SIZE] = data
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        self.shm[:SEQ_SIZE] = struct.pack(SEQ_FORMAT, self.seq)
+        self.count += 1
+        return state
+
+    def __publish_loop(self):
+        """
+        Background publishing thread. Communication errors are retried
+        on the next poll.
+        """
+        while not self.thread_stop.isSet():
+            t0 = time.time()
+            try:
+                self.publish()
+            except IOError, err:
+                pass
+            dt = self.period - (time.time() - t0)
+            if dt > 0:
+                self.thread_stop.wait(dt)
+        return
+
+class State_Reader:
+
+    """
+    Reads device state published by a State_Publisher. The getter methods
+    have the same names and return values as those of Simple_Step, but
+    return the most recently published values.
+    """
+
+    def __init__(self,serial_number=None,path=None):
+        """
+        Initialize state reader.
+
+        Keywords:
+          serial_number = serial number of published device.
+          path          = shared memory file path. Used in place of the
+                          path derived from the serial number.
+
+        Return: None
+        """
+        if path == None:
+            if serial_number == None:
+                raise ValueError, "serial_number or path must be given"
+            path = get_shm_path(serial_number)
+        self.path = path
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            self.shm = mmap.mmap(fd, SHM_SIZE, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        """
+        Unmaps the shared memory.
+
+        Arguments: None
+
+        Return: None
+        """
+        self.shm.close()
+        return
+
+    def get_state(self):
+        """
+        Returns a consistent snapshot of the published state.
+
+        Arguments: None
+
+        Return: dictionary of state values (integer values for dir,
+                mode, status, enable and dir_setpt).
+        """
+        for i in range(MAX_READ_TRIES):
+            seq0, = struct.unpack(SEQ_FORMAT, self.shm[:SEQ_SIZE])
+            if seq0 & 1:
+                # Write in progress
+                time.sleep(0)
+                continue
+            data = self.shm[SEQ_SIZE:SHM_SIZE]
+            seq1, = struct.unpack(SEQ_FORMAT, self.shm[:SEQ_SIZE])
+            if seq0 == seq1:
+                break
+        else:
+            raise IOError, "unable to obtain consistent state from shared memory"
+        if seq0 == 0:
+            raise RuntimeError, "no state has been published"
+        return dict(zip(STATE_NAMES, struct.unpack(STATE_FORMAT, data)))
+
+    def get_age(self):
+        """
+        Returns the time since the state was published.
+
+        Arguments: None
+
+        Return: age of state (sec)
+        """
+        return time.time() - self.get_state()['time']
+
+    def get_pos(self):
+        """Returns the published motor position (indices)."""
+        return self.get_state()['pos']
+
+    def get_vel(self):
+        """Returns the published motor velocity (indices/sec)."""
+        return self.get_state()['vel']
+
+    def get_pos_setpt(self):
+        """Returns the published position set-point (indices)."""
+        return self.get_state()['pos_setpt']
+
+    def get_pos_err(self):
+        """Returns the published position error (indices)."""
+        return self.get_state()['pos_err']
+
+    def get_pos_vel(self):
+        """Returns the published positioning velocity (indices/sec)."""
+        return self.get_state()['pos_vel']
+
+    def get_vel_setpt(self):
+        """Returns the published velocity set-point (indices/sec)."""
+        return self.get_state()['vel_setpt']
+
+    def get_dir(self,ret_type='str'):
+        """Returns the published motor direction (string or integer)."""
+        return self.__convert(self.get_state()['dir'], VAL2DIR_DICT, ret_type)
+
+    def get_dir_setpt(self,ret_type='str'):
+        """Returns the published direction set-point (string or integer)."""
+        return self.__convert(self.get_state()['dir_setpt'], VAL2DIR_DICT, ret_type)
+
+    def get_mode(self,ret_type='str'):
+        """Returns the published operating mode (string or integer)."""
+        return self.__convert(self.get_state()['mode'], VAL2MODE_DICT, ret_type)
+
+    def get_status(self,ret_type='str'):
+        """Returns the published device status (string or integer)."""
+        return self.__convert(self.get_state()['status'], VAL2STATUS_DICT, ret_type)
+
+    def get_enable(self,ret_type='str'):
+        """Returns the published enable status (string or integer)."""
+        return self.__convert(self.get_state()['enable'], VAL2ENABLE_DICT, ret_type)
+
+    def __convert(self,val,val2str_dict,ret_type):
+        if ret_type == 'str':
+            return val2str_dict[val]
+        elif ret_type == 'int':
+            return val
+        else:
+            raise ValueError, "unknown ret_type %s"%(ret_type,)
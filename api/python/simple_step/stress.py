@@ -0,0 +1,447 @@
+"""
+-----------------------------------------------------------------------
+simple_step
+Copyright (C) William Dickson, 2008.
+
+wbd@caltech.edu
+www.willdickson.com
+
+Released under the LGPL Licence, Version 3
+
+This file is part of simple_step.
+
+simple_step is free software: you can redistribute it and/or modify it
+under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+simple_step is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with simple_step.  If not, see
+<http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------------------
+
+Purpose: Provides a soak and stress test of the usb command path of the
+at90usb based stepper motor controller. One thread per device sends a
+randomized mix of get and set commands as fast as possible. Throughput,
+latency percentiles, set value read back errors, retries, command id 
+mismatches, errors and reconnects are tracked for each reporting 
+interval and for the whole run, and can be written to a compact json 
+report.
+
+The devices are stopped and placed in velocity mode for the test, so 
+the set commands don't move the motor. The mode and the set-points 
+changed by the test are restored at the end.
+
+Author: William Dickson
+
+------------------------------------------------------------------------
+"""
+import time
+import math
+import json
+import random
+import threading
+from simple_step import *
+
+# Default reporting interval (sec)
+DEFAULT_INTERVAL = 10.0
+
+# Time to wait between reconnect attempts (sec)
+RECONNECT_WAIT = 1.0
+
+# Latency histogram - log spaced bins, BINS_PER_DECADE per decade of 
+# microseconds. Used for whole run percentiles with constant memory.
+BINS_PER_DECADE = 20
+LATENCY_PERCENTILES = (50, 90, 99, 99.9)
+
+# Get commands used in the test
+GET_CMD_LIST = (
+    USB_CMD_GET_POS, USB_CMD_GET_POS_SETPT, USB_CMD_GET_VEL_SETPT, 
+    USB_CMD_GET_VEL, USB_CMD_GET_DIR_SETPT, USB_CMD_GET_MODE, 
+    USB_CMD_GET_POS_VEL, USB_CMD_GET_POS_ERR, USB_CMD_GET_MAX_VEL, 
+    USB_CMD_GET_MIN_VEL, USB_CMD_GET_STATUS, USB_CMD_GET_DIR,
+    USB_CMD_GET_ENABLE, USB_CMD_GET_EXT_INT, USB_CMD_GET_STEP_MODE,
+    USB_CMD_GET_ACCEL, USB_CMD_GET_CLOCK,
+    )
+
+# Set commands used in the test - the set-points are restored after 
+# the test. 
+SET_CMD_LIST = (
+    USB_CMD_SET_VEL_SETPT, USB_CMD_SET_POS_VEL, USB_CMD_SET_DIR_SETPT,
+    USB_CMD_SET_ACCEL,
+    )
+
+# Default fraction of set commands in the command mix
+DEFAULT_SET_FRACTION = 0.25
+
+class Stress_Test:
+
+    """
+    Soak and stress test of the usb command path of one or more devices.
+    """
+
+    def __init__(self,dev_list,seed=None,set_fraction=DEFAULT_SET_FRACTION,reconnect=True):
+        """
+        Initialize stress test.
+
+        Arguments:
+          dev_list = list of Simple_Step devices (or a Simple_Step_Pool)
+
+        Keywords:
+          seed         = random number generator seed. If None the current
+                         time is used. 
+          set_fraction = fraction of set commands in the command mix
+          reconnect    = True (default) or False. If True a device is 
+                         closed and reopened, by serial number, after an
+                         error other than a command id mismatch. 
+
+        Return: None
+        """
+        self.dev_list = list(dev_list)
+        if seed is None:
+            seed = int(time.time())
+        self.seed = seed
+        self.set_fraction = float(set_fraction)
+        self.reconnect = reconnect
+        self.serial_numbers = [dev.get_serial_number() for dev in self.dev_list]
+        self.open_options = [dev.get_open_options() for dev in self.dev_list]
+        self.stats_lock = threading.Lock()
+        self.thread_stop = threading.Event()
+        self.intervals = []
+        self.totals = [_new_stats() for dev in self.dev_list]
+        self.current = [_new_stats() for dev in self.dev_list]
+        self.histograms = [{} for dev in self.dev_list]
+        self.t_start = None
+        self.t_stop = None
+
+    def run(self,duration,interval=DEFAULT_INTERVAL,report=None,verbose=True):
+        """
+        Runs the stress test. The test can be ended early with Ctrl-C.
+
+        Arguments:
+          duration = test duration (sec)
+
+        Keywords:
+          interval = reporting interval (sec)
+          report   = report file name. If not None the json report is 
+                     written at the end of every interval.
+          verbose  = True (default) or False. If True print interval 
+                     statistics.
+
+        Return: None
+        """
+        saved = [self.__prepare(dev) for dev in self.dev_list]
+        self.thread_stop.clear()
+        threads = []
+        for i in range(len(self.dev_list)):
+            thread = threading.Thread(target=self.__worker, args=(i,))
+            thread.setDaemon(True)
+            threads.append(thread)
+        self.t_start = time.time()
+        for thread in threads:
+            thread.start()
+
+        t_next = self.t_start + interval
+        try:
+            while time.time() < self.t_start + duration:
+                t_wait = min(t_next, self.t_start + duration) - time.time()
+                if t_wait > 0:
+                    time.sleep(min(t_wait, 0.5))
+                if time.time() >= t_next and t_next < self.t_start + duration:
+                    self.__end_interval(verbose)
+                    if report is not None:
+                        self.write_report(report)
+                    t_next += interval
+        except KeyboardInterrupt:
+            if verbose:
+                print 'interrupted'
+        self.thread_stop.set()
+        for thread in threads:
+            thread.join()
+        self.t_stop = time.time()
+        self.__end_interval(verbose)
+        for dev, values in zip(self.dev_list, saved):
+            try:
+                self.__restore(dev, values)
+            except IOError, err:
+                pass
+        if report is not None:
+            self.write_report(report)
+        return
+
+    def get_report(self):
+        """
+        Returns the test report.
+
+        Arguments: None
+
+        Return: dictionary with the test settings, whole run statistics 
+                ('totals') for each device and the statistics for each 
+                reporting interval ('intervals').
+        """
+        self.stats_lock.acquire()
+        try:
+            totals = []
+            for sn, stats, hist in zip(self.serial_numbers, self.totals, self.histograms):
+                entry = _summarize(stats)
+                entry['serial_number'] = sn
+                for p in LATENCY_PERCENTILES:
+                    entry['lat_p%s'%(p,)] = _hist_percentile(hist, p)
+                totals.append(entry)
+            t_end = self.t_stop if self.t_stop is not None else time.time()
+            report = {
+                'start'        : self.t_start,
+                'duration'     : t_end - self.t_start if self.t_start is not None else 0.0,
+                'seed'         : self.seed,
+                'set_fraction' : self.set_fraction,
+                'devices'      : self.serial_numbers,
+                'totals'       : totals,
+                'intervals'    : list(self.intervals),
+                }
+        finally:
+            self.stats_lock.release()
+        return report
+
+    def write_report(self,filename):
+        """
+        Writes the json test report.
+
+        Arguments:
+          filename = report file name
+
+        Return: None
+        """
+        report = self.get_report()
+        fid = open(filename, 'w')
+        try:
+            json.dump(report, fid, separators=(',',':'))
+        finally:
+            fid.close()
+        return
+
+    def print_summary(self):
+        """
+        Prints the whole run statistics for each device.
+
+        Arguments: None
+
+        Return: None
+        """
+        report = self.get_report()
+        print 'duration: %1.1f sec, seed: %d'%(report['duration'], report['seed'])
+        for entry in report['totals']:
+            print 
+            print 'device: %s'%(entry['serial_number'],)
+            print '  commands:      %d (%1.1f/sec)'%(entry['count'], entry['count']/max(report['duration'],1.0e-9))
+            for p in LATENCY_PERCENTILES:
+                name = 'lat_p%s'%(p,)
+                print '  latency p%-5s %s'%(str(p)+':', _fmt_ms(entry[name]))
+            print '  latency max:   %s'%(_fmt_ms(entry['lat_max']),)
+            for name in ('retries', 'cmd_id_errors', 'value_errors', 'errors', 'reconnects'):
+                print '  %-14s %d'%(name+':', entry[name])
+        return
+
+    def __prepare(self,dev):
+        """
+        Stops the device, places it in velocity mode and returns the 
+        mode and the set-points changed by the test.
+        """
+        dev.stop()
+        mode = dev.get_mode(ret_type='int')
+        dev.set_mode('velocity')
+        return {
+            USB_CMD_SET_MODE      : mode,
+            USB_CMD_SET_VEL_SETPT : dev.get_vel_setpt(),
+            USB_CMD_SET_POS_VEL   : dev.get_pos_vel(),
+            USB_CMD_SET_DIR_SETPT : dev.get_dir_setpt(ret_type='int'),
+            USB_CMD_SET_ACCEL     : dev.get_accel(),
+            }
+
+    def __restore(self,dev,values):
+        """
+        Restores the set-points changed by the test and then the mode.
+        """
+        values = dict(values)
+        mode = values.pop(USB_CMD_SET_MODE)
+        for cmd_id, val in values.iteritems():
+            dev.usb_set_cmd(cmd_id, val, io_update=False)
+        dev.set_mode(mode)
+        return
+
+    def __worker(self,i):
+        """
+        Test thread for device i. 
+        """
+        rng = random.Random(self.seed + i)
+        dev = self.dev_list[i]
+        max_vel, min_vel = dev.max_vel, dev.min_vel
+        io_stats = dev.get_io_stats()
+        while not self.thread_stop.isSet():
+            # Random command
+            if rng.random() < self.set_fraction:
+                cmd_id = rng.choice(SET_CMD_LIST)
+                if cmd_id in (USB_CMD_SET_VEL_SETPT, USB_CMD_SET_POS_VEL):
+                    val = rng.randint(min_vel, max_vel)
+                elif cmd_id == USB_CMD_SET_DIR_SETPT:
+                    val = rng.choice((POSITIVE, NEGATIVE))
+                else:
+                    val = rng.randint(0, 100000)
+            else:
+                cmd_id = rng.choice(GET_CMD_LIST)
+                val = None
+
+            error = False
+            value_error = False
+            t0 = time.time()
+            try:
+                if val is None:
+                    dev.usb_get_cmd(cmd_id)
+                else:
+                    value_error = dev.usb_set_cmd(cmd_id, val, io_update=False) != val
+            except Exception, err:
+                error = True
+            dt = time.time() - t0
+
+            io_stats_new = dev.get_io_stats()
+            retries = io_stats_new['retries'] - io_stats['retries']
+            cmd_id_errors = io_stats_new['cmd_id_errors'] - io_stats['cmd_id_errors']
+            io_stats = io_stats_new
+
+            self.stats_lock.acquire()
+            try:
+                for stats in (self.current[i], self.totals[i]):
+                    stats['retries'] += retries
+                    stats['cmd_id_errors'] += cmd_id_errors
+                    if error:
+                        stats['errors'] += 1
+                    else:
+                        stats['count'] += 1
+                        stats['value_errors'] += int(value_error)
+                        stats['lat_sum'] += dt
+                        stats['lat_max'] = max(stats['lat_max'], dt)
+                if not error:
+                    self.current[i]['lat_list'].append(dt)
+                    _hist_add(self.histograms[i], dt)
+            finally:
+                self.stats_lock.release()
+
+            if error and cmd_id_errors == 0 and self.reconnect:
+                dev = self.__reconnect(i)
+                if dev is None:
+                    break
+                io_stats = dev.get_io_stats()
+        return
+
+    def __reconnect(self,i):
+        """
+        Closes and reopens device i, by serial number and with the options
+        it was originally opened with. Returns the reopened device or None
+        if the test was stopped first.
+        """
+        dev = self.dev_list[i]
+        try:
+            dev.close()
+        except Exception, err:
+            pass
+        while not self.thread_stop.isSet():
+            self.thread_stop.wait(RECONNECT_WAIT)
+            try:
+                options = dict(self.open_options[i])
+                options['serial_number'] = self.serial_numbers[i]
+                transport = options.get('transport')
+                if hasattr(transport, 'reopen'):
+                    transport.reopen()
+                dev = dev.__class__(**options)
+                self.__prepare(dev)
+            except Exception, err:
+                continue
+            self.dev_list[i] = dev
+            self.stats_lock.acquire()
+            self.current[i]['reconnects'] += 1
+            self.totals[i]['reconnects'] += 1
+            self.stats_lock.release()
+            return dev
+        return None
+
+    def __end_interval(self,verbose):
+        """
+        Records the statistics of the current interval and starts the
+        next one.
+        """
+        self.stats_lock.acquire()
+        try:
+            t = time.time() - self.t_start
+            for sn, stats in zip(self.serial_numbers, self.current):
+                entry = _summarize(stats)
+                lat_list = sorted(stats['lat_list'])
+                for p in LATENCY_PERCENTILES:
+                    entry['lat_p%s'%(p,)] = _percentile(lat_list, p)
+                entry['serial_number'] = sn
+                entry['t'] = t
+                self.intervals.append(entry)
+                if verbose:
+                    print '%8.1f %-10s %7d cmds  p50 %s  p99 %s  max %s  retries %d  id_err %d  err %d  reconn %d'%(
+                            t, sn, entry['count'], _fmt_ms(entry['lat_p50']), 
+                            _fmt_ms(entry['lat_p99']), _fmt_ms(entry['lat_max']), 
+                            entry['retries'], entry['cmd_id_errors'], 
+                            entry['errors'], entry['reconnects'])
+            self.current = [_new_stats() for sn in self.serial_numbers]
+        finally:
+            self.stats_lock.release()
+        return
+
+def _new_stats():
+    return {
+        'count'         : 0,
+        'errors'        : 0,
+        'value_errors'  : 0,
+        'retries'       : 0,
+        'cmd_id_errors' : 0,
+        'reconnects'    : 0,
+        'lat_sum'       : 0.0,
+        'lat_max'       : 0.0,
+        'lat_list'      : [],
+        }
+
+def _summarize(stats):
+    entry = dict([(k,v) for k,v in stats.iteritems() if k not in ('lat_list','lat_sum')])
+    if stats['count'] > 0:
+        entry['lat_mean'] = stats['lat_sum']/stats['count']
+    else:
+        entry['lat_mean'] = None
+    return entry
+
+def _percentile(sorted_list, p):
+    if len(sorted_list) == 0:
+        return None
+    n = int(math.ceil(p/100.0*len(sorted_list))) - 1
+    return sorted_list[min(max(n, 0), len(sorted_list)-1)]
+
+def _hist_add(hist, dt):
+    n = int(math.floor(BINS_PER_DECADE*math.log10(max(dt*1.0e6, 1.0))))
+    hist[n] = hist.get(n, 0) + 1
+
+def _hist_percentile(hist, p):
+    """
+    Returns the upper edge of the histogram bin containing percentile p.
+    """
+    total = sum(hist.values())
+    if total == 0:
+        return None
+    cnt = 0
+    for n in sorted(hist.keys()):
+        cnt += hist[n]
+        if cnt >= p/100.0*total:
+            return 10.0**((n + 1)/float(BINS_PER_DECADE))*1.0e-6
+    return None
+
+def _fmt_ms(dt):
+    if dt is None:
+        return '-'
+    return '%1.3fms'%(1.0e3*dt,)
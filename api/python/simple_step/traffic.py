@@ -0,0 +1,282 @@
+"""
+-----------------------------------------------------------------------
+simple_step
+Copyright (C) William Dickson, 2008.
+
+wbd@caltech.edu
+www.willdickson.com
+
+Released under the LGPL Licence, Version 3
+
+This file is part of simple_step.
+
+simple_step is free software: you can redistribute it and/or modify it
+under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+simple_step is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with simple_step.  If not, see
+<http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------------------
+
+Purpose: Provides usb traffic capture and replay for the at90usb based
+stepper motor controller. Every packet sent to and received from the 
+device's command endpoints is written, with the host time, to a compact
+binary log by a Traffic_Capture (see Simple_Step.start_capture). The 
+log can be read with Traffic_Log or replayed with a Replay_Transport,
+which stands in for the usb device and returns the captured replies 
+with the captured device latency, optionally scaled or removed. Host 
+code can then be rerun, profiled and benchmarked offline on identical
+traffic, e.g.
+
+    dev = Simple_Step(transport=Replay_Transport('run.sstraf'))
+
+Log format: an 8 byte magic string, a 4 byte length and a json header
+with the device information, followed by fixed size packet records - 
+direction (1 byte), host time (8 byte double) and packet (8 bytes).
+
+Author: William Dickson
+
+------------------------------------------------------------------------
+"""
+import time
+import json
+import struct
+import threading
+
+TRAFFIC_MAGIC = 'SSTRAF01'
+HEADER_LEN_FORMAT = '<I'
+RECORD_FORMAT = '<Bd8s'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+PACKET_SIZE = 8
+
+# Packet directions
+TRAFFIC_OUT = 0  # host to device
+TRAFFIC_IN = 1   # device to host
+TRAFFIC_DIR_DICT = {TRAFFIC_OUT: 'out', TRAFFIC_IN: 'in'}
+
+class Traffic_Capture:
+
+    """
+    Writes usb packets to a traffic log.
+    """
+
+    def __init__(self,filename,info=None):
+        """
+        Create traffic log.
+
+        Arguments:
+          filename = log file name
+
+        Keywords:
+          info = dictionary of device information written to the log
+                 header, e.g. serial number.
+
+        Return: None
+        """
+        if info is None:
+            info = {}
+        info = dict(info)
+        info['start'] = time.time()
+        header = json.dumps(info)
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.count = 0
+        self.fid = open(filename, 'wb')
+        self.fid.write(TRAFFIC_MAGIC)
+        self.fid.write(struct.pack(HEADER_LEN_FORMAT, len(header)))
+        self.fid.write(header)
+
+    def record(self,direction,t,packet):
+        """
+        Writes a packet record.
+
+        Arguments:
+          direction = TRAFFIC_OUT or TRAFFIC_IN
+          t         = host time (sec)
+          packet    = packet bytes - a string
+
+        Return: None
+        """
+        data = struct.pack(RECORD_FORMAT, direction, t, packet)
+        self.lock.acquire()
+        try:
+            if self.fid is not None:
+                self.fid.write(data)
+                self.count += 1
+        finally:
+            self.lock.release()
+        return
+
+    def close(self):
+        """
+        Closes the traffic log.
+
+        Arguments: None
+
+        Return: None
+        """
+        self.lock.acquire()
+        try:
+            if self.fid is not None:
+                self.fid.close()
+                self.fid = None
+        finally:
+            self.lock.release()
+        return
+
+class Traffic_Log:
+
+    """
+    Reads a traffic log.
+    """
+
+    def __init__(self,filename):
+        """
+        Open traffic log. 
+
+        Arguments:
+          filename = log file name
+
+        Return: None
+        """
+        self.filename = filename
+        fid = open(filename, 'rb')
+        try:
+            if fid.read(len(TRAFFIC_MAGIC)) != TRAFFIC_MAGIC:
+                raise IOError, "%s is not a traffic log"%(filename,)
+            n, = struct.unpack(HEADER_LEN_FORMAT, fid.read(struct.calcsize(HEADER_LEN_FORMAT)))
+            self.info = json.loads(fid.read(n))
+            data = fid.read()
+        finally:
+            fid.close()
+        # Ignore partial record at end of log, e.g. capture interrupted
+        num = len(data)/RECORD_SIZE
+        self.records = [struct.unpack(RECORD_FORMAT, data[i*RECORD_SIZE:(i+1)*RECORD_SIZE]) for i in range(num)]
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self,ind):
+        return self.records[ind]
+
+    def print_records(self,num=None):
+        """
+        Prints packet records - time relative to the first record, 
+        direction, command id and packet bytes.
+
+        Keywords:
+          num = number of records to print. If None, all records.
+
+        Return: None
+        """
+        if len(self.records) == 0:
+            return
+        t0 = self.records[0][1]
+        for direction, t, packet in self.records[:num]:
+            print '%12.6f %-3s %3d  %s'%(t - t0, TRAFFIC_DIR_DICT[direction], ord(packet[0]),
+                                          ' '.join(['%02x'%(ord(b),) for b in packet]))
+        return
+
+class Replay_Transport:
+
+    """
+    Stands in for the usb device, returning the replies of a traffic log.
+    Packets sent by the host are checked against the captured packets. 
+    A missing reply in the log is replayed as a read timeout. 
+    """
+
+    def __init__(self,filename,speed=1.0,strict=False):
+        """
+        Open traffic log for replay.
+
+        Arguments:
+          filename = log file name
+
+        Keywords:
+          speed  = device latency scale. Each reply is returned after the
+                   captured latency divided by speed. If None replies are
+                   returned immediately.
+          strict = True or False (default). If True raise an IOError when
+                   a sent packet doesn't match the captured packet, 
+                   otherwise count the mismatch.
+
+        Return: None
+        """
+        self.log = Traffic_Log(filename)
+        self.info = self.log.info
+        self.speed = speed
+        self.strict = strict
+        self.index = 0
+        self.mismatches = 0
+        self.t_due = None
+
+    def write(self,packet,timeout):
+        """
+        Sends packet. Returns the number of bytes written.
+        """
+        direction, t_out, captured = self.__next_record()
+        if direction != TRAFFIC_OUT:
+            raise IOError, "replay out of step - expected reply at record %d"%(self.index-1,)
+        if packet != captured:
+            self.mismatches += 1
+            if self.strict:
+                raise IOError, "sent packet does not match captured packet %d"%(self.index-1,)
+
+        # Reply due after captured latency 
+        self.t_due = time.time()
+        if self.index < len(self.log) and self.log[self.index][0] == TRAFFIC_IN:
+            if self.speed is not None:
+                self.t_due += (self.log[self.index][1] - t_out)/float(self.speed)
+        return len(packet)
+
+    def read(self,timeout):
+        """
+        Receives a packet. Returns the packet, or None if the captured
+        reply was missing.
+        """
+        if self.index >= len(self.log):
+            raise IOError, "end of traffic log"
+        if self.log[self.index][0] != TRAFFIC_IN:
+            # Captured reply was missing
+            return None
+        direction, t_in, packet = self.__next_record()
+        dt = self.t_due - time.time()
+        if dt > 0:
+            time.sleep(dt)
+        return packet
+
+    def get_serial_number(self):
+        return self.info.get('serial_number')
+
+    def get_manufacturer(self):
+        return self.info.get('manufacturer')
+
+    def get_product(self):
+        return self.info.get('product')
+
+    def get_vendor_id(self):
+        return self.info.get('vendor_id')
+
+    def get_product_id(self):
+        return self.info.get('product_id')
+
+    def close(self):
+        return
+
+    def __next_record(self):
+        if self.index >= len(self.log):
+            raise IOError, "end of traffic log"
+        record = self.log[self.index]
+        self.index += 1
+        return record
@@ -0,0 +1,436 @@
+"""
+-----------------------------------------------------------------------
+simple_step
+Copyright (C) William Dickson, 2008.
+
+wbd@caltech.edu
+www.willdickson.com
+
+Released under the LGPL Licence, Version 3
+
+This file is part of simple_step.
+
+simple_step is free software: you can redistribute it and/or modify it
+under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+simple_step is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with simple_step.  If not, see
+<http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------------------
+
+Purpose: Provides a Linux usbfs transport for the at90usb based stepper 
+motor controller. The device is found through sysfs and accessed through 
+its /dev/bus/usb node with usbfs ioctls, so neither pylibusb nor libusb
+is required. Replies on the bulk in endpoint are read with an URB which
+is submitted before the command is sent, and all transfers use buffers 
+and ioctl structures allocated once when the device is opened. 
+
+Usage: 
+  dev = Simple_Step(transport='usbfs')
+or
+  dev = Simple_Step(transport=Usbfs_Transport(serial_number))
+
+The ioctl request codes are computed for the generic Linux ioctl layout
+(x86, arm) and the process needs read/write access to the device node,
+e.g. through a udev rule.
+
+Author: William Dickson 
+
+------------------------------------------------------------------------
+"""
+import os
+import errno
+import select
+import ctypes
+import ctypes.util
+from simple_step import USB_VENDOR_ID
+from simple_step import USB_PRODUCT_ID
+from simple_step import USB_BULKOUT_EP_ADDRESS
+from simple_step import USB_BULKIN_EP_ADDRESS
+from simple_step import USB_BUFFER_SIZE
+from simple_step import USB_CAPTURE_BUFFER_SIZE
+
+# Device configuration and interface numbers 
+USB_CONFIGURATION = 1
+USB_INTERFACE = 0
+
+SYSFS_DEVICES_DIR = '/sys/bus/usb/devices'
+USBFS_DEVICE_FMT = '/dev/bus/usb/%03d/%03d'
+
+# ioctl request codes - linux/usbdevice_fs.h 
+_IOC_NONE = 0
+_IOC_WRITE = 1
+_IOC_READ = 2
+
+def _IOC(direction,type,nr,size):
+    return (direction << 30) | (size << 16) | (ord(type) << 8) | nr
+
+class Bulk_Transfer(ctypes.Structure):
+    _fields_ = [
+        ('ep',      ctypes.c_uint),
+        ('len',     ctypes.c_uint),
+        ('timeout', ctypes.c_uint),
+        ('data',    ctypes.c_void_p),
+        ]
+
+class URB(ctypes.Structure):
+    _fields_ = [
+        ('type',              ctypes.c_ubyte),
+        ('endpoint',          ctypes.c_ubyte),
+        ('status',            ctypes.c_int),
+        ('flags',             ctypes.c_uint),
+        ('buffer',            ctypes.c_void_p),
+        ('buffer_length',     ctypes.c_int),
+        ('actual_length',     ctypes.c_int),
+        ('start_frame',       ctypes.c_int),
+        ('number_of_packets', ctypes.c_int),
+        ('error_count',       ctypes.c_int),
+        ('signr',             ctypes.c_uint),
+        ('usercontext',       ctypes.c_void_p),
+        ]
+
+class Usbfs_Ioctl(ctypes.Structure):
+    _fields_ = [
+        ('ifno',       ctypes.c_int),
+        ('ioctl_code', ctypes.c_int),
+        ('data',       ctypes.c_void_p),
+        ]
+
+USBDEVFS_BULK = _IOC(_IOC_READ|_IOC_WRITE, 'U', 2, ctypes.sizeof(Bulk_Transfer))
+USBDEVFS_SETCONFIGURATION = _IOC(_IOC_READ, 'U', 5, ctypes.sizeof(ctypes.c_uint))
+USBDEVFS_SUBMITURB = _IOC(_IOC_READ, 'U', 10, ctypes.sizeof(URB))
+USBDEVFS_DISCARDURB = _IOC(_IOC_NONE, 'U', 11, 0)
+USBDEVFS_REAPURB = _IOC(_IOC_WRITE, 'U', 12, ctypes.sizeof(ctypes.c_void_p))
+USBDEVFS_REAPURBNDELAY = _IOC(_IOC_WRITE, 'U', 13, ctypes.sizeof(ctypes.c_void_p))
+USBDEVFS_CLAIMINTERFACE = _IOC(_IOC_READ, 'U', 15, ctypes.sizeof(ctypes.c_uint))
+USBDEVFS_RELEASEINTERFACE = _IOC(_IOC_READ, 'U', 16, ctypes.sizeof(ctypes.c_uint))
+USBDEVFS_IOCTL = _IOC(_IOC_READ|_IOC_WRITE, 'U', 18, ctypes.sizeof(Usbfs_Ioctl))
+USBDEVFS_DISCONNECT = _IOC(_IOC_NONE, 'U', 22, 0)
+
+USBDEVFS_URB_TYPE_BULK = 3
+
+libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+def ioctl(fd,request,arg):
+    """
+    Performs an ioctl with a pointer argument. Raises IOError on error.
+
+    Arguments:
+      fd      = file descriptor
+      request = ioctl request code
+      arg     = ctypes pointer, e.g. ctypes.byref(struct), or None
+
+    Return: ioctl return value
+    """
+    ret = libc.ioctl(fd, ctypes.c_ulong(request), arg)
+    if ret < 0:
+        err = ctypes.get_errno()
+        raise IOError(err, os.strerror(err))
+    return ret
+
+def read_sysfs_attr(path,name):
+    """
+    Returns the value of a sysfs attribute, with trailing whitespace 
+    removed, or None if the attribute can't be read.
+    """
+    try:
+        fid = open(os.path.join(path, name), 'r')
+    except IOError:
+        return None
+    try:
+        return fid.read().rstrip()
+    finally:
+        fid.close()
+
+def find_devices():
+    """
+    Finds the connected devices through sysfs.
+
+    Arguments: None
+
+    Return: list of device dictionaries with keys 'serial_number', 
+            'manufacturer', 'product', 'busnum', 'devnum', 'configuration'
+            and 'path' (the sysfs device directory). 
+    """
+    dev_list = []
+    try:
+        names = os.listdir(SYSFS_DEVICES_DIR)
+    except OSError:
+        return dev_list
+    names.sort()
+    for name in names:
+        path = os.path.join(SYSFS_DEVICES_DIR, name)
+        try:
+            vendor_id = int(read_sysfs_attr(path, 'idVendor'), 16)
+            product_id = int(read_sysfs_attr(path, 'idProduct'), 16)
+        except (TypeError, ValueError):
+            # Not a device, e.g. an interface
+            continue
+        if vendor_id != USB_VENDOR_ID or product_id != USB_PRODUCT_ID:
+            continue
+        try:
+            busnum = int(read_sysfs_attr(path, 'busnum'))
+            devnum = int(read_sysfs_attr(path, 'devnum'))
+        except (TypeError, ValueError):
+            continue
+        dev_list.append({
+            'serial_number' : read_sysfs_attr(path, 'serial'),
+            'manufacturer'  : read_sysfs_attr(path, 'manufacturer'),
+            'product'       : read_sysfs_attr(path, 'product'),
+            'busnum'        : busnum,
+            'devnum'        : devnum,
+            'configuration' : read_sysfs_attr(path, 'bConfigurationValue'),
+            'path'          : path,
+            })
+    return dev_list
+
+class Usbfs_Transport:
+
+    """
+    usbfs transport for Simple_Step - see the transport keyword of 
+    Simple_Step. Provides write and read for the command endpoints, 
+    read_endpoint for the event and capture endpoints, reopen for 
+    automatic reconnect, and the device information methods.
+    """
+
+    def __init__(self,serial_number=None):
+        """
+        Finds and opens the device.
+
+        Keywords:
+          serial_number = serial number of device to open. If None the
+                          first device found is opened.
+
+        Return: None
+        """
+        self.serial_number = serial_number
+        self.fd = None
+        self.info = None
+
+        # Preallocated transfer buffers and ioctl structures
+        self.out_buffer = ctypes.create_string_buffer(USB_BUFFER_SIZE)
+        self.in_buffer = ctypes.create_string_buffer(USB_BUFFER_SIZE)
+        self.out_bulk = Bulk_Transfer(USB_BULKOUT_EP_ADDRESS, USB_BUFFER_SIZE, 0, 
+                                      ctypes.addressof(self.out_buffer))
+        self.in_urb = URB()
+        self.in_urb.type = USBDEVFS_URB_TYPE_BULK
+        self.in_urb.endpoint = USB_BULKIN_EP_ADDRESS
+        self.in_urb.buffer = ctypes.addressof(self.in_buffer)
+        self.in_urb.buffer_length = USB_BUFFER_SIZE
+        self.in_urb_addr = ctypes.addressof(self.in_urb)
+        self.in_pending = False
+        self.reaped = ctypes.c_void_p()
+        self.uint_arg = ctypes.c_uint()
+        self.poll = None
+        self.open()
+
+    def open(self):
+        """
+        Finds the device, by serial number if given, opens its usbfs 
+        device node and claims the interface.
+
+        Arguments: None
+
+        Return: None
+        """
+        dev_list = find_devices()
+        if self.serial_number is not None:
+            dev_list = [d for d in dev_list if d['serial_number'] == self.serial_number]
+            if not dev_list:
+                raise RuntimeError("Cannot find device w/ serial number %s."%(self.serial_number,))
+        if not dev_list:
+            raise RuntimeError("Cannot find device.")
+        info = dev_list[0]
+        filename = USBFS_DEVICE_FMT%(info['busnum'], info['devnum'])
+        try:
+            fd = os.open(filename, os.O_RDWR)
+        except OSError, err:
+            raise IOError(err.errno, "%s: %s"%(filename, err.strerror))
+        try:
+            if info['configuration'] != str(USB_CONFIGURATION):
+                self.uint_arg.value = USB_CONFIGURATION
+                ioctl(fd, USBDEVFS_SETCONFIGURATION, ctypes.byref(self.uint_arg))
+            self.__claim_interface(fd)
+        except:
+            os.close(fd)
+            raise
+        self.fd = fd
+        self.info = info
+        self.in_pending = False
+        self.poll = select.poll()
+        self.poll.register(fd, select.POLLOUT | select.POLLWRNORM)
+        return
+
+    def reopen(self):
+        """
+        Closes the device, if open, and opens it again. Used by Simple_Step
+        to reconnect to a device which has been lost.
+
+        Arguments: None
+
+        Return: None
+        """
+        self.close()
+        if self.serial_number is None and self.info is not None:
+            self.serial_number = self.info['serial_number']
+        self.open()
+        return
+
+    def close(self):
+        """
+        Releases the interface and closes the device.
+
+        Arguments: None
+
+        Return: None
+        """
+        if self.fd is None:
+            return
+        try:
+            try:
+                self.__cancel_read()
+                self.uint_arg.value = USB_INTERFACE
+                ioctl(self.fd, USBDEVFS_RELEASEINTERFACE, ctypes.byref(self.uint_arg))
+            except IOError:
+                pass
+        finally:
+            os.close(self.fd)
+            self.fd = None
+        return
+
+    def write(self,packet,timeout):
+        """
+        Sends a packet to the bulk out endpoint. The read for the reply
+        is submitted first so that it is already queued when the reply 
+        arrives.
+
+        Arguments:
+          packet  = packet string 
+          timeout = timeout in ms
+
+        Return: number of bytes written
+        """
+        fd = self.__get_fd()
+        if not self.in_pending:
+            self.in_urb.status = 0
+            self.in_urb.actual_length = 0
+            ioctl(fd, USBDEVFS_SUBMITURB, ctypes.byref(self.in_urb))
+            self.in_pending = True
+        n = min(len(packet), USB_BUFFER_SIZE)
+        ctypes.memmove(self.out_buffer, packet, n)
+        self.out_bulk.len = n
+        self.out_bulk.timeout = timeout
+        return ioctl(fd, USBDEVFS_BULK, ctypes.byref(self.out_bulk))
+
+    def read(self,timeout):
+        """
+        Reads a packet from the bulk in endpoint. 
+
+        Arguments:
+          timeout = timeout in ms
+
+        Return: packet string or None on timeout.
+        """
+        fd = self.__get_fd()
+        if not self.in_pending:
+            ioctl(fd, USBDEVFS_SUBMITURB, ctypes.byref(self.in_urb))
+            self.in_pending = True
+        if not self.poll.poll(timeout):
+            self.__cancel_read()
+            return None
+        ioctl(fd, USBDEVFS_REAPURBNDELAY, ctypes.byref(self.reaped))
+        self.in_pending = False
+        status = self.in_urb.status
+        if status < 0:
+            if status in (-errno.ENODEV, -errno.ESHUTDOWN, -errno.EPROTO):
+                raise IOError(-status, os.strerror(-status))
+            return None
+        return self.in_buffer.raw[:self.in_urb.actual_length]
+
+    def read_endpoint(self,endpoint,buf,timeout):
+        """
+        Reads a packet from an interrupt or bulk in endpoint, e.g. the 
+        event or capture endpoint, into buf. The transfer is made directly
+        into buf with its own ioctl structure, so different threads may 
+        read different endpoints at the same time.
+
+        Arguments:
+          endpoint = endpoint address
+          buf      = ctypes string buffer
+          timeout  = timeout in ms
+
+        Return: number of bytes read or None on timeout.
+        """
+        fd = self.__get_fd()
+        n = min(len(buf), USB_CAPTURE_BUFFER_SIZE)
+        bulk = Bulk_Transfer(endpoint, n, timeout, ctypes.addressof(buf))
+        try:
+            val = ioctl(fd, USBDEVFS_BULK, ctypes.byref(bulk))
+        except IOError, err:
+            if err.errno == errno.ETIMEDOUT:
+                return None
+            raise
+        return val
+
+    def get_serial_number(self):
+        return self.info['serial_number']
+
+    def get_manufacturer(self):
+        return self.info['manufacturer']
+
+    def get_product(self):
+        return self.info['product']
+
+    def get_vendor_id(self):
+        return USB_VENDOR_ID
+
+    def get_product_id(self):
+        return USB_PRODUCT_ID
+
+    def __get_fd(self):
+        """
+        Returns the device file descriptor. Raises IOError if the device
+        is closed.
+        """
+        if self.fd is None:
+            raise IOError, "device not open"
+        return self.fd
+
+    def __claim_interface(self,fd):
+        """
+        Claims the interface, detaching any kernel driver bound to it.
+        """
+        self.uint_arg.value = USB_INTERFACE
+        try:
+            ioctl(fd, USBDEVFS_CLAIMINTERFACE, ctypes.byref(self.uint_arg))
+        except IOError, err:
+            if err.errno != errno.EBUSY:
+                raise
+            cmd = Usbfs_Ioctl(USB_INTERFACE, USBDEVFS_DISCONNECT, None)
+            ioctl(fd, USBDEVFS_IOCTL, ctypes.byref(cmd))
+            ioctl(fd, USBDEVFS_CLAIMINTERFACE, ctypes.byref(self.uint_arg))
+        return
+
+    def __cancel_read(self):
+        """
+        Discards and reaps the pending bulk in URB, if any.
+        """
+        if not self.in_pending:
+            return
+        try:
+            ioctl(self.fd, USBDEVFS_DISCARDURB, ctypes.byref(self.in_urb))
+        except IOError, err:
+            # EINVAL - already completed
+            if err.errno != errno.EINVAL:
+                raise
+        ioctl(self.fd, USBDEVFS_REAPURB, ctypes.byref(self.reaped))
+        self.in_pending = False
+        return
@@ -0,0 +1,73 @@
+"""
+-----------------------------------------------------------------------
+simple_step
+Copyright (C) William Dickson, 2008.
+
+wbd@caltech.edu
+www.willdickson.com
+
+Released under the LGPL Licence, Version 3
+
+This file is part of simple_step.
+
+simple_step is free software: you can redistribute it and/or modify it
+under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+simple_step is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with simple_step.  If not, see
+<http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------------------
+
+
+Purpose: Start up tests. Checks that importing the package doesn't 
+import the modules which are only imported on first use, which would 
+slow down the start up of short lived scripts. See also the 
+examples/startup_time.py benchmark.
+
+Author: William Dickson
+
+------------------------------------------------------------------------
+"""
+import os
+import sys
+import subprocess
+import unittest
+
+# Modules which must not be imported by "import simple_step"
+LAZY_MODULES = ('pylibusb', 'optparse', 'json', 'random', 'tempfile',
+                'simple_step.cmd_line', 'simple_step.traffic', 'simple_step.stress',
+                'simple_step.motion_program')
+
+IMPORT_SRC = """
+import sys
+import simple_step
+print ' '.join([m for m in %s if sys.modules.get(m) is not None])
+"""%(repr(LAZY_MODULES),)
+
+class Test_Startup(unittest.TestCase):
+
+    def test_import_is_lazy(self):
+        """
+        Imports the package in a fresh interpreter and checks that none
+        of the lazy modules have been imported.
+        """
+        env = dict(os.environ)
+        path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = os.pathsep.join([path] + env.get('PYTHONPATH','').split(os.pathsep))
+        proc = subprocess.Popen([sys.executable, '-c', IMPORT_SRC], env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, error = proc.communicate()
+        self.assertEqual(proc.returncode, 0, error)
+        loaded = output.split()
+        self.assertEqual(loaded, [], "imported by the package: %s"%(' '.join(loaded),))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -58,7 +58,7 @@ USB_Descriptor_Configuration_t ConfigurationDescriptor PROGMEM = {
     Header:{Size:sizeof(USB_Descriptor_Interface_t),Type:DTYPE_Interface},
     InterfaceNumber:0,
     AlternateSetting:0,
-    TotalEndpoints:2,
+    TotalEndpoints:4,
     Class:0xFF,
     SubClass:0xFF,
     Protocol:0xFF,
@@ -79,6 +79,22 @@ USB_Descriptor_Configuration_t ConfigurationDescriptor PROGMEM = {
     Attributes:EP_TYPE_BULK,
     EndpointSize:SIMPLE_OUT_EPSIZE,
     PollingIntervalMS:0x00
+  },
+
+  EventInEndpoint:{
+    Header: {Size: sizeof(USB_Descriptor_Endpoint_t), Type:DTYPE_Endpoint},
+    EndpointAddress:(ENDPOINT_DESCRIPTOR_DIR_IN | SIMPLE_EVENT_EPNUM),
+    Attributes:EP_TYPE_INTERRUPT,
+    EndpointSize:SIMPLE_EVENT_EPSIZE,
+    PollingIntervalMS:0x01
+  },
+
+  CaptureInEndpoint:{
+    Header: {Size: sizeof(USB_Descriptor_Endpoint_t), Type:DTYPE_Endpoint},
+    EndpointAddress:(ENDPOINT_DESCRIPTOR_DIR_IN | SIMPLE_CAPTURE_EPNUM),
+    Attributes:EP_TYPE_BULK,
+    EndpointSize:SIMPLE_CAPTURE_EPSIZE,
+    PollingIntervalMS:0x00
   }
 };
 
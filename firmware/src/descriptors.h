@@ -36,6 +36,10 @@
 #define SIMPLE_OUT_EPNUM    1	
 #define SIMPLE_IN_EPSIZE    8   
 #define SIMPLE_OUT_EPSIZE   8
+#define SIMPLE_EVENT_EPNUM  3
+#define SIMPLE_EVENT_EPSIZE 8
+#define SIMPLE_CAPTURE_EPNUM  4
+#define SIMPLE_CAPTURE_EPSIZE 64
 
 /* Serial Number */
 #define SERIAL_NUMBER {SN2,'.',SN1,'.',SN0} //,'.',SN3,'.',SN4,'.',SN5,'.',SN6} 
@@ -47,6 +51,8 @@ typedef struct
   USB_Descriptor_Interface_t            Interface;
   USB_Descriptor_Endpoint_t             DataInEndpoint;
   USB_Descriptor_Endpoint_t             DataOutEndpoint;
+  USB_Descriptor_Endpoint_t             EventInEndpoint;
+  USB_Descriptor_Endpoint_t             CaptureInEndpoint;
 } USB_Descriptor_Configuration_t;
 
 /* External Variables: */
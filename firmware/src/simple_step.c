@@ -44,6 +44,11 @@ BUTTLOADTAG(MyUSBVersion, "MyUSB V" MYUSB_VERSION_STRING);
 TASK_LIST {
     {Task: USB_USBTask,        TaskStatus: TASK_STOP},
     {Task: USB_Process_Packet, TaskStatus: TASK_STOP},
+    {Task: Vel_Ramp,           TaskStatus: TASK_RUN },
+    {Task: USB_Send_Event,     TaskStatus: TASK_STOP},
+    {Task: Home_Seq,           TaskStatus: TASK_STOP},
+    {Task: USB_Send_Capture,   TaskStatus: TASK_STOP},
+    {Task: Prog_Run,           TaskStatus: TASK_STOP},
 };
 
 // DFU Bootloader Declarations 
@@ -95,6 +100,9 @@ int main(void)
 
 static void IO_Init(void)
 {
+    // Load saved start up configuration, if any, from EEPROM
+    Load_Config(FALSE);
+
     // Initial DIO PORT
     DIO_DDR = 0xff; // set all pins to output
     DIO_PORT = 0x00; // set all pins low
@@ -164,6 +172,19 @@ static void IO_Init(void)
     TIMER_TIMSK |= (1<<TIMER_TOIE); 
     TIMER_TIMSK |= (1<<TIMER_OCIEB); 
 
+    // Set ramp timer to CTC mode w/ prescaler 64 and enable compare 
+    // match interrupts. 
+    RAMP_TIMER_TCCRA = (1<<WGM01);
+    RAMP_TIMER_TCCRB = (1<<CS01) | (1<<CS00);
+    RAMP_TIMER_OCR = RAMP_TIMER_TOP;
+    RAMP_TIMER_TIMSK |= (1<<RAMP_TIMER_OCIE);
+
+    // Set device clock timer to normal mode and enable overflow 
+    // interrupts.
+    CLOCK_TCCRA = 0x00;
+    CLOCK_TCCRB = (1<<CS11);  // prescaler 8
+    CLOCK_TIMSK |= (1<<CLOCK_TOIE);
+
     // Set data direction for external interrupt
     EXT_INT_DDR &= ~(1<<EXT_INT_DDR_PIN);
 
@@ -193,8 +214,15 @@ static void IO_Init(void)
         EICRB |= ((1<<ISC40) | (1<<ISC41) | (1<<ISC50) | (1<<ISC51)); 
     }
 
-    // Enable external interrupt if that is the default start up state
-    if (Sys_State.Ext_Int==ENABLED) {
+    // Set data direction and switch off pullup for trigger pin 
+    TRIG_INT_DDR &= ~(1<<TRIG_INT_DDR_PIN);
+    TRIG_INT_OUT_REG &= ~(1<<TRIG_INT_OUT_PIN);
+
+    // Trigger is always on the rising edge 
+    EICRA |= ((1<<ISC11) | (1<<ISC10));
+
+    // Enable external interrupt if that is the start up state
+    if (Sys_State.Ext_Int != DISABLED) {
         EIMSK |= (1<<EXT_INT);
     }
 }
@@ -210,8 +238,10 @@ EVENT_HANDLER(USB_Connect)
 
 EVENT_HANDLER(USB_Disconnect)
 {
-    // Stop running ProcessPacket and USB management tasks
+    // Stop running ProcessPacket, SendEvent and USB management tasks
     Scheduler_SetTaskMode(USB_Process_Packet, TASK_STOP);
+    Scheduler_SetTaskMode(USB_Send_Event, TASK_STOP);
+    Scheduler_SetTaskMode(USB_Send_Capture, TASK_STOP);
     Scheduler_SetTaskMode(USB_USBTask, TASK_STOP);
 
     // Stop the timers and reset I/O lines to reduce current draw
@@ -237,11 +267,25 @@ EVENT_HANDLER(USB_CreateEndpoints)
             SIMPLE_OUT_EPSIZE,
             ENDPOINT_BANK_DOUBLE);
 
+    Endpoint_ConfigureEndpoint(SIMPLE_EVENT_EPNUM,
+            EP_TYPE_INTERRUPT,
+            ENDPOINT_DIR_IN,
+            SIMPLE_EVENT_EPSIZE,
+            ENDPOINT_BANK_SINGLE);
+
+    Endpoint_ConfigureEndpoint(SIMPLE_CAPTURE_EPNUM,
+            EP_TYPE_BULK,
+            ENDPOINT_DIR_IN,
+            SIMPLE_CAPTURE_EPSIZE,
+            ENDPOINT_BANK_SINGLE);
+
     // Indicate USB connected and ready
     LEDs_SetAllLEDs(LEDS_LED2 | LEDS_LED4);
 
-    // Start ProcessPacket task
+    // Start ProcessPacket and SendEvent tasks
     Scheduler_SetTaskMode(USB_Process_Packet, TASK_RUN);
+    Scheduler_SetTaskMode(USB_Send_Event, TASK_RUN);
+    Scheduler_SetTaskMode(USB_Send_Capture, TASK_RUN);
     return;
 }
 
@@ -270,6 +314,9 @@ TASK(USB_Process_Packet)
             // Return the same CommandID that was received 
             USB_In.Header.Command_ID = USB_Out.Header.Command_ID;
 
+            // Time stamp the return packet
+            USB_In.Aux = (uint16_t) Get_Clock();
+
             // Process USB packet 
             switch(USB_Out.Header.Command_ID) {
 
@@ -407,6 +454,173 @@ TASK(USB_Process_Packet)
                     USB_In.Data.uint8_t = Sys_State.Ext_Int;
                     break;
 
+                case USB_CMD_SET_STEP_MODE:
+                    Set_Step_Mode(USB_Out.Data.uint8_t);
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Sys_State.Step_Mode;
+                    break;
+
+                case USB_CMD_GET_STEP_MODE:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Sys_State.Step_Mode;
+                    break;
+
+                case USB_CMD_GET_EFF_VEL:
+                    USB_In.Header.Control_Byte = USB_CTL_INT32;
+                    USB_In.Data.int32_t = (int32_t) Get_Eff_Vel();
+                    break;
+
+                case USB_CMD_SET_ACCEL:
+                    Set_Accel((uint32_t) USB_Out.Data.int32_t);
+                    USB_In.Header.Control_Byte = USB_CTL_INT32;
+                    USB_In.Data.int32_t = (int32_t) Ramp.Accel;
+                    break;
+
+                case USB_CMD_GET_ACCEL:
+                    USB_In.Header.Control_Byte = USB_CTL_INT32;
+                    USB_In.Data.int32_t = (int32_t) Ramp.Accel;
+                    break;
+
+                case USB_CMD_FIRE_TRIG:
+                    Fire_Trig(USB_Out.Data.uint8_t);
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Sys_State.Status;
+                    break;
+
+                case USB_CMD_GET_CLOCK:
+                    USB_In.Header.Control_Byte = USB_CTL_INT32;
+                    USB_In.Data.int32_t = (int32_t) Get_Clock();
+                    break;
+
+                case USB_CMD_GET_STAGED:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Staged_Move.Pending;
+                    break;
+
+                case USB_CMD_STAGE_MOVE:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Stage_Move(USB_Out.Data.int32_t, USB_Out.Aux);
+                    break;
+
+                case USB_CMD_SET_POS_TRIG:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Set_Pos_Trig((uint8_t) USB_Out.Aux, USB_Out.Data.int32_t);
+                    break;
+
+                case USB_CMD_SET_POS_TRIG_CFG:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Set_Pos_Trig_Cfg(
+                            (uint8_t) (USB_Out.Data.uint16_t & 0xff), 
+                            (uint8_t) (USB_Out.Data.uint16_t >> 8),
+                            USB_Out.Aux
+                            );
+                    break;
+
+                case USB_CMD_GET_POS_TRIG_CNT:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT16;
+                    USB_In.Data.uint16_t = Get_Pos_Trig_Cnt();
+                    break;
+
+                case USB_CMD_GET_LATCH_CNT:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Get_Latch_Cnt();
+                    break;
+
+                case USB_CMD_GET_LATCH_TIME:
+                    // Time of latch last removed by USB_CMD_GET_LATCH_POS
+                    USB_In.Header.Control_Byte = USB_CTL_INT32;
+                    USB_In.Data.int32_t = (int32_t) Latch_Last.Time;
+                    break;
+
+                case USB_CMD_GET_LATCH_POS:
+                    USB_In.Header.Control_Byte = USB_CTL_INT32;
+                    USB_In.Data.int32_t = Pop_Latch();
+                    break;
+
+                case USB_CMD_SET_DIO_PORT:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Set_DIO_Port(USB_Out.Data.uint8_t);
+                    break;
+
+                case USB_CMD_GET_DIO_PORT:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Get_DIO_Port();
+                    break;
+
+                case USB_CMD_SET_DIO_PAT:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Set_DIO_Pat((uint8_t) USB_Out.Aux, (uint32_t) USB_Out.Data.int32_t);
+                    break;
+
+                case USB_CMD_PLAY_DIO_PAT:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Play_DIO_Pat(USB_Out.Data.uint16_t);
+                    break;
+
+                case USB_CMD_GET_DIO_PAT:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = DIO_Pat.Playing;
+                    break;
+
+                case USB_CMD_SET_CAPTURE:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Set_Capture(USB_Out.Data.uint8_t);
+                    break;
+
+                case USB_CMD_READ_CAPTURE:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Read_Capture(USB_Out.Data.uint8_t);
+                    break;
+
+                case USB_CMD_SET_PROG:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Set_Prog(
+                            (uint8_t) (USB_Out.Aux & 0xff),
+                            (uint8_t) (USB_Out.Aux >> 8),
+                            USB_Out.Data.int32_t
+                            );
+                    break;
+
+                case USB_CMD_RUN_PROG:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Run_Prog(USB_Out.Data.uint8_t);
+                    break;
+
+                case USB_CMD_GET_PROG:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT16;
+                    USB_In.Data.uint16_t = (((uint16_t) Prog.PC) << 8) | Prog.State;
+                    break;
+
+                case USB_CMD_GET_BUILD_ID:
+                    USB_In.Header.Control_Byte = USB_CTL_INT32;
+                    USB_In.Data.int32_t = BUILD_ID;
+                    break;
+
+                case USB_CMD_SAVE_CONFIG:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Save_Config(USB_Out.Data.uint8_t);
+                    break;
+
+                case USB_CMD_LOAD_CONFIG:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Load_Config(TRUE);
+                    break;
+
+                case USB_CMD_SET_HOME_PARAM:
+                    USB_In.Header.Control_Byte = USB_CTL_INT32;
+                    USB_In.Data.int32_t = Set_Home_Param((uint8_t) USB_Out.Aux, USB_Out.Data.int32_t);
+                    break;
+
+                case USB_CMD_START_HOME:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Start_Home(USB_Out.Data.uint8_t);
+                    break;
+
+                case USB_CMD_GET_HOME_STATE:
+                    USB_In.Header.Control_Byte = USB_CTL_UINT8;
+                    USB_In.Data.uint8_t = Home.State;
+                    break;
+
                 case USB_CMD_AVR_RESET:    
                     USB_Packet_Write();
                     AVR_RESET();
@@ -458,6 +672,277 @@ TASK(USB_Process_Packet)
     return;
 }
 
+// --------------------------------------------------------------
+// Function: Vel_Ramp
+//
+// Purpose: Velocity mode acceleration limiting. Once every ramp 
+// tick the signed ramp velocity is moved toward the signed velocity
+// set-point by at most Accel/RAMP_TICK_FREQ. Passing through zero 
+// reverses the direction. The step timer is updated here, rather 
+// than in the timer interrupts, to keep the division out of the
+// interrupt routines. When the ramp is not active the ramp velocity
+// tracks the actual motor velocity.
+//
+// --------------------------------------------------------------
+TASK(Vel_Ramp)
+{
+    uint8_t ticks;
+    int32_t vel;
+    int32_t vel_setpt;
+    int32_t dvel;
+    uint16_t vel_out;
+    uint8_t dir_out;
+
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        ticks = Ramp.Ticks;
+        Ramp.Ticks = 0;
+    }
+    if (ticks == 0) {
+        return;
+    }
+
+    if ((Sys_State.Mode != VEL_MODE) || (Ramp.Accel == 0) || 
+            (Sys_State.Status != RUNNING)) {
+        // Ramp not active - track actual velocity
+        ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+            vel = 1000*((int32_t) Sys_State.Vel);
+            Ramp.Vel = Sys_State.Dir == DIR_POS ? vel : -vel;
+            Ramp.Vel_Out = Sys_State.Vel;
+            Ramp.Dir_Out = Sys_State.Dir;
+        }
+        return;
+    }
+
+    // Get signed velocity set-point
+    vel_setpt = 1000*((int32_t) Sys_State.Vel_Mode.Vel_SetPt);
+    if (Sys_State.Vel_Mode.Dir_SetPt == DIR_NEG) {
+        vel_setpt = -vel_setpt;
+    }
+
+    // Slew ramp velocity toward set-point. Accel (indices/sec**2) is 
+    // the change in velocity in milli-indices/sec per 1ms ramp tick.
+    vel = Ramp.Vel;
+    dvel = ((int32_t) Ramp.Accel)*((int32_t) ticks);
+    if (vel < vel_setpt) {
+        vel = (vel_setpt - vel) > dvel ? vel + dvel : vel_setpt;
+    }
+    else if (vel > vel_setpt) {
+        vel = (vel - vel_setpt) > dvel ? vel - dvel : vel_setpt;
+    }
+
+    // Get output velocity and direction. Velocities below the minimum
+    // allowed velocity are output as zero.
+    if (vel < 0) {
+        vel_out = (uint16_t) ((-vel)/1000);
+        dir_out = DIR_NEG;
+    }
+    else if (vel > 0) {
+        vel_out = (uint16_t) (vel/1000);
+        dir_out = DIR_POS;
+    }
+    else {
+        vel_out = 0;
+        dir_out = Sys_State.Vel_Mode.Dir_SetPt;
+    }
+    vel_out = vel_out >= Min_Vel ? vel_out : 0;
+
+    // Update step timer if necessary
+    if (vel_out != Ramp.Vel_Out) {
+        Set_Step_Rate(vel_out);
+    }
+
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        Ramp.Vel = vel;
+        Ramp.Vel_Out = vel_out;
+        Ramp.Dir_Out = dir_out;
+    }
+    return;
+}
+
+// --------------------------------------------------------------
+// Function: USB_Send_Event
+//
+// Purpose: Sends event records from the event FIFO to the host via
+// the interrupt in endpoint - one record per endpoint transfer. 
+//
+// --------------------------------------------------------------
+TASK(USB_Send_Event)
+{
+    Event_t Event;
+
+    if (USB_IsConnected) {
+        if (Event_FIFO.Head == Event_FIFO.Tail) {
+            return;
+        }
+
+        // Select the Event In Endpoint 
+        Endpoint_SelectEndpoint(SIMPLE_EVENT_EPNUM);
+
+        if (Endpoint_ReadWriteAllowed()) {
+            // Remove event from FIFO
+            ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+                Event = Event_FIFO.Buffer[Event_FIFO.Tail];
+                Event_FIFO.Tail = (Event_FIFO.Tail + 1) & EVENT_FIFO_MASK;
+            }
+
+            // Write event record and send 
+            Endpoint_Write_Stream_LE((uint8_t *) &Event, sizeof(Event));
+            Endpoint_FIFOCON_Clear();
+        }
+    }
+    return;
+}
+
+// --------------------------------------------------------------
+// Function: Home_Seq
+//
+// Purpose: Homing sequence state machine. Only runs while homing.
+// The external interrupt routine detects the edges and stops the
+// motor, this task then starts the next stage of the sequence. If
+// the motor is stopped by the host the sequence is aborted.
+//
+// --------------------------------------------------------------
+TASK(Home_Seq)
+{
+    uint8_t edge;
+    uint8_t status;
+    int32_t edge_pos;
+    int32_t backoff;
+
+    // Read together - the edge interrupt also changes the status
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        edge = Home.Edge;
+        edge_pos = Home.Edge_Pos;
+        status = Sys_State.Status;
+    }
+
+    // Back off in the direction away from the switch
+    backoff = (int32_t) Home.Backoff;
+    if (Home.Dir == DIR_POS) {
+        backoff = -backoff;
+    }
+
+    switch (Home.State) {
+
+        case HOME_FAST:
+        case HOME_SLOW:
+            if (edge == TRUE) {
+                if (Home.State == HOME_FAST) {
+                    Home.State = HOME_BACKOFF;
+                    Home_Move(edge_pos + backoff, Home.Fast_Vel);
+                }
+                else {
+                    // Zero at edge 
+                    Set_Zero_Pos(edge_pos);
+                    Home.State = HOME_PARK;
+                    Home_Move(backoff, Home.Slow_Vel);
+                }
+            }
+            else if (status != RUNNING) {
+                Home_Finish(HOME_ABORTED);
+            }
+            break;
+
+        case HOME_BACKOFF:
+        case HOME_PARK:
+            if (status != RUNNING) {
+                Home_Finish(HOME_ABORTED);
+            }
+            else if (Get_Pos_Err() == 0) {
+                if (Home.State == HOME_PARK) {
+                    Home_Finish(HOME_DONE);
+                }
+                else if (Ext_Int_Active() == TRUE) {
+                    // Back off didn't release the switch 
+                    Home_Finish(HOME_ABORTED);
+                }
+                else {
+                    Home.State = HOME_SLOW;
+                    Home_Approach(Home.Slow_Vel);
+                }
+            }
+            break;
+
+        default:
+            Home_Finish(Home.State);
+            break;
+    }
+    return;
+}
+
+// --------------------------------------------------------------
+// Function: Prog_Run
+//
+// Purpose: Motion program interpreter. Only runs while a program 
+// is running. Executes instructions until one has to wait, or at 
+// most PROG_MAX_STEPS instructions, so that the other tasks are 
+// not held up by programs which loop without waiting.
+//
+// --------------------------------------------------------------
+TASK(Prog_Run)
+{
+    uint8_t i;
+
+    for (i=0; i<PROG_MAX_STEPS; i++) {
+        if (Prog.State != PROG_RUNNING) {
+            break;
+        }
+        if (Prog_Step() == FALSE) {
+            break;
+        }
+    }
+    return;
+}
+
+// --------------------------------------------------------------
+// Function: USB_Send_Capture
+//
+// Purpose: Sends input capture records requested by the host on 
+// the capture bulk in endpoint. Each packet starts with the number 
+// of records in the packet and the number of records dropped since
+// the last packet.
+//
+// --------------------------------------------------------------
+TASK(USB_Send_Capture)
+{
+    Capture_t Rec;
+    uint8_t num;
+    uint8_t dropped;
+    uint8_t i;
+
+    if (USB_IsConnected) {
+        if (Capture_FIFO.Send == 0) {
+            return;
+        }
+
+        // Select the Capture In Endpoint 
+        Endpoint_SelectEndpoint(SIMPLE_CAPTURE_EPNUM);
+
+        if (Endpoint_ReadWriteAllowed()) {
+            num = Capture_FIFO.Send;
+            num = num < CAPTURE_RECS_PER_PACKET ? num : CAPTURE_RECS_PER_PACKET;
+            ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+                dropped = Capture_FIFO.Dropped;
+                Capture_FIFO.Dropped = 0;
+            }
+            Endpoint_Write_Byte(num);
+            Endpoint_Write_Byte(dropped);
+
+            // Remove records from FIFO and write 
+            for (i=0; i<num; i++) {
+                ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+                    Rec = Capture_FIFO.Buffer[Capture_FIFO.Tail];
+                    Capture_FIFO.Tail = (Capture_FIFO.Tail + 1) & CAPTURE_FIFO_MASK;
+                }
+                Endpoint_Write_Stream_LE((uint8_t *) &Rec, sizeof(Rec));
+            }
+            Endpoint_FIFOCON_Clear();
+            Capture_FIFO.Send -= num;
+        }
+    }
+    return;
+}
+
 // ------------------------------------------------------------------
 // Function: USB_Packet_Read
 //
@@ -517,82 +1002,1070 @@ static void USB_Packet_Write(void)
 }
 
 // ------------------------------------------------------------
-// Function: Ext_Int_Active 
+// Function: Get_Clock
+//
+// Purpose: Gets the 32 bit device clock in an atomic manner. 
 //
 // ------------------------------------------------------------
-static uint8_t Ext_Int_Active(void)
+static uint32_t Get_Clock(void)
 {
-    uint8_t ext_int_val;
-    uint8_t rtn_val = FALSE;
-    ext_int_val =   EXT_INT_INP_REG & (1<<EXT_INT_INP_PIN); 
-    if ((EXT_INT_POLARITY==EXT_INT_HI2LO) && (ext_int_val==0)) {
-        rtn_val = TRUE;
-    } 
-    else if ((EXT_INT_POLARITY==EXT_INT_LO2HI) && (ext_int_val==1)) {
-        rtn_val = TRUE;
-    }
-    else {
-        rtn_val = FALSE;
+    uint16_t lo;
+    uint16_t hi;
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        lo = CLOCK_TCNT;
+        hi = Clock_Hi;
+        // Account for an overflow which has not yet been serviced
+        if ((CLOCK_TIFR & (1<<CLOCK_TOV)) && (lo < 0x8000)) {
+            hi++;
+        }
     }
-    return rtn_val;
+    return (((uint32_t) hi) << 16) | ((uint32_t) lo);
 }
 
 // ------------------------------------------------------------
-// Function: Set_Ext_Int
+// Function: Push_Event
 //
-// Purpose: Enables external interrupts. Only allowed if the 
-// external interrupt pin is no longer active. What active
-// means depends on the external interrrupt polarity.
+// Purpose: Adds an event record to the event FIFO. If the FIFO
+// is full the event is dropped. Called from the interrupt routines.
 //
 // ------------------------------------------------------------
-static void Set_Ext_Int(uint8_t val)
+static void Push_Event(uint8_t Event_ID, uint8_t Arg)
 {
-    if (val == ENABLED) {
-        if (Ext_Int_Active()==TRUE) {
-            return;
+    uint8_t head;
+
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        head = (Event_FIFO.Head + 1) & EVENT_FIFO_MASK;
+        if (head == Event_FIFO.Tail) {
+            if (Event_FIFO.Dropped < 0xff) {
+                Event_FIFO.Dropped++;
+            }
         }
         else {
-            // Enable external interrupts
-            Sys_State.Ext_Int = ENABLED;
-            EIFR  |= (1<<EXT_INT_FLAG); // Clear interrupt
-            EIMSK |= (1<<EXT_INT);
+            Event_FIFO.Buffer[Event_FIFO.Head].Event_ID = Event_ID;
+            Event_FIFO.Buffer[Event_FIFO.Head].Arg = Arg;
+            Event_FIFO.Buffer[Event_FIFO.Head].Pos = Sys_State.Pos;
+            Event_FIFO.Buffer[Event_FIFO.Head].Stamp = (uint16_t) Get_Clock();
+            Event_FIFO.Head = head;
         }
     }
-    if (val == DISABLED) {
-        // Disable external interrupts
-        Sys_State.Ext_Int = DISABLED;
-        EIMSK &= ~(1<<EXT_INT);
-    }
     return;
 }
-    
 
 // ------------------------------------------------------------
-// Function: Set_DIO_Hi
+// Function: Push_Latch
+//
+// Purpose: Adds the current motor position and device clock to
+// the latch FIFO. If the FIFO is full the oldest latch is 
+// overwritten. Called from the external interrupt routine.
+//
+// ------------------------------------------------------------
+static void Push_Latch(void)
+{
+    uint8_t head;
+
+    head = (Latch_FIFO.Head + 1) & LATCH_FIFO_MASK;
+    if (head == Latch_FIFO.Tail) {
+        Latch_FIFO.Tail = (Latch_FIFO.Tail + 1) & LATCH_FIFO_MASK;
+    }
+    Latch_FIFO.Buffer[Latch_FIFO.Head].Pos = Sys_State.Pos;
+    Latch_FIFO.Buffer[Latch_FIFO.Head].Time = Get_Clock();
+    Latch_FIFO.Head = head;
+    return;
+}
+
+// ------------------------------------------------------------
+// Function: Get_Latch_Cnt
+//
+// Purpose: Gets the number of latches in the latch FIFO.
+//
+// ------------------------------------------------------------
+static uint8_t Get_Latch_Cnt(void)
+{
+    uint8_t Cnt;
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        Cnt = (Latch_FIFO.Head - Latch_FIFO.Tail) & LATCH_FIFO_MASK;
+    }
+    return Cnt;
+}
+
+// ------------------------------------------------------------
+// Function: Pop_Latch
+//
+// Purpose: Removes the oldest latch from the latch FIFO, copies 
+// it, position and time together, to Latch_Last and returns its 
+// position. The current position and time are used if the FIFO
+// is empty.
+//
+// ------------------------------------------------------------
+static int32_t Pop_Latch(void)
+{
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        if (Latch_FIFO.Head == Latch_FIFO.Tail) {
+            Latch_Last.Pos = Sys_State.Pos;
+            Latch_Last.Time = Get_Clock();
+        }
+        else {
+            Latch_Last.Pos = Latch_FIFO.Buffer[Latch_FIFO.Tail].Pos;
+            Latch_Last.Time = Latch_FIFO.Buffer[Latch_FIFO.Tail].Time;
+            Latch_FIFO.Tail = (Latch_FIFO.Tail + 1) & LATCH_FIFO_MASK;
+        }
+    }
+    return Latch_Last.Pos;
+}
+
+// ------------------------------------------------------------
+// Function: Ext_Int_Active 
+//
+// ------------------------------------------------------------
+static uint8_t Ext_Int_Active(void)
+{
+    uint8_t ext_int_val;
+    uint8_t rtn_val = FALSE;
+    ext_int_val =   EXT_INT_INP_REG & (1<<EXT_INT_INP_PIN); 
+    if ((EXT_INT_POLARITY==EXT_INT_HI2LO) && (ext_int_val==0)) {
+        rtn_val = TRUE;
+    } 
+    else if ((EXT_INT_POLARITY==EXT_INT_LO2HI) && (ext_int_val==1)) {
+        rtn_val = TRUE;
+    }
+    else {
+        rtn_val = FALSE;
+    }
+    return rtn_val;
+}
+
+// ------------------------------------------------------------
+// Function: Set_Ext_Int
+//
+// Purpose: Enables external interrupts. Only allowed if the 
+// external interrupt pin is no longer active. What active
+// means depends on the external interrrupt polarity.
+//
+// ------------------------------------------------------------
+static void Set_Ext_Int(uint8_t val)
+{
+    if ((val == ENABLED) || (val == EXT_INT_LATCH)) {
+        if ((val == ENABLED) && (Ext_Int_Active()==TRUE)) {
+            return;
+        }
+        else {
+            // Enable external interrupts and clear latches
+            ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+                Sys_State.Ext_Int = val;
+                Latch_FIFO.Head = 0;
+                Latch_FIFO.Tail = 0;
+                EIFR  |= (1<<EXT_INT_FLAG); // Clear interrupt
+                EIMSK |= (1<<EXT_INT);
+            }
+        }
+    }
+    if (val == DISABLED) {
+        // Disable external interrupts
+        Sys_State.Ext_Int = DISABLED;
+        EIMSK &= ~(1<<EXT_INT);
+    }
+    return;
+}
+    
+
+// ------------------------------------------------------------
+// Function: Set_DIO_Hi
 //
 //
 // ------------------------------------------------------------
 static void Set_DIO_Hi(uint8_t pin)
 {
-    if (pin < 8) {
-        DIO_PORT |= (1 << dio_port_pins[pin]);
+    if (pin < 8) {
+        // Atomic - DIO port is also written by position triggers
+        ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+            DIO_PORT |= (1 << dio_port_pins[pin]);
+        }
+    }
+    return;
+}
+
+//-------------------------------------------------------------
+// Function: Set_DIO_Lo
+//
+//
+// ------------------------------------------------------------
+static void Set_DIO_Lo(uint8_t pin)
+{
+    if (pin < 8) {
+        ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+            DIO_PORT &= ~(1 << dio_port_pins[pin]);
+        }
+    }
+    return;
+}
+
+// ------------------------------------------------------------
+// Function: Set_Capture
+//
+// Purpose: Enables input capture on the capture port pins set in
+// Mask - a Mask of zero disables input capture. The enabled pins
+// are set to inputs and the unrequested records in the capture FIFO
+// are cleared. Records already requested by the host with 
+// Read_Capture are kept and still sent, so that a read in progress
+// on the capture endpoint completes. Returns the enabled pins.
+//
+// ------------------------------------------------------------
+static uint8_t Set_Capture(uint8_t Mask)
+{
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        CAPTURE_DDR &= ~Mask;
+        CAPTURE_PCMSK = Mask;
+        Capture_FIFO.Mask = Mask;
+        Capture_FIFO.Prev = CAPTURE_INP_REG;
+        Capture_FIFO.Head = (Capture_FIFO.Tail + Capture_FIFO.Send) & CAPTURE_FIFO_MASK;
+        Capture_FIFO.Dropped = 0;
+        PCIFR = (1 << CAPTURE_PCIF);
+        if (Mask != 0) {
+            PCICR |= (1 << CAPTURE_PCIE);
+        }
+        else {
+            PCICR &= ~(1 << CAPTURE_PCIE);
+        }
+    }
+    return Mask;
+}
+
+// ------------------------------------------------------------
+// Function: Read_Capture
+//
+// Purpose: Requests that up to Num input capture records be sent 
+// to the host on the capture endpoint. Returns the number of records 
+// which will be sent. 
+//
+// ------------------------------------------------------------
+static uint8_t Read_Capture(uint8_t Num)
+{
+    uint8_t cnt;
+
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        // Records already requested are still in the FIFO
+        cnt = ((Capture_FIFO.Head - Capture_FIFO.Tail) & CAPTURE_FIFO_MASK) - Capture_FIFO.Send;
+        cnt = cnt < Num ? cnt : Num;
+        Capture_FIFO.Send += cnt;
+    }
+    return cnt;
+}
+
+// ------------------------------------------------------------
+// Function: Set_DIO_Port
+//
+// Purpose: Sets all DIO pins at once. Bit i of Mask sets the 
+// value of DIO pin i. Returns the DIO port mask.
+//
+// ------------------------------------------------------------
+static uint8_t Set_DIO_Port(uint8_t Mask)
+{
+    uint8_t port;
+
+    port = DIO_Mask_To_Port(Mask);
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        DIO_PORT = (DIO_PORT & ~DIO_PORT_MASK) | port;
+    }
+    return Get_DIO_Port();
+}
+
+// ------------------------------------------------------------
+// Function: DIO_Mask_To_Port
+//
+// Purpose: Converts a DIO mask, bit i for DIO pin i, to DIO port
+// register bits.
+//
+// ------------------------------------------------------------
+static uint8_t DIO_Mask_To_Port(uint8_t Mask)
+{
+    uint8_t i;
+    uint8_t port = 0;
+
+    for (i=0; i<8; i++) {
+        if (Mask & (1 << i)) {
+            port |= (1 << dio_port_pins[i]);
+        }
+    }
+    return port;
+}
+
+// ------------------------------------------------------------
+// Function: Get_DIO_Port
+//
+// Purpose: Gets the DIO port mask. Bit i is the value of DIO
+// pin i.
+//
+// ------------------------------------------------------------
+static uint8_t Get_DIO_Port(void)
+{
+    uint8_t i;
+    uint8_t port;
+    uint8_t Mask = 0;
+
+    port = DIO_PORT;
+    for (i=0; i<8; i++) {
+        if (port & (1 << dio_port_pins[i])) {
+            Mask |= (1 << i);
+        }
+    }
+    return Mask;
+}
+
+// ------------------------------------------------------------
+// Function: Set_DIO_Pat
+//
+// Purpose: Sets entry Index of the DIO pattern table. The low byte
+// of Entry is the DIO port mask and the upper three bytes are the
+// duration (us). The table must be written in order starting at 
+// index 0 - writing index 0 stops playback and clears the table.
+// Returns the number of entries in the table.
+//
+// ------------------------------------------------------------
+static uint8_t Set_DIO_Pat(uint8_t Index, uint32_t Entry)
+{
+    uint8_t Num;
+    uint32_t Duration;
+
+    Duration = Entry >> 8;
+    Duration = Duration >= DIO_PAT_DURATION_MIN ? Duration : DIO_PAT_DURATION_MIN;
+
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        if (Index == 0) {
+            CLOCK_TIMSK &= ~(1 << DIO_PAT_OCIE);
+            DIO_Pat.Playing = FALSE;
+            DIO_Pat.Num = 0;
+        }
+        if ((Index == DIO_Pat.Num) && (Index < DIO_PAT_TABLE_SIZE) && 
+                (DIO_Pat.Playing == FALSE)) {
+            DIO_Pat.Port[Index] = DIO_Mask_To_Port((uint8_t) (Entry & 0xff));
+            DIO_Pat.Duration[Index] = Duration;
+            DIO_Pat.Num++;
+        }
+        Num = DIO_Pat.Num;
+    }
+    return Num;
+}
+
+// ------------------------------------------------------------
+// Function: Play_DIO_Pat
+//
+// Purpose: Plays the DIO pattern Repeat times, or endlessly if 
+// Repeat is DIO_PAT_FOREVER. A Repeat of zero stops playback. The
+// entries are timed by the device clock output compare, which is 
+// advanced from one compare to the next so that timing errors do 
+// not accumulate. Returns TRUE if the pattern is playing.
+//
+// ------------------------------------------------------------
+static uint8_t Play_DIO_Pat(uint16_t Repeat)
+{
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        CLOCK_TIMSK &= ~(1 << DIO_PAT_OCIE);
+        DIO_Pat.Playing = FALSE;
+        if ((Repeat > 0) && (DIO_Pat.Num > 0)) {
+            DIO_Pat.Repeat = Repeat;
+            DIO_Pat.Idx = 0;
+            DIO_Pat.Playing = TRUE;
+            DIO_PAT_OCR = CLOCK_TCNT;
+            DIO_PORT = (DIO_PORT & ~DIO_PORT_MASK) | DIO_Pat.Port[0];
+            DIO_Pat_Schedule(DIO_Pat.Duration[0]);
+            CLOCK_TIFR = (1 << DIO_PAT_OCF);
+            CLOCK_TIMSK |= (1 << DIO_PAT_OCIE);
+        }
+    }
+    return DIO_Pat.Playing;
+}
+
+// ------------------------------------------------------------
+// Function: DIO_Pat_Schedule
+//
+// Purpose: Schedules the next DIO pattern compare interrupt Ticks
+// after the previous one, in steps of at most DIO_PAT_STEP_MAX. 
+// Must be called with interrupts disabled.
+//
+// ------------------------------------------------------------
+static void DIO_Pat_Schedule(uint32_t Ticks)
+{
+    uint16_t step;
+
+    step = Ticks > DIO_PAT_STEP_MAX ? DIO_PAT_STEP_MAX : (uint16_t) Ticks;
+    DIO_PAT_OCR += step;
+    DIO_Pat.Remain = Ticks - step;
+    return;
+}
+
+// ------------------------------------------------------------
+// Function: Fire_Trig
+//
+// Purpose: Sends a trigger pulse on the given DIO pin. The pin 
+// should be wired to the trigger pins of all devices which are to
+// be started together. This device is started at the rising edge
+// whether or not its own trigger pin is wired.
+//
+// ------------------------------------------------------------
+static void Fire_Trig(uint8_t pin)
+{
+    if (pin < 8) {
+        ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+            DIO_PORT |= (1 << dio_port_pins[pin]);
+            Trig_Start();
+        }
+        _delay_us(TRIG_PULSE_WIDTH);
+        ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+            DIO_PORT &= ~(1 << dio_port_pins[pin]);
+        }
+    }
+    return;
+}
+
+// ------------------------------------------------------------
+// Function: Trig_Start
+//
+// Purpose: Starts an ARMED device. The step timer is restarted so 
+// that all triggered devices step in phase. Must be called with 
+// interrupts disabled.
+//
+// ------------------------------------------------------------
+static void Trig_Start(void)
+{
+    if (Sys_State.Status == ARMED) {
+        Sys_State.Status = RUNNING;
+        TIMER_TCNT = 0;
+        EIMSK &= ~(1<<TRIG_INT);
+        Push_Event(EVENT_TRIG_START, Sys_State.Mode);
+    }
+    return;
+}
+
+// ------------------------------------------------------------
+// Function: Set_Prog
+//
+// Purpose: Sets instruction Index of the motion program. The 
+// program must be written in order starting at index 0 - writing 
+// index 0 clears the program. The program can't be changed while
+// it is running. Returns the number of instructions in the program.
+//
+// ------------------------------------------------------------
+static uint8_t Set_Prog(uint8_t Index, uint8_t Op, int32_t Arg)
+{
+    if (Prog.State == PROG_RUNNING) {
+        return Prog.Num;
+    }
+    if (Index == 0) {
+        Prog.Num = 0;
+        Prog.PC = 0;
+        Prog.State = PROG_STOPPED;
+    }
+    if ((Index == Prog.Num) && (Index < PROG_TABLE_SIZE) && (Op <= PROG_OP_MAX)) {
+        Prog.Op[Index] = Op;
+        Prog.Arg[Index] = Arg;
+        Prog.Num++;
+    }
+    return Prog.Num;
+}
+
+// ------------------------------------------------------------
+// Function: Run_Prog
+//
+// Purpose: Starts the motion program from the first instruction 
+// if Run is TRUE, or aborts the running program if Run is FALSE.
+// The motor is left in position mode at its current position. A 
+// program can't be started while homing. Returns the program state. 
+//
+// ------------------------------------------------------------
+static uint8_t Run_Prog(uint8_t Run)
+{
+    uint8_t i;
+
+    if (Run == FALSE) {
+        if (Prog.State == PROG_RUNNING) {
+            Prog_Finish(PROG_ABORTED);
+        }
+        return Prog.State;
+    }
+    if ((Prog.State == PROG_RUNNING) || (Prog.Num == 0) || HOME_ACTIVE(Home.State)) {
+        return Prog.State;
+    }
+    for (i=0; i<Prog.Num; i++) {
+        Prog.Cnt[i] = 0;
+    }
+    Set_Mode(POS_MODE);
+    Set_Pos_SetPt(Get_Pos());
+    Pos_Mode_IO_Update();
+    Prog.PC = 0;
+    Prog.Wait = FALSE;
+    Prog.State = PROG_RUNNING;
+    Scheduler_SetTaskMode(Prog_Run, TASK_RUN);
+    return Prog.State;
+}
+
+// ------------------------------------------------------------
+// Function: Prog_Step
+//
+// Purpose: Executes the current motion program instruction. Wait 
+// instructions are started on the first call and checked on each
+// following call. Returns TRUE if the program advanced, FALSE if 
+// it is waiting or has finished.
+//
+// ------------------------------------------------------------
+static uint8_t Prog_Step(void)
+{
+    uint8_t op;
+    int32_t arg;
+    uint8_t sel;
+    uint8_t status;
+    uint8_t edge;
+    uint16_t count;
+
+    if (Prog.PC >= Prog.Num) {
+        Prog_Finish(PROG_DONE);
+        return FALSE;
+    }
+    op = Prog.Op[Prog.PC];
+    arg = Prog.Arg[Prog.PC];
+
+    switch (op) {
+
+        case PROG_OP_END:
+            Prog_Finish(PROG_DONE);
+            return FALSE;
+
+        case PROG_OP_MOVE:
+        case PROG_OP_MOVE_REL:
+            if (op == PROG_OP_MOVE_REL) {
+                // Relative to set-point so that errors don't accumulate
+                arg += Sys_State.Pos_Mode.Pos_SetPt;
+            }
+            Set_Pos_SetPt(arg);
+            Pos_Mode_IO_Update();
+            Set_Status(RUNNING);
+            break;
+
+        case PROG_OP_SET_VEL:
+            Set_Pos_Vel(arg > 0 ? (arg < Max_Vel ? (uint16_t) arg : Max_Vel) : 0);
+            Pos_Mode_IO_Update();
+            break;
+
+        case PROG_OP_WAIT_DONE:
+            ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+                status = Sys_State.Status;
+            }
+            if (status != RUNNING) {
+                // Motor stopped by something other than the program,
+                // e.g. the external interrupt 
+                Prog_Finish(PROG_ABORTED);
+                return FALSE;
+            }
+            if (Get_Pos_Err() != 0) {
+                return FALSE;
+            }
+            break;
+
+        case PROG_OP_WAIT_US:
+            if (Prog.Wait == FALSE) {
+                Prog.Wait_Start = Get_Clock();
+                Prog.Wait = TRUE;
+            }
+            if ((Get_Clock() - Prog.Wait_Start) < (uint32_t) arg) {
+                return FALSE;
+            }
+            Prog.Wait = FALSE;
+            break;
+
+        case PROG_OP_DIO_SET:
+            sel = (uint8_t) ((arg >> 8) & 0xff);
+            sel = sel != 0 ? sel : 0xff;
+            Set_DIO_Port((Get_DIO_Port() & ~sel) | ((uint8_t) (arg & 0xff) & sel));
+            break;
+
+        case PROG_OP_WAIT_EXT_INT:
+            if (Prog.Wait == FALSE) {
+                ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+                    Prog.Edge = FALSE;
+                    EIFR  |= (1<<EXT_INT_FLAG); 
+                    EIMSK |= (1<<EXT_INT);
+                }
+                Prog.Wait = TRUE;
+            }
+            ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+                edge = Prog.Edge;
+            }
+            if (edge == FALSE) {
+                return FALSE;
+            }
+            ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+                if (Sys_State.Ext_Int == DISABLED) {
+                    EIMSK &= ~(1<<EXT_INT);
+                }
+            }
+            Prog.Wait = FALSE;
+            break;
+
+        case PROG_OP_LOOP:
+            count = (uint16_t) ((arg >> 8) & 0xffff);
+            if (count == 0) {
+                // Loop forever
+                Prog.PC = (uint8_t) (arg & 0xff);
+                return TRUE;
+            }
+            Prog.Cnt[Prog.PC]++;
+            if (Prog.Cnt[Prog.PC] < count) {
+                Prog.PC = (uint8_t) (arg & 0xff);
+                return TRUE;
+            }
+            Prog.Cnt[Prog.PC] = 0;
+            break;
+
+        default:
+            Prog_Finish(PROG_ABORTED);
+            return FALSE;
+    }
+    Prog.PC++;
+    return TRUE;
+}
+
+// ------------------------------------------------------------
+// Function: Prog_Finish
+//
+// Purpose: Ends the motion program. When aborted the motor is 
+// stopped. The external interrupt setting is restored.
+//
+// ------------------------------------------------------------
+static void Prog_Finish(uint8_t State)
+{
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        Prog.State = State;
+        Prog.Wait = FALSE;
+        if (State == PROG_ABORTED) {
+            Sys_State.Status = STOPPED;
+            Staged_Move.Pending = FALSE;
+        }
+        if ((Sys_State.Ext_Int == DISABLED) && !HOME_ACTIVE(Home.State)) {
+            EIMSK &= ~(1<<EXT_INT);
+        }
+        Push_Event(EVENT_PROG_DONE, State);
+    }
+    Scheduler_SetTaskMode(Prog_Run, TASK_STOP);
+    return;
+}
+
+// ------------------------------------------------------------
+// Function: Set_Home_Param
+//
+// Purpose: Sets a homing parameter. Returns the new value. 
+//
+// ------------------------------------------------------------
+static int32_t Set_Home_Param(uint8_t Param, int32_t Value)
+{
+    uint16_t Vel;
+
+    Vel = Value > 0 ? (Value < Max_Vel ? (uint16_t) Value : Max_Vel) : 0;
+    Vel = Vel >= Min_Vel ? Vel : Min_Vel;
+
+    switch (Param) {
+
+        case HOME_PARAM_FAST_VEL:
+            Home.Fast_Vel = Vel;
+            return Home.Fast_Vel;
+
+        case HOME_PARAM_SLOW_VEL:
+            Home.Slow_Vel = Vel;
+            return Home.Slow_Vel;
+
+        case HOME_PARAM_BACKOFF:
+            Value = Value > 0 ? Value : 1;
+            Home.Backoff = Value < 0xffff ? (uint16_t) Value : 0xffff;
+            return Home.Backoff;
+
+        default:
+            return 0;
+    }
+}
+
+// ------------------------------------------------------------
+// Function: Start_Home
+//
+// Purpose: Starts the homing sequence toward the switch on the 
+// external interrupt pin, which lies in direction Dir. If the 
+// switch is already active the fast approach is skipped. The 
+// external interrupt is used for homing regardless of its setting,
+// which is restored at the end of the sequence, as are the mode and
+// the positioning and velocity mode set-points. Returns the 
+// homing state, or HOME_BUSY if a motion program is running.
+//
+// ------------------------------------------------------------
+static uint8_t Start_Home(uint8_t Dir)
+{
+    if (((Dir != DIR_POS) && (Dir != DIR_NEG)) || HOME_ACTIVE(Home.State)) {
+        return Home.State;
+    }
+    if (Prog.State == PROG_RUNNING) {
+        return HOME_BUSY;
+    }
+    Home.Dir = Dir;
+    Home.Edge = FALSE;
+
+    // Saved for Home_Finish
+    Home.Mode = Sys_State.Mode;
+    Home.Pos_Vel = Sys_State.Pos_Mode.Pos_Vel;
+    Home.Vel_SetPt = Sys_State.Vel_Mode.Vel_SetPt;
+    Home.Dir_SetPt = Sys_State.Vel_Mode.Dir_SetPt;
+
+    if (Ext_Int_Active() == TRUE) {
+        Home.State = HOME_BACKOFF;
+        Home_Move(Get_Pos() + (Dir == DIR_POS ? -1L : 1L)*((int32_t) Home.Backoff), Home.Fast_Vel);
+    }
+    else {
+        Home.State = HOME_FAST;
+        Home_Approach(Home.Fast_Vel);
+    }
+    Scheduler_SetTaskMode(Home_Seq, TASK_RUN);
+    return Home.State;
+}
+
+// ------------------------------------------------------------
+// Function: Home_Move
+//
+// Purpose: Homing position mode move. The switch may be active 
+// so the status is set directly rather than through Set_Status.
+//
+// ------------------------------------------------------------
+static void Home_Move(int32_t Pos, uint16_t Vel)
+{
+    Set_Mode(POS_MODE);
+    Set_Pos_Vel(Vel);
+    Set_Pos_SetPt(Pos);
+    Pos_Mode_IO_Update();
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        Sys_State.Status = RUNNING;
+    }
+    return;
+}
+
+// ------------------------------------------------------------
+// Function: Home_Approach
+//
+// Purpose: Homing velocity mode approach to the switch. Enables 
+// the external interrupt to catch the edge.
+//
+// ------------------------------------------------------------
+static void Home_Approach(uint16_t Vel)
+{
+    Set_Mode(VEL_MODE);
+    Set_Dir_SetPt(Home.Dir);
+    Set_Vel_SetPt(Vel);
+    Vel_Mode_IO_Update();
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        Home.Edge = FALSE;
+        Sys_State.Status = RUNNING;
+        EIFR  |= (1<<EXT_INT_FLAG); 
+        EIMSK |= (1<<EXT_INT);
+    }
+    return;
+}
+
+// ------------------------------------------------------------
+// Function: Home_Finish
+//
+// Purpose: Ends the homing sequence. Stops the motor and restores
+// the external interrupt setting, the mode and the positioning and 
+// velocity mode set-points saved by Start_Home. The position 
+// set-point is set to the current position so that restarting in
+// position mode doesn't move the motor.
+//
+// ------------------------------------------------------------
+static void Home_Finish(uint8_t State)
+{
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        Sys_State.Status = STOPPED;
+        if (Sys_State.Ext_Int == DISABLED) {
+            EIMSK &= ~(1<<EXT_INT);
+        }
+        else {
+            EIFR  |= (1<<EXT_INT_FLAG); 
+        }
+    }
+
+    // Restore settings changed by the homing moves 
+    Set_Mode(Home.Mode);
+    Set_Pos_SetPt(Get_Pos());
+    Set_Pos_Vel(Home.Pos_Vel);
+    Set_Vel_SetPt(Home.Vel_SetPt);
+    Set_Dir_SetPt(Home.Dir_SetPt);
+
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        Home.State = State;
+        Push_Event(EVENT_HOME_DONE, State);
+    }
+    Scheduler_SetTaskMode(Home_Seq, TASK_STOP);
+    return;
+}
+
+// ------------------------------------------------------------
+// Function: Set_Pos_Trig
+//
+// Purpose: Sets entry Index of the position trigger table. The
+// table must be written in order starting at index 0 and the
+// positions must be increasing. Writing index 0 clears the table. 
+// Position triggers are disabled while the table is written. 
+// Returns the number of positions in the table.
+//
+// ------------------------------------------------------------
+static uint8_t Set_Pos_Trig(uint8_t Index, int32_t Pos)
+{
+    uint8_t Num;
+
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        Pos_Trig.Mode = POS_TRIG_OFF;
+        if (Index == 0) {
+            Pos_Trig.Num = 0;
+        }
+        if ((Index == Pos_Trig.Num) && (Index < POS_TRIG_TABLE_SIZE)) {
+            if ((Index == 0) || (Pos > Pos_Trig.Pos[Index-1])) {
+                Pos_Trig.Pos[Index] = Pos;
+                Pos_Trig.Num++;
+            }
+        }
+        Num = Pos_Trig.Num;
+    }
+    return Num;
+}
+
+// ------------------------------------------------------------
+// Function: Set_Pos_Trig_Cfg
+//
+// Purpose: Configures and enables, or disables, the position 
+// triggers. When enabled the trigger count is reset. Returns the
+// position trigger mode.
+//
+// ------------------------------------------------------------
+static uint8_t Set_Pos_Trig_Cfg(uint8_t Pin, uint8_t Mode, uint16_t Width)
+{
+    if ((Pin >= 8) || (Mode > POS_TRIG_TOGGLE)) {
+        return Pos_Trig.Mode;
+    }
+    Width = Width >= POS_TRIG_WIDTH_MIN ? Width : POS_TRIG_WIDTH_MIN;
+
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        Pos_Trig.Pin = Pin;
+        Pos_Trig.Width = Width;
+        Pos_Trig.Count = 0;
+        Pos_Trig_Reset();
+        Pos_Trig.Mode = Mode;
+    }
+    return Mode;
+}
+
+// ------------------------------------------------------------
+// Function: Get_Pos_Trig_Cnt
+//
+// Purpose: Gets the number of position triggers fired since the
+// position triggers were enabled. 
+//
+// ------------------------------------------------------------
+static uint16_t Get_Pos_Trig_Cnt(void)
+{
+    uint16_t Count;
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        Count = Pos_Trig.Count;
+    }
+    return Count;
+}
+
+// ------------------------------------------------------------
+// Function: Pos_Trig_Reset
+//
+// Purpose: Finds the index of the first trigger position >= the 
+// motor position by binary search. Must be called with interrupts
+// disabled.
+//
+// ------------------------------------------------------------
+static void Pos_Trig_Reset(void)
+{
+    uint8_t Lo = 0;
+    uint8_t Hi = Pos_Trig.Num;
+    uint8_t Mid;
+
+    while (Lo < Hi) {
+        Mid = (Lo + Hi)/2;
+        if (Pos_Trig.Pos[Mid] < Sys_State.Pos) {
+            Lo = Mid + 1;
+        }
+        else {
+            Hi = Mid;
+        }
     }
+    Pos_Trig.Idx = Lo;
     return;
 }
 
-//-------------------------------------------------------------
-// Function: Set_DIO_Lo
+// ------------------------------------------------------------
+// Function: Pos_Trig_Update
 //
+// Purpose: Updates the trigger index after a one step change in 
+// motor position and fires the trigger if the motor has reached a 
+// trigger position. Called from the step timer interrupt.
 //
 // ------------------------------------------------------------
-static void Set_DIO_Lo(uint8_t pin)
+static void Pos_Trig_Update(void)
 {
-    if (pin < 8) {
-        DIO_PORT &= ~(1 << dio_port_pins[pin]);
+    uint8_t Fire = FALSE;
+    uint8_t Idx = Pos_Trig.Idx;
+    int32_t Pos = Sys_State.Pos;
+
+    if (Sys_State.Dir == DIR_POS) {
+        if ((Idx < Pos_Trig.Num) && (Pos_Trig.Pos[Idx] < Pos)) {
+            Idx++;
+        }
+        if ((Idx < Pos_Trig.Num) && (Pos_Trig.Pos[Idx] == Pos)) {
+            Fire = TRUE;
+        }
+    }
+    else {
+        if ((Idx > 0) && (Pos_Trig.Pos[Idx-1] == Pos)) {
+            Idx--;
+            Fire = TRUE;
+        }
+    }
+    Pos_Trig.Idx = Idx;
+
+    if (Fire == TRUE) {
+        if (Pos_Trig.Mode == POS_TRIG_TOGGLE) {
+            DIO_PORT ^= (1 << dio_port_pins[Pos_Trig.Pin]);
+        }
+        else {
+            // Set pin high and time pulse with the device clock
+            uint16_t Start = CLOCK_TCNT;
+            DIO_PORT |= (1 << dio_port_pins[Pos_Trig.Pin]);
+            POS_TRIG_OCR = Start + Pos_Trig.Width;
+            CLOCK_TIFR = (1 << POS_TRIG_OCF);
+            CLOCK_TIMSK |= (1 << POS_TRIG_OCIE);
+            if ((uint16_t) (CLOCK_TCNT - Start) >= Pos_Trig.Width) {
+                // Clock passed the compare value before it was armed - 
+                // end the pulse now rather than after the clock wraps
+                CLOCK_TIMSK &= ~(1 << POS_TRIG_OCIE);
+                DIO_PORT &= ~(1 << dio_port_pins[Pos_Trig.Pin]);
+            }
+        }
+        Pos_Trig.Count++;
     }
     return;
 }
 
+// ------------------------------------------------------------
+// Function: Config_Check
+//
+// Purpose: Returns the checksum of a configuration block - the
+// complement of the sum of all bytes before the Check field.
+//
+// ------------------------------------------------------------
+static uint8_t Config_Check(Config_t *Config)
+{
+    uint8_t i;
+    uint8_t Sum = 0;
+    uint8_t *Bytes = (uint8_t *) Config;
+
+    for (i=0; i<offsetof(Config_t, Check); i++) {
+        Sum += Bytes[i];
+    }
+    return ~Sum;
+}
+
+// ------------------------------------------------------------
+// Function: Read_Config
+//
+// Purpose: Reads the configuration block from EEPROM. Returns TRUE 
+// if the block is valid and FALSE otherwise.
+//
+// ------------------------------------------------------------
+static uint8_t Read_Config(Config_t *Config)
+{
+    eeprom_read_block((void *) Config, (const void *) &EE_Config, sizeof(Config_t));
+    if ((Config->Magic != CONFIG_MAGIC) || (Config->Version != CONFIG_VERSION)) {
+        return FALSE;
+    }
+    if (Config->Check != Config_Check(Config)) {
+        return FALSE;
+    }
+    if ((Config->Mode != VEL_MODE) && (Config->Mode != POS_MODE)) {
+        return FALSE;
+    }
+    if ((Config->Enable != ENABLED) && (Config->Enable != DISABLED)) {
+        return FALSE;
+    }
+    if ((Config->Ext_Int != ENABLED) && (Config->Ext_Int != DISABLED) &&
+        (Config->Ext_Int != EXT_INT_LATCH)) {
+        return FALSE;
+    }
+    return TRUE;
+}
+
+// ------------------------------------------------------------
+// Function: Save_Config
+//
+// Purpose: Saves the current mode, positioning velocity, enable,
+// external interrupt, step mode and acceleration settings to the 
+// EEPROM configuration block, or, if Save is CONFIG_ERASE, 
+// invalidates the saved block so that the compile time defaults 
+// are used at start up. Returns TRUE if a valid block is saved. 
+// Writing the block takes a few tens of ms.
+//
+// ------------------------------------------------------------
+static uint8_t Save_Config(uint8_t Save)
+{
+    Config_t Config;
+
+    if (Save == CONFIG_ERASE) {
+        eeprom_write_word(&EE_Config.Magic, 0xffff);
+        return FALSE;
+    }
+
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        Config.Mode = Sys_State.Mode;
+        Config.Pos_Vel = Sys_State.Pos_Mode.Pos_Vel;
+        Config.Enable = Sys_State.Enable;
+        Config.Ext_Int = Sys_State.Ext_Int;
+        Config.Step_Mode = Sys_State.Step_Mode;
+        Config.Accel = Ramp.Accel;
+    }
+    Config.Magic = CONFIG_MAGIC;
+    Config.Version = CONFIG_VERSION;
+    Config.Check = Config_Check(&Config);
+    eeprom_write_block((const void *) &Config, (void *) &EE_Config, sizeof(Config_t));
+
+    return Read_Config(&Config);
+}
+
+// ------------------------------------------------------------
+// Function: Load_Config
+//
+// Purpose: Loads the EEPROM configuration block, if valid, into the 
+// system state. If Apply is FALSE, during IO_Init, the enable pin and
+// external interrupts are only set in Sys_State and are configured 
+// by IO_Init. Returns TRUE if a valid block was loaded.
+//
+// ------------------------------------------------------------
+static uint8_t Load_Config(uint8_t Apply)
+{
+    Config_t Config;
+
+    if (Read_Config(&Config) == FALSE) {
+        return FALSE;
+    }
+    Set_Mode(Config.Mode);
+    Set_Pos_Vel(Config.Pos_Vel);
+    Set_Step_Mode(Config.Step_Mode);
+    Set_Accel(Config.Accel);
+    if (Apply == TRUE) {
+        Set_Enable(Config.Enable);
+        Set_Ext_Int(Config.Ext_Int);
+    }
+    else {
+        Sys_State.Enable = Config.Enable;
+        Sys_State.Ext_Int = Config.Ext_Int;
+    }
+    return TRUE;
+}
+
 // -------------------------------------------------------------
 // Function: Set_Enable
 //
@@ -639,25 +2112,64 @@ static void Vel_Trig_Lo(void)
 // -------------------------------------------------------------
 // Function: Set_Status
 //
-// Purpose: Sets the device status - to RUNNING or STOPPED.
+// Purpose: Sets the device status - to RUNNING, STOPPED or ARMED.
+// An ARMED device waits for a rising edge on the trigger pin and 
+// then changes its status to RUNNING.
 //
 // -------------------------------------------------------------
 static void Set_Status(uint8_t Status)
 {
-    if ((Status == RUNNING) || (Status == STOPPED)) {
-        if ((Status==RUNNING) && (Sys_State.Ext_Int==ENABLED) && 
+    if ((Status == RUNNING) || (Status == STOPPED) || (Status == ARMED)) {
+        if ((Status!=STOPPED) && (Sys_State.Ext_Int==ENABLED) && 
                 (Ext_Int_Active()==TRUE)) {
             return;
         }
+        else if ((Status!=STOPPED) && HOME_ACTIVE(Home.State)) {
+            // Homing sequence controls the status
+            return;
+        }
         else {
+            if ((Status == STOPPED) && (Prog.State == PROG_RUNNING)) {
+                // Stop aborts the motion program
+                Prog_Finish(PROG_ABORTED);
+            }
             ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
                 Sys_State.Status = Status;
+                if (Status == STOPPED) {
+                    // Don't continue into staged moves after a stop
+                    Staged_Move.Pending = FALSE;
+                }
+                if (Status == ARMED) {
+                    // Clear pending trigger and enable trigger interrupt 
+                    EIFR  |= (1<<TRIG_INT_FLAG); 
+                    EIMSK |= (1<<TRIG_INT);
+                }
+                else {
+                    EIMSK &= ~(1<<TRIG_INT);
+                }
             }
             return;
         }
     }
 }
 
+// ------------------------------------------------------------
+// Function: Set_Accel
+//
+// Purpose: Sets the velocity mode acceleration in indices/sec**2.
+// A value of zero disables acceleration limiting, in which case
+// velocity set-point changes take effect immediately.
+//
+// ------------------------------------------------------------
+static void Set_Accel(uint32_t Accel)
+{
+    Accel = Accel <= ACCEL_MAX ? Accel : ACCEL_MAX;
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        Ramp.Accel = Accel;
+    }
+    return;
+}
+
 // ------------------------------------------------------------
 // Function: Set_Pos_SetPt
 //
@@ -674,6 +2186,39 @@ static void Set_Pos_SetPt(int32_t Pos)
     return;
 }
 
+// ------------------------------------------------------------
+// Function: Stage_Move
+//
+// Purpose: Stages the next move, position set-point and 
+// positioning velocity, and precomputes its step rate so that 
+// the move can be committed quickly from within the step timer 
+// interrupt. Moves can only be staged in position mode. 
+//
+// Return: TRUE if the move was staged, FALSE otherwise
+//
+// ------------------------------------------------------------
+static uint8_t Stage_Move(int32_t Pos, uint16_t Pos_Vel)
+{
+    uint16_t Vel;
+    Step_Rate_t Rate;
+
+    if (Sys_State.Mode != POS_MODE) {
+        return FALSE;
+    }
+    Vel = Pos_Vel;
+    Vel = Vel >= Min_Vel ? Vel : Min_Vel;
+    Vel = Vel <= Max_Vel ? Vel : Max_Vel;
+    Calc_Step_Rate(Vel, &Rate);
+
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        Staged_Move.Pos_SetPt = Pos;
+        Staged_Move.Pos_Vel = Vel;
+        Staged_Move.Rate = Rate;
+        Staged_Move.Pending = TRUE;
+    }
+    return TRUE;
+}
+
 // -------------------------------------------------------------
 // Function: Set_vel
 //
@@ -750,6 +2295,7 @@ static void Set_Mode(uint8_t Mode)
     if ((Mode == VEL_MODE) || (Mode == POS_MODE)) {
         ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
             Sys_State.Mode = Mode;
+            Staged_Move.Pending = FALSE;
         }
     }
     return;
@@ -795,6 +2341,7 @@ static void Set_Zero_Pos(int32_t Pos)
     ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
         Sys_State.Pos_Mode.Pos_SetPt -= Pos;
         Sys_State.Pos -= Pos;
+        Pos_Trig_Reset();
     }
     return;
 }
@@ -841,6 +2388,136 @@ static uint16_t Get_Top(uint16_t Vel)
     return (uint16_t) top;
 }
 
+// ----------------------------------------------------------------
+// Function: Set_Step_Mode
+//
+// Purpose: Sets the step generation mode. Allowed values are
+// STEP_MODE_FIXED and STEP_MODE_DDS. The new mode takes effect
+// on the next IO update.
+//
+// ----------------------------------------------------------------
+static void Set_Step_Mode(uint8_t Step_Mode)
+{
+    if ((Step_Mode == STEP_MODE_FIXED) || (Step_Mode == STEP_MODE_DDS)) {
+        ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+            Sys_State.Step_Mode = Step_Mode;
+            Step_Rate.Acc = 0;
+        }
+    }
+    return;
+}
+
+// ----------------------------------------------------------------
+// Function: Calc_Step_Rate
+//
+// Purpose: Computes the timer top for the given velocity in 
+// indices/sec. In STEP_MODE_DDS the remainder of the timer period
+// is also computed so that the TIMER3_COMPB_vect interrupt can dither
+// the timer top and produce the exact velocity on average. 
+//
+// ----------------------------------------------------------------
+static void Calc_Step_Rate(uint16_t Vel, volatile Step_Rate_t *Rate)
+{
+    uint16_t timer_top;
+    uint16_t timer_rem;
+
+    if (Vel == 0) {
+        timer_top = TIMER_TOP_MAX;
+        timer_rem = 0;
+    }
+    else if (Sys_State.Step_Mode == STEP_MODE_DDS) {
+        // Integer division gives base period and remainder
+        timer_top = (uint16_t) (TIMER_FREQ/((uint32_t) Vel) - 1);
+        timer_rem = (uint16_t) (TIMER_FREQ%((uint32_t) Vel));
+    }
+    else {
+        timer_top = Get_Top(Vel);
+        timer_rem = 0;
+    }
+
+    // Clamp top - no dithering if outside of allowed range
+    if ((timer_top < TIMER_TOP_MIN) || (timer_top >= TIMER_TOP_MAX)) {
+        timer_rem = 0;
+    }
+    timer_top = timer_top > TIMER_TOP_MIN ? timer_top : TIMER_TOP_MIN;
+    timer_top = timer_top < TIMER_TOP_MAX ? timer_top : TIMER_TOP_MAX;
+
+    Rate->Top = timer_top;
+    Rate->Rem = timer_rem;
+    Rate->Div = Vel;
+    Rate->Acc = 0;
+    return;
+}
+
+// ----------------------------------------------------------------
+// Function: Load_Step_Rate
+//
+// Purpose: Loads the step timer top and pulse width and the phase
+// accumulator from a precomputed step rate. Must be called with 
+// interrupts disabled.
+//
+// ----------------------------------------------------------------
+static void Load_Step_Rate(volatile Step_Rate_t *Rate)
+{
+    // Update clock frequency and pulse width 
+    TIMER_TOP = Rate->Top;
+    TIMER_OCR = Rate->Top/2;
+    // Update phase accumulator
+    Step_Rate.Top = Rate->Top;
+    Step_Rate.Rem = Rate->Rem;
+    if (Step_Rate.Div != Rate->Div) {
+        Step_Rate.Div = Rate->Div;
+        Step_Rate.Acc = 0;
+    }
+    return;
+}
+
+// ----------------------------------------------------------------
+// Function: Set_Step_Rate
+//
+// Purpose: Sets the timer top and pulse width for the given velocity
+// in indices/sec. 
+//
+// ----------------------------------------------------------------
+static void Set_Step_Rate(uint16_t Vel)
+{
+    Step_Rate_t Rate;
+
+    Calc_Step_Rate(Vel, &Rate);
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        Load_Step_Rate(&Rate);
+    }
+    return;
+}
+
+// ----------------------------------------------------------------
+// Function: Get_Eff_Vel
+//
+// Purpose: Gets the effective (average) step rate of the current
+// timer settings in milli-indices/sec. 
+//
+// ----------------------------------------------------------------
+static uint32_t Get_Eff_Vel(void)
+{
+    uint16_t top;
+    uint16_t rem;
+    uint16_t div;
+
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        top = Step_Rate.Top;
+        rem = Step_Rate.Rem;
+        div = Step_Rate.Div;
+    }
+
+    if (rem == 0) {
+        return (1000UL*TIMER_FREQ)/(((uint32_t) top) + 1UL);
+    }
+    else {
+        // Phase accumulator is exact by construction 
+        return 1000UL*((uint32_t) div);
+    }
+}
+
 // ------------------------------------------------------------------
 // Function: Pos_Mode_IO_Update
 //
@@ -852,18 +2529,7 @@ static uint16_t Get_Top(uint16_t Vel)
 // ------------------------------------------------------------------
 static void Pos_Mode_IO_Update(void)
 {
-    uint16_t timer_top;
-
-    // Compute top
-    timer_top = Get_Top(Sys_State.Pos_Mode.Pos_Vel);
-    timer_top = timer_top > TIMER_TOP_MIN ? timer_top : TIMER_TOP_MIN;
-    timer_top = timer_top < TIMER_TOP_MAX ? timer_top : TIMER_TOP_MAX;
-
-    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
-        // Update clock frequency and pulse width 
-        TIMER_TOP = timer_top;
-        TIMER_OCR = timer_top/2;
-    }
+    Set_Step_Rate(Sys_State.Pos_Mode.Pos_Vel);
     return;
 }
 
@@ -877,19 +2543,10 @@ static void Pos_Mode_IO_Update(void)
 // -------------------------------------------------------------------- 
 static void Vel_Mode_IO_Update(void)
 {
-    uint16_t Vel;
-    uint16_t timer_top;
-
-    // Compute top
-    timer_top = Get_Top(Sys_State.Vel_Mode.Vel_SetPt);
-    timer_top = timer_top > TIMER_TOP_MIN ? timer_top : TIMER_TOP_MIN;
-    timer_top = timer_top < TIMER_TOP_MAX ? timer_top : TIMER_TOP_MAX;
-
-    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
-        // Sys_State.Dir = Sys_State.Vel_Mode.Dir_SetPt;
-        // Update clock frequency and pulse width 
-        TIMER_TOP = timer_top;
-        TIMER_OCR = timer_top/2;
+    // When the velocity ramp is active the Vel_Ramp task sets the 
+    // step timer.
+    if (Ramp.Accel == 0) {
+        Set_Step_Rate(Sys_State.Vel_Mode.Vel_SetPt);
     }
     return;
 }
@@ -910,6 +2567,11 @@ ISR(TIMER3_OVF_vect) {
         else {
             Sys_State.Pos -= (int32_t)1;
         }
+
+        // Position compare triggers
+        if (Pos_Trig.Mode != POS_TRIG_OFF) {
+            Pos_Trig_Update();
+        }
     }
 
     return;
@@ -921,6 +2583,7 @@ ISR(TIMER3_OVF_vect) {
 ISR(TIMER3_COMPB_vect) {
     uint16_t Vel;
     int32_t Pos_Err;
+    uint8_t Dir_Prev = Sys_State.Dir;
 
     // Set Clock dio line low 
     CLK_DIR_PORT &= ~(1 << CLK_PORT_PIN);
@@ -930,6 +2593,17 @@ ISR(TIMER3_COMPB_vect) {
         // on the position error. 
         Pos_Err = Sys_State.Pos_Mode.Pos_SetPt - Sys_State.Pos;
 
+        // Commit staged move as soon as the current move is done
+        if ((Pos_Err == 0) && (Staged_Move.Pending == TRUE) && 
+                (Sys_State.Status == RUNNING)) {
+            Sys_State.Pos_Mode.Pos_SetPt = Staged_Move.Pos_SetPt;
+            Sys_State.Pos_Mode.Pos_Vel = Staged_Move.Pos_Vel;
+            Load_Step_Rate(&Staged_Move.Rate);
+            Staged_Move.Pending = FALSE;
+            Push_Event(EVENT_NEXT_MOVE, POS_MODE);
+            Pos_Err = Sys_State.Pos_Mode.Pos_SetPt - Sys_State.Pos;
+        }
+
         // Set Direction
         if (Pos_Err > 0) {
             Sys_State.Dir = DIR_POS;
@@ -941,6 +2615,9 @@ ISR(TIMER3_COMPB_vect) {
         // Set Velocity
         if (Pos_Err == 0) {
             Vel = 0;
+            if ((Sys_State.Vel > 0) && (Sys_State.Status == RUNNING)) {
+                Push_Event(EVENT_MOVE_DONE, POS_MODE);
+            }
         }
         else {
             Vel = Sys_State.Pos_Mode.Pos_Vel;
@@ -948,9 +2625,15 @@ ISR(TIMER3_COMPB_vect) {
     } 
     else {
         // In velocity mode set the velocity based on the velocity
-        // set point.
-        Vel = Sys_State.Vel_Mode.Vel_SetPt;
-        Sys_State.Dir = Sys_State.Vel_Mode.Dir_SetPt;
+        // set point, or on the ramp output if the ramp is active.
+        if (Ramp.Accel == 0) {
+            Vel = Sys_State.Vel_Mode.Vel_SetPt;
+            Sys_State.Dir = Sys_State.Vel_Mode.Dir_SetPt;
+        }
+        else {
+            Vel = Ramp.Vel_Out;
+            Sys_State.Dir = Ramp.Dir_Out;
+        }
         // Set velocity trigger - this is/was used in Peter and Marie's 
         // experiments so I've kept it in case they need it. 
         if (Vel > 0) {
@@ -973,11 +2656,130 @@ ISR(TIMER3_COMPB_vect) {
     if ((Sys_State.Status == RUNNING) && (Vel > 0)) {
         Sys_State.Clk = CLK_ON;
         Sys_State.Vel = Vel;
+        if (Sys_State.Dir != Dir_Prev) {
+            Push_Event(EVENT_DIR_CHANGE, Sys_State.Dir);
+        }
     }
     else {
         Sys_State.Clk = CLK_OFF;
         Sys_State.Vel = 0;
     }
+
+    // Phase accumulator - choose the length of the next step period so 
+    // that the average step rate is exact. TIMER_TOP is double buffered 
+    // so the new value takes effect at the start of the next period.
+    if ((Sys_State.Step_Mode == STEP_MODE_DDS) && (Step_Rate.Rem != 0)) {
+        if (Step_Rate.Acc >= Step_Rate.Div - Step_Rate.Rem) {
+            Step_Rate.Acc -= Step_Rate.Div - Step_Rate.Rem;
+            TIMER_TOP = Step_Rate.Top + 1;
+        }
+        else {
+            Step_Rate.Acc += Step_Rate.Rem;
+            TIMER_TOP = Step_Rate.Top;
+        }
+    }
+    return;
+}
+
+// -------------------------------------------------------------------
+// Device clock overflow - extend clock to 32 bits
+// -------------------------------------------------------------------
+ISR(CLOCK_OVF_VECT) {
+    Clock_Hi++;
+    return;
+}
+
+// -------------------------------------------------------------------
+// End of position trigger pulse
+// -------------------------------------------------------------------
+ISR(POS_TRIG_VECT) {
+    DIO_PORT &= ~(1 << dio_port_pins[Pos_Trig.Pin]);
+    CLOCK_TIMSK &= ~(1 << POS_TRIG_OCIE);
+    return;
+}
+
+// -------------------------------------------------------------------
+// DIO pattern timer - advance to next pattern entry
+// -------------------------------------------------------------------
+ISR(DIO_PAT_VECT) {
+    if (DIO_Pat.Remain > 0) {
+        // Long entry - not done yet
+        DIO_Pat_Schedule(DIO_Pat.Remain);
+        return;
+    }
+
+    DIO_Pat.Idx++;
+    if (DIO_Pat.Idx >= DIO_Pat.Num) {
+        DIO_Pat.Idx = 0;
+        if (DIO_Pat.Repeat != DIO_PAT_FOREVER) {
+            DIO_Pat.Repeat--;
+        }
+        if (DIO_Pat.Repeat == 0) {
+            // Done - last entry is left on the port
+            DIO_Pat.Playing = FALSE;
+            CLOCK_TIMSK &= ~(1 << DIO_PAT_OCIE);
+            Push_Event(EVENT_DIO_PAT_DONE, 0);
+            return;
+        }
+    }
+    DIO_PORT = (DIO_PORT & ~DIO_PORT_MASK) | DIO_Pat.Port[DIO_Pat.Idx];
+    DIO_Pat_Schedule(DIO_Pat.Duration[DIO_Pat.Idx]);
+    return;
+}
+
+// -------------------------------------------------------------------
+// Input capture - record edges on enabled capture pins
+// -------------------------------------------------------------------
+ISR(CAPTURE_VECT) {
+    uint8_t pins;
+    uint8_t changed;
+    uint8_t head;
+    uint8_t i;
+    uint32_t time;
+
+    time = Get_Clock();
+    pins = CAPTURE_INP_REG;
+    changed = (pins ^ Capture_FIFO.Prev) & Capture_FIFO.Mask;
+    Capture_FIFO.Prev = pins;
+
+    for (i=0; i<8; i++) {
+        if (changed & (1 << i)) {
+            head = (Capture_FIFO.Head + 1) & CAPTURE_FIFO_MASK;
+            if (head == Capture_FIFO.Tail) {
+                if (Capture_FIFO.Dropped < 0xff) {
+                    Capture_FIFO.Dropped++;
+                }
+            }
+            else {
+                Capture_FIFO.Buffer[Capture_FIFO.Head].Pin = i;
+                Capture_FIFO.Buffer[Capture_FIFO.Head].Edge = (pins >> i) & 1;
+                Capture_FIFO.Buffer[Capture_FIFO.Head].Time = time;
+                Capture_FIFO.Buffer[Capture_FIFO.Head].Pos = Sys_State.Pos;
+                Capture_FIFO.Head = head;
+            }
+        }
+    }
+    return;
+}
+
+// -------------------------------------------------------------------
+// Ramp timer tick
+// -------------------------------------------------------------------
+ISR(RAMP_TIMER_VECT) {
+    if (Ramp.Ticks < 0xff) {
+        Ramp.Ticks++;
+    }
+    return;
+}
+
+// -----------------------------------------------------------------
+// Function: ISR(INT1_vect)
+//
+// Purpose: Trigger interrupt. Starts the device if it is ARMED.
+//
+// -----------------------------------------------------------------
+ISR(TRIG_INT_VECT) {
+    Trig_Start();
     return;
 }
 
@@ -988,19 +2790,51 @@ ISR(TIMER3_COMPB_vect) {
 // enabled then an interrupt will changes the status of the device
 // to STOPPED. In addition when in velocity mode the velocity set
 // point will be set to zero, when in position mode the position 
-// set point will be set to the current position. 
+// set point will be set to the current position. In both the 
+// ENABLED and EXT_INT_LATCH modes the position and time of the 
+// edge are added to the latch FIFO. 
 //
 // -----------------------------------------------------------------
 ISR(EXT_INT_VECT) {
+    if (HOME_ACTIVE(Home.State)) {
+        // Homing - latch edge and stop during approaches, otherwise 
+        // ignore the interrupt (e.g. switch bounce during back off).
+        if ((Home.State == HOME_FAST) || (Home.State == HOME_SLOW)) {
+            if (Home.Edge == FALSE) {
+                Home.Edge_Pos = Sys_State.Pos;
+                Home.Edge = TRUE;
+                Sys_State.Status = STOPPED;
+                Sys_State.Clk = CLK_OFF;
+                Sys_State.Vel_Mode.Vel_SetPt = 0;
+                Ramp.Vel = 0;
+                Ramp.Vel_Out = 0;
+            }
+        }
+        return;
+    }
+    if (Prog.State == PROG_RUNNING) {
+        Prog.Edge = TRUE;
+    }
+    if (Sys_State.Ext_Int != DISABLED) {
+        // Latch position before anything else
+        Push_Latch();
+    }
+    if (Sys_State.Ext_Int == EXT_INT_LATCH) {
+        Push_Event(EVENT_LATCH, Sys_State.Mode);
+    }
     if (Sys_State.Ext_Int==ENABLED) {
+        Push_Event(EVENT_EXT_INT_STOP, Sys_State.Mode);
         Sys_State.Status = STOPPED;
         Sys_State.Clk = CLK_OFF;
+        Staged_Move.Pending = FALSE;
         if (Sys_State.Mode == POS_MODE) {
             Sys_State.Pos_Mode.Pos_SetPt = Sys_State.Pos;
             //Pos_Mode_IO_Update();
         }
         if (Sys_State.Mode == VEL_MODE) {
             Sys_State.Vel_Mode.Vel_SetPt = 0;
+            Ramp.Vel = 0;
+            Ramp.Vel_Out = 0;
             //Vel_Mode_IO_Update();
         }
     }
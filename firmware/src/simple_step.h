@@ -35,10 +35,13 @@ Author: Will Dickson
 #define _SIMPLE_STEP_H_
 
 #include <math.h>
+#include <stddef.h>
 #include <avr/io.h>
 #include <avr/interrupt.h>
 #include <avr/wdt.h>
+#include <avr/eeprom.h>
 #include <util/atomic.h>
+#include <util/delay.h>
 #include "descriptors.h"
 #include <MyUSB/Version.h>          // Library Version Information
 #include <MyUSB/Common/ButtLoadTag.h>   // PROGMEM tags readable by the ButtLoad project
@@ -72,6 +75,37 @@ Author: Will Dickson
 #define USB_CMD_SET_DIO_LO      22
 #define USB_CMD_GET_EXT_INT     23
 #define USB_CMD_SET_EXT_INT     24
+#define USB_CMD_SET_STEP_MODE   25
+#define USB_CMD_GET_STEP_MODE   26
+#define USB_CMD_GET_EFF_VEL     27
+#define USB_CMD_SET_ACCEL       28
+#define USB_CMD_GET_ACCEL       29
+#define USB_CMD_FIRE_TRIG       30
+#define USB_CMD_GET_CLOCK       31
+#define USB_CMD_GET_STAGED      32
+#define USB_CMD_SET_POS_TRIG    33
+#define USB_CMD_SET_POS_TRIG_CFG 34
+#define USB_CMD_GET_POS_TRIG_CNT 35
+#define USB_CMD_GET_LATCH_CNT   36
+#define USB_CMD_GET_LATCH_TIME  37
+#define USB_CMD_GET_LATCH_POS   38
+#define USB_CMD_SET_HOME_PARAM  39
+#define USB_CMD_START_HOME      40
+#define USB_CMD_GET_HOME_STATE  41
+#define USB_CMD_SET_DIO_PORT    42
+#define USB_CMD_GET_DIO_PORT    43
+#define USB_CMD_SET_DIO_PAT     44
+#define USB_CMD_PLAY_DIO_PAT    45
+#define USB_CMD_GET_DIO_PAT     46
+#define USB_CMD_SET_CAPTURE     47
+#define USB_CMD_READ_CAPTURE    48
+#define USB_CMD_SET_PROG        49
+#define USB_CMD_RUN_PROG        50
+#define USB_CMD_GET_PROG        51
+#define USB_CMD_GET_BUILD_ID    52
+#define USB_CMD_SAVE_CONFIG     53
+#define USB_CMD_LOAD_CONFIG     54
+#define USB_CMD_STAGE_MOVE      55
 #define USB_CMD_AVR_RESET      200
 #define USB_CMD_AVR_DFU_MODE   201
 #define USB_CMD_TEST           251
@@ -79,6 +113,12 @@ Author: Will Dickson
 #define TRUE  1
 #define FALSE 0
 
+// Build identifier - the Makefile includes the generated build_id.h 
+// in every source file. Builds without it report 0.
+#ifndef BUILD_ID
+#define BUILD_ID 0L
+#endif
+
 // Clock and Direction states
 #define CLK_ON 1
 #define CLK_OFF 0
@@ -103,6 +143,11 @@ Author: Will Dickson
 #define DIR_NEG 1
 #define DEFAULT_DIR DIR_POS
 
+// Step generation modes
+#define STEP_MODE_FIXED 0  // One step per timer period, period = TOP+1
+#define STEP_MODE_DDS   1  // Phase accumulator dithers TOP for exact rate
+#define DEFAULT_STEP_MODE STEP_MODE_FIXED
+
 // Default positioning velocity 
 #define DEFAULT_POS_VEL 5000
 
@@ -113,6 +158,9 @@ Author: Will Dickson
 // Prescaler for pwm timer
 #define TIMER_PRESCALER 8
 
+// Timer clock frequency (Hz)
+#define TIMER_FREQ (F_CPU/TIMER_PRESCALER)
+
 // Max and min values allowed for the timer.
 // Sets the min and max frequencies.
 #define TIMER_TOP_MIN 19      // 19 => 50kHz
@@ -122,6 +170,36 @@ Author: Will Dickson
 #define TIMER_TOP OCR3A  // Using OCR3A gives double buffering of top  
 #define TIMER_OCR OCR3B  // Sets PWM (Clock) high time
 
+// Velocity mode acceleration (indices/sec**2). Zero disables the
+// firmware velocity ramp, i.e., velocity changes are instantaneous.
+#define DEFAULT_ACCEL 0
+#define ACCEL_MAX 1000000
+
+// Ramp timer - Timer0 in CTC mode generates the velocity ramp tick
+#define RAMP_TICK_FREQ 1000  // Hz, must be 1000 - Accel is added per tick 
+#define RAMP_TIMER_PRESCALER 64
+#define RAMP_TIMER_TOP (F_CPU/(RAMP_TIMER_PRESCALER*RAMP_TICK_FREQ) - 1)
+#define RAMP_TIMER_TCCRA TCCR0A
+#define RAMP_TIMER_TCCRB TCCR0B
+#define RAMP_TIMER_OCR OCR0A
+#define RAMP_TIMER_TIMSK TIMSK0
+#define RAMP_TIMER_OCIE OCIE0A
+#define RAMP_TIMER_VECT TIMER0_COMPA_vect
+
+// Device clock - Timer1 free running w/ prescaler 8. The overflow 
+// interrupt extends the count to 32 bits. With F_CPU = 8MHz the clock 
+// counts microseconds and wraps every 71.6 minutes.
+#define CLOCK_PRESCALER 8
+#define CLOCK_FREQ (F_CPU/CLOCK_PRESCALER)
+#define CLOCK_TCCRA TCCR1A
+#define CLOCK_TCCRB TCCR1B
+#define CLOCK_TCNT TCNT1
+#define CLOCK_TIMSK TIMSK1
+#define CLOCK_TOIE TOIE1
+#define CLOCK_TIFR TIFR1
+#define CLOCK_TOV TOV1
+#define CLOCK_OVF_VECT TIMER1_OVF_vect
+
 // Timer control registers
 #define TIMER_TCCRA TCCR3A
 #define TIMER_TCCRB TCCR3B
@@ -142,6 +220,7 @@ Author: Will Dickson
 #define DIR_PORT_PIN PC4 
 
 // States for run status flag
+#define ARMED   2  // Waiting for trigger edge, then RUNNING
 #define RUNNING 1
 #define STOPPED 0
 #define DEFAULT_STATUS STOPPED
@@ -173,6 +252,7 @@ Author: Will Dickson
 // DIO PORT
 #define DIO_PORT PORTA
 #define DIO_PORT_PINS {PA0,PA1,PA2,PA3,PA4,PA5,PA6,PA7}
+#define DIO_PORT_MASK 0xff  // Port bits of all DIO_PORT_PINS 
 
 ////////////////////////////////////////////////////////////////// 
 // DEBUG --
@@ -185,6 +265,15 @@ Author: Will Dickson
 #define EXT_INT_HI2LO 0
 #define EXT_INT_LO2HI 1
 
+// External interrupt latch-only mode. The position is latched on each
+// external interrupt edge but the motor is not stopped. (In the ENABLED
+// mode the position is latched and the motor is stopped.)
+#define EXT_INT_LATCH 2
+
+// Latch FIFO size - must be a power of 2
+#define LATCH_FIFO_SIZE 8
+#define LATCH_FIFO_MASK (LATCH_FIFO_SIZE-1)
+
 // External interrupt
 #define EXT_INT INT0
 #define EXT_INT_FLAG INTF0
@@ -203,6 +292,148 @@ Author: Will Dickson
 // External interupt polarity (EXT_INT_HI2LO or EXT_INT_LO2HI)
 #define EXT_INT_POLARITY EXT_INT_HI2LO 
 
+// Trigger external interrupt. Used to start armed devices at the same
+// time. A rising edge on the trigger pin changes the status of an ARMED
+// device to RUNNING. 
+#define TRIG_INT INT1
+#define TRIG_INT_FLAG INTF1
+#define TRIG_INT_VECT INT1_vect
+
+// Trigger DDR register, and DDR pin
+#define TRIG_INT_DDR DDRD
+#define TRIG_INT_DDR_PIN DDD1
+
+// Trigger port and pin
+#define TRIG_INT_OUT_REG PORTD
+#define TRIG_INT_OUT_PIN PD1
+
+// Width of the trigger pulse sent by USB_CMD_FIRE_TRIG (us)
+#define TRIG_PULSE_WIDTH 10
+
+// Step timer counter - reset when triggered 
+#define TIMER_TCNT TCNT3
+
+// Position compare triggers. Trigger positions are uploaded, in 
+// increasing order, one per USB_CMD_SET_POS_TRIG packet with the table
+// index in the Aux field. 
+#define POS_TRIG_TABLE_SIZE 128
+#define POS_TRIG_OFF    0   // Position triggers disabled
+#define POS_TRIG_PULSE  1   // Pulse DIO pin at trigger positions
+#define POS_TRIG_TOGGLE 2   // Toggle DIO pin at trigger positions
+#define POS_TRIG_WIDTH_MIN 20 // Minimum pulse width (us)
+
+// Position trigger pulse width timer - output compare A of the device 
+// clock, which counts microseconds.
+#define POS_TRIG_OCR OCR1A
+#define POS_TRIG_OCIE OCIE1A
+#define POS_TRIG_OCF OCF1A
+#define POS_TRIG_VECT TIMER1_COMPA_vect
+
+// DIO pattern playback. Pattern entries are uploaded, in order, one 
+// per USB_CMD_SET_DIO_PAT packet with the table index in the Aux field
+// and the entry, (Duration << 8) | Mask, in the data field. Durations
+// are in device clock ticks (us).
+#define DIO_PAT_TABLE_SIZE 64
+#define DIO_PAT_DURATION_MIN 20        // (us)
+#define DIO_PAT_DURATION_MAX 0xffffff  // (us)
+#define DIO_PAT_FOREVER 0xffff         // Repeat count for endless play
+#define DIO_PAT_STEP_MAX 0x8000        // Max. compare step (us)
+
+// DIO pattern timer - output compare B of the device clock
+#define DIO_PAT_OCR OCR1B
+#define DIO_PAT_OCIE OCIE1B
+#define DIO_PAT_OCF OCF1B
+#define DIO_PAT_VECT TIMER1_COMPB_vect
+
+// Digital input capture. Edges on the enabled pins of the capture port
+// are recorded, with the device clock and motor position, by the pin 
+// change interrupt. Records are sent to the host on the capture bulk 
+// in endpoint, CAPTURE_RECS_PER_PACKET records per packet, after a 
+// USB_CMD_READ_CAPTURE command. 
+#define CAPTURE_DDR DDRB
+#define CAPTURE_PORT PORTB
+#define CAPTURE_INP_REG PINB
+#define CAPTURE_PCMSK PCMSK0
+#define CAPTURE_PCIE PCIE0
+#define CAPTURE_PCIF PCIF0
+#define CAPTURE_VECT PCINT0_vect
+
+// Capture FIFO size - must be a power of 2
+#define CAPTURE_FIFO_SIZE 32
+#define CAPTURE_FIFO_MASK (CAPTURE_FIFO_SIZE-1)
+#define CAPTURE_RECS_PER_PACKET 6
+
+// Motion program interpreter. Instructions are uploaded, in order, one
+// per USB_CMD_SET_PROG packet with (Op << 8) | Index in the Aux field 
+// and the argument in the data field. 
+#define PROG_TABLE_SIZE 64
+#define PROG_MAX_STEPS  8    // Max. instructions executed per task call 
+
+// Motion program opcodes
+#define PROG_OP_END       0  // End of program
+#define PROG_OP_MOVE      1  // Position mode move to Arg
+#define PROG_OP_MOVE_REL  2  // Position mode move by Arg from set-point
+#define PROG_OP_SET_VEL   3  // Set positioning velocity to Arg
+#define PROG_OP_WAIT_DONE 4  // Wait until move is complete
+#define PROG_OP_WAIT_US   5  // Wait Arg us 
+#define PROG_OP_DIO_SET   6  // Set DIO pins in (Arg >> 8) to (Arg & 0xff)
+#define PROG_OP_WAIT_EXT_INT 7 // Wait for external interrupt edge
+#define PROG_OP_LOOP      8  // Jump to (Arg & 0xff), (Arg >> 8) times
+#define PROG_OP_MAX       PROG_OP_LOOP
+
+// Motion program states
+#define PROG_STOPPED 0       // Not run 
+#define PROG_RUNNING 1       // Running
+#define PROG_DONE    2       // Program reached end 
+#define PROG_ABORTED 3       // Stopped by host or motor stopped early
+
+// Homing sequence states 
+#define HOME_NONE     0   // Not homed 
+#define HOME_FAST     1   // Fast approach to external interrupt edge
+#define HOME_BACKOFF  2   // Back off from edge
+#define HOME_SLOW     3   // Slow re-approach to edge
+#define HOME_PARK     4   // Position zeroed at edge - move off switch
+#define HOME_DONE     5   // Homing complete
+#define HOME_ABORTED  6   // Homing stopped by host or failed
+#define HOME_BUSY     7   // Not started - motion program running. Only
+                          // returned by USB_CMD_START_HOME
+#define HOME_ACTIVE(State) (((State) >= HOME_FAST) && ((State) <= HOME_PARK))
+
+// Homing parameter IDs - sent in the Aux field of USB_CMD_SET_HOME_PARAM
+#define HOME_PARAM_FAST_VEL 0
+#define HOME_PARAM_SLOW_VEL 1
+#define HOME_PARAM_BACKOFF  2
+
+// Default homing parameters
+#define DEFAULT_HOME_FAST_VEL 2000  // (indices/sec)
+#define DEFAULT_HOME_SLOW_VEL 100   // (indices/sec)
+#define DEFAULT_HOME_BACKOFF  200   // (indices)
+
+// Configuration block saved in EEPROM and applied at start up. The 
+// block is valid when Magic and Version match and the checksum is 
+// correct - erased EEPROM reads 0xff and is never valid. 
+#define CONFIG_MAGIC   0x5353 // 'SS'
+#define CONFIG_VERSION 1
+
+// Data values for USB_CMD_SAVE_CONFIG
+#define CONFIG_ERASE 0        // Invalidate saved configuration
+#define CONFIG_SAVE  1        // Save current configuration
+
+// Event IDs for event records sent on the interrupt in endpoint
+#define EVENT_EXT_INT_STOP 0  // External interrupt stopped the motor
+#define EVENT_MOVE_DONE    1  // Position mode move completed
+#define EVENT_DIR_CHANGE   2  // Motor direction reversed while running
+#define EVENT_TRIG_START   3  // Armed device started by trigger
+#define EVENT_NEXT_MOVE    4  // Staged move committed
+#define EVENT_LATCH        5  // Position latched w/o stopping
+#define EVENT_HOME_DONE    6  // Homing sequence finished
+#define EVENT_DIO_PAT_DONE 7  // DIO pattern playback finished
+#define EVENT_PROG_DONE    8  // Motion program finished
+
+// Event FIFO size - must be a power of 2
+#define EVENT_FIFO_SIZE 16
+#define EVENT_FIFO_MASK (EVENT_FIFO_SIZE-1)
+
 // Software reset 
 #define AVR_RESET() wdt_enable(WDTO_30MS); while(1) {}
 #define AVR_IS_WDT_RESET()  ((MCUSR&(1<<WDRF)) ? 1:0)
@@ -221,12 +452,48 @@ typedef union {
     int32_t  int32_t;
 } Data_t;
 
-// USB packet structure
+// USB packet structure. For bulk in packets Aux holds the lower 16 
+// bits of the device clock at the time the command was processed.
 typedef struct {
     Header_t Header;
     Data_t   Data;
+    uint16_t Aux;
 } USB_InOut_t; 
 
+// Event record structure 
+typedef struct {
+    uint8_t  Event_ID;     // Event ID
+    uint8_t  Arg;          // Event argument, e.g. new direction
+    int32_t  Pos;          // Motor position at time of event
+    uint16_t Stamp;        // Lower 16 bits of device clock 
+} Event_t;
+
+// Event FIFO structure. Events are added in the interrupt routines
+// and removed by the USB_Send_Event task.
+typedef struct {
+    Event_t  Buffer[EVENT_FIFO_SIZE];
+    uint8_t  Head;         // Index of next event added
+    uint8_t  Tail;         // Index of next event sent
+    uint8_t  Dropped;      // Number of events dropped - FIFO full
+} Event_FIFO_t;
+
+// Latch record structure
+typedef struct {
+    int32_t  Pos;          // Motor position at external interrupt edge
+    uint32_t Time;         // Device clock at external interrupt edge
+} Latch_t;
+
+// Latch FIFO structure. Latches are added in the external interrupt
+// routine and removed by USB_CMD_GET_LATCH_POS, which copies the whole
+// record to Latch_Last with interrupts disabled. USB_CMD_GET_LATCH_TIME
+// then returns the time from Latch_Last so the position and time of a
+// latch always belong together. 
+typedef struct {
+    Latch_t  Buffer[LATCH_FIFO_SIZE];
+    uint8_t  Head;         // Index of next latch added
+    uint8_t  Tail;         // Index of next latch removed
+} Latch_FIFO_t;
+
 // Position mode parameter structure
 typedef struct {
     int32_t   Pos_SetPt;   // Set-point motor position 
@@ -239,6 +506,136 @@ typedef struct {
     uint8_t   Dir_SetPt;   // Set-point direction   
 } Vel_Mode_t;
 
+// Step rate structure. In STEP_MODE_DDS the timer period alternates
+// between Top+1 and Top+2 timer counts. The phase accumulator, Acc, is 
+// advanced by Rem (= TIMER_FREQ % Vel) every step and wraps at Div (= Vel)
+// so that the average step rate is exactly Vel. 
+typedef struct {
+    uint16_t Top;          // Base timer top 
+    uint16_t Rem;          // Phase increment
+    uint16_t Div;          // Phase modulus 
+    uint16_t Acc;          // Phase accumulator 
+} Step_Rate_t;
+
+// Position compare trigger structure. Idx is the index of the first 
+// table position >= the motor position. It is maintained by the step 
+// timer interrupt so that each step requires only a single comparison.
+typedef struct {
+    int32_t  Pos[POS_TRIG_TABLE_SIZE]; // Trigger positions (increasing)
+    uint8_t  Num;          // Number of positions in the table
+    uint8_t  Idx;          // Index of first position >= motor position 
+    uint8_t  Pin;          // DIO pin 
+    uint8_t  Mode;         // POS_TRIG_OFF, POS_TRIG_PULSE or POS_TRIG_TOGGLE
+    uint16_t Width;        // Pulse width (us)
+    uint16_t Count;        // Number of triggers fired
+} Pos_Trig_t;
+
+// Input capture record structure
+typedef struct {
+    uint8_t  Pin;          // Capture port pin 
+    uint8_t  Edge;         // New pin value, 1 = rising, 0 = falling
+    uint32_t Time;         // Device clock at edge
+    int32_t  Pos;          // Motor position at edge
+} Capture_t;
+
+// Input capture FIFO structure. Records are added in the pin change
+// interrupt routine and removed by the USB_Send_Capture task.
+typedef struct {
+    Capture_t Buffer[CAPTURE_FIFO_SIZE];
+    uint8_t  Head;         // Index of next record added
+    uint8_t  Tail;         // Index of next record sent
+    uint8_t  Dropped;      // Number of records dropped - FIFO full
+    uint8_t  Mask;         // Enabled pins
+    uint8_t  Prev;         // Previous pin values
+    uint8_t  Send;         // Number of records to send to the host
+} Capture_FIFO_t;
+
+// DIO pattern structure. Each entry sets the DIO port to Mask and 
+// holds it for Duration us. Durations longer than the compare timer
+// range are timed in steps of at most DIO_PAT_STEP_MAX. The masks are
+// stored as DIO port register bits so that the timer interrupt can 
+// write them directly.
+typedef struct {
+    uint8_t  Port[DIO_PAT_TABLE_SIZE];     // DIO port register bits
+    uint32_t Duration[DIO_PAT_TABLE_SIZE]; // Durations (us) 
+    uint8_t  Num;          // Number of entries in the table
+    uint8_t  Idx;          // Index of entry being played
+    uint8_t  Playing;      // TRUE while playing
+    uint16_t Repeat;       // Remaining number of plays 
+    uint32_t Remain;       // Remaining time of current entry (us)
+} DIO_Pat_t;
+
+// Motion program structure. Loop counts are kept per instruction so
+// that loops may be nested.
+typedef struct {
+    uint8_t  Op[PROG_TABLE_SIZE];  // Opcodes
+    int32_t  Arg[PROG_TABLE_SIZE]; // Arguments
+    uint16_t Cnt[PROG_TABLE_SIZE]; // Loop counters
+    uint8_t  Num;          // Number of instructions in the table
+    uint8_t  PC;           // Index of current instruction
+    uint8_t  State;        // Program state
+    uint8_t  Wait;         // TRUE while current instruction is waiting
+    uint8_t  Edge;         // TRUE when external interrupt edge detected
+    uint32_t Wait_Start;   // Device clock at start of wait (us)
+} Prog_t;
+
+// Homing sequence structure. The motor approaches the external 
+// interrupt edge quickly, backs off, and re-approaches slowly. The 
+// position latched at the slow edge becomes the zero position and the
+// motor is then parked Backoff indices away from the edge. The mode, 
+// positioning velocity and velocity mode set-points in use when homing 
+// starts are restored when it finishes.
+typedef struct {
+    uint8_t  State;        // Homing state
+    uint8_t  Dir;          // Direction of the home switch
+    uint8_t  Edge;         // TRUE when edge detected
+    int32_t  Edge_Pos;     // Position latched at edge
+    uint16_t Fast_Vel;     // Fast approach velocity (indices/sec)
+    uint16_t Slow_Vel;     // Slow approach velocity (indices/sec)
+    uint16_t Backoff;      // Back off distance (indices)
+    uint8_t  Mode;         // Saved operating mode
+    uint16_t Pos_Vel;      // Saved positioning velocity
+    uint16_t Vel_SetPt;    // Saved velocity mode set-point
+    uint8_t  Dir_SetPt;    // Saved velocity mode direction set-point
+} Home_t;
+
+// Staged move structure. In position mode USB_CMD_STAGE_MOVE, with the 
+// position set-point in the data field and the positioning velocity in 
+// the Aux field, stages a move here which is committed by the 
+// TIMER3_COMPB_vect interrupt as soon as the current move completes. 
+// The step rate is computed when the move is staged. 
+typedef struct {
+    int32_t     Pos_SetPt; // Staged position set-point
+    uint16_t    Pos_Vel;   // Staged positioning velocity
+    Step_Rate_t Rate;      // Step rate for staged positioning velocity
+    uint8_t     Pending;   // TRUE if a move is staged
+} Staged_Move_t;
+
+// Velocity ramp structure. When Accel is nonzero the Vel_Ramp task 
+// slews Vel toward the signed velocity set-point and the step timer 
+// interrupts use Vel_Out and Dir_Out in place of the velocity mode 
+// set-points.
+typedef struct {
+    uint32_t Accel;        // Acceleration (indices/sec**2)
+    int32_t  Vel;          // Signed ramp velocity (milli-indices/sec)
+    uint16_t Vel_Out;      // Ramp output velocity (indices/sec)
+    uint8_t  Dir_Out;      // Ramp output direction
+    uint8_t  Ticks;        // Ramp ticks since last update
+} Ramp_t;
+
+// Configuration block structure - the start up defaults saved in EEPROM
+typedef struct {
+    uint16_t Magic;        // CONFIG_MAGIC when valid
+    uint8_t  Version;      // CONFIG_VERSION
+    uint8_t  Mode;         // Operating mode
+    uint16_t Pos_Vel;      // Positioning velocity (indices/sec)
+    uint8_t  Enable;       // Motor enable pin
+    uint8_t  Ext_Int;      // External interrupts
+    uint8_t  Step_Mode;    // Step generation mode
+    uint32_t Accel;        // Acceleration (indices/sec**2)
+    uint8_t  Check;        // Checksum - complement of the sum of the bytes above
+} Config_t;
+
 // Sytem state structure
 typedef struct {
     uint8_t    Mode;        // Operating mode
@@ -249,14 +646,21 @@ typedef struct {
     Vel_Mode_t Vel_Mode;    // Velocity mode parameters
     uint8_t    Status;      // Motor status (RUNNING or STOPPED)
     uint8_t    Enable;      // Motor enable pin 
-    uint8_t    Ext_Int;     // External interrupts (ENABLED or DISABLED)
+    uint8_t    Ext_Int;     // External interrupts (ENABLED, EXT_INT_LATCH or DISABLED)
     uint8_t    Clk;         // Clock (ON or OFF)
+    uint8_t    Step_Mode;   // Step generation mode (FIXED or DDS)
 } Sys_State_t;
 
 /// Global variables
 USB_InOut_t USB_Out; 
 USB_InOut_t USB_In; 
 const uint8_t dio_port_pins[] = DIO_PORT_PINS;
+volatile uint16_t Clock_Hi = 0;
+volatile Event_FIFO_t Event_FIFO;
+volatile Latch_FIFO_t Latch_FIFO;
+volatile Latch_t Latch_Last;
+
+Config_t EE_Config EEMEM;
 
 volatile Sys_State_t Sys_State = {
     Mode:      DEFAULT_MODE, 
@@ -269,10 +673,75 @@ volatile Sys_State_t Sys_State = {
     Enable:    ENABLED,
     Ext_Int:   DISABLED,
     Clk:       DEFAULT_CLK,
+    Step_Mode: DEFAULT_STEP_MODE,
+};
+
+volatile Step_Rate_t Step_Rate = {
+    Top: TIMER_TOP_MAX,
+    Rem: 0,
+    Div: 0,
+    Acc: 0,
+};
+
+volatile Staged_Move_t Staged_Move = {
+    Pos_SetPt: DEFAULT_POS,
+    Pos_Vel:   DEFAULT_POS_VEL,
+    Rate:      {Top: TIMER_TOP_MAX, Rem: 0, Div: 0, Acc: 0},
+    Pending:   FALSE,
+};
+
+volatile Capture_FIFO_t Capture_FIFO;
+
+volatile DIO_Pat_t DIO_Pat = {
+    Num:     0,
+    Idx:     0,
+    Playing: FALSE,
+    Repeat:  0,
+    Remain:  0,
+};
+
+volatile Prog_t Prog = {
+    Num:   0,
+    PC:    0,
+    State: PROG_STOPPED,
+    Wait:  FALSE,
+    Edge:  FALSE,
+};
+
+volatile Home_t Home = {
+    State:    HOME_NONE,
+    Dir:      DIR_NEG,
+    Edge:     FALSE,
+    Edge_Pos: 0,
+    Fast_Vel: DEFAULT_HOME_FAST_VEL,
+    Slow_Vel: DEFAULT_HOME_SLOW_VEL,
+    Backoff:  DEFAULT_HOME_BACKOFF,
+};
+
+volatile Pos_Trig_t Pos_Trig = {
+    Num:   0,
+    Idx:   0,
+    Pin:   0,
+    Mode:  POS_TRIG_OFF,
+    Width: POS_TRIG_WIDTH_MIN,
+    Count: 0,
+};
+
+volatile Ramp_t Ramp = {
+    Accel:   DEFAULT_ACCEL,
+    Vel:     0,
+    Vel_Out: DEFAULT_VEL,
+    Dir_Out: DEFAULT_DIR,
+    Ticks:   0,
 };
 
 // Task Definitions: 
 TASK(USB_Process_Packet);
+TASK(Vel_Ramp);
+TASK(USB_Send_Event);
+TASK(Home_Seq);
+TASK(USB_Send_Capture);
+TASK(Prog_Run);
 
 // Event Handlers:
 HANDLES_EVENT(USB_Connect);
@@ -294,6 +763,13 @@ static int32_t Get_Pos_Err(void);
 static uint16_t Get_Max_Vel(void);
 static uint16_t Get_Min_Vel(void);
 static uint16_t Get_Top(uint16_t Vel);
+static void Calc_Step_Rate(uint16_t Vel, volatile Step_Rate_t *Rate);
+static void Load_Step_Rate(volatile Step_Rate_t *Rate);
+static void Set_Step_Rate(uint16_t Vel);
+static uint8_t Stage_Move(int32_t Pos, uint16_t Pos_Vel);
+static void Set_Step_Mode(uint8_t Step_Mode);
+static uint32_t Get_Eff_Vel(void);
+static void Set_Accel(uint32_t Accel);
 static void Vel_Mode_IO_Update(void);
 static void Pos_Mode_IO_Update(void);
 static void Vel_Trig_Hi(void);
@@ -304,5 +780,38 @@ static void Set_DIO_Hi(uint8_t pin);
 static void Set_DIO_Lo(uint8_t pin);
 static void Set_Ext_Int(uint8_t val);
 static uint8_t Ext_Int_Active(void);
+static void Fire_Trig(uint8_t pin);
+static void Trig_Start(void);
+static uint32_t Get_Clock(void);
+static void Push_Event(uint8_t Event_ID, uint8_t Arg);
+static void Push_Latch(void);
+static uint8_t Get_Latch_Cnt(void);
+static int32_t Pop_Latch(void);
+static uint8_t Set_Capture(uint8_t Mask);
+static uint8_t Read_Capture(uint8_t Num);
+static uint8_t DIO_Mask_To_Port(uint8_t Mask);
+static uint8_t Set_DIO_Port(uint8_t Mask);
+static uint8_t Get_DIO_Port(void);
+static uint8_t Set_DIO_Pat(uint8_t Index, uint32_t Entry);
+static uint8_t Play_DIO_Pat(uint16_t Repeat);
+static void DIO_Pat_Schedule(uint32_t Ticks);
+static uint8_t Set_Prog(uint8_t Index, uint8_t Op, int32_t Arg);
+static uint8_t Run_Prog(uint8_t Run);
+static uint8_t Prog_Step(void);
+static void Prog_Finish(uint8_t State);
+static int32_t Set_Home_Param(uint8_t Param, int32_t Value);
+static uint8_t Start_Home(uint8_t Dir);
+static void Home_Move(int32_t Pos, uint16_t Vel);
+static void Home_Approach(uint16_t Vel);
+static void Home_Finish(uint8_t State);
+static uint8_t Set_Pos_Trig(uint8_t Index, int32_t Pos);
+static uint8_t Set_Pos_Trig_Cfg(uint8_t Pin, uint8_t Mode, uint16_t Width);
+static uint16_t Get_Pos_Trig_Cnt(void);
+static void Pos_Trig_Reset(void);
+static void Pos_Trig_Update(void);
+static uint8_t Config_Check(Config_t *Config);
+static uint8_t Read_Config(Config_t *Config);
+static uint8_t Save_Config(uint8_t Save);
+static uint8_t Load_Config(uint8_t Apply);
 
 #endif // _SIMPLE_STEP_H_